@@ -0,0 +1,97 @@
+//! log entry 编码格式的微基准：比较 JSON（旧格式）与二进制格式的编码大小、写入和读取吞吐
+//!
+//! cargo run --release --example log_codec_bench -- [条目数] [value 字节数]
+
+use std::io;
+use std::time::Instant;
+
+use kv_store::TypeConfig;
+use kv_store::store::Request;
+use kv_store::store::log_store::decode_entry;
+use kv_store::store::log_store::encode_entry;
+use openraft::Entry;
+use openraft::entry::RaftEntry;
+use rocksdb::ColumnFamilyDescriptor;
+use rocksdb::DB;
+use rocksdb::IteratorMode;
+use rocksdb::Options;
+
+type Encode = fn(&Entry<TypeConfig>) -> Result<Vec<u8>, io::Error>;
+
+fn encode_json(entry: &Entry<TypeConfig>) -> Result<Vec<u8>, io::Error> {
+  serde_json::to_vec(entry).map_err(io::Error::other)
+}
+
+fn main() -> Result<(), io::Error> {
+  let mut args = std::env::args().skip(1);
+  let count: u64 = args.next().and_then(|s| s.parse().ok()).unwrap_or(100_000);
+  let value_len: usize = args.next().and_then(|s| s.parse().ok()).unwrap_or(64);
+
+  // 与实际负载相近：单个 Put 和小批量 Batch 交替
+  let entries: Vec<Entry<TypeConfig>> = (1..=count)
+    .map(|i| {
+      let put = |k: u64| Request::Put {
+        key: format!("key-{:08}", k),
+        value: "v".repeat(value_len),
+        expire_at: None,
+      };
+      let req = if i % 4 == 0 {
+        Request::Batch {
+          ops: (0..4).map(|j| put(i * 4 + j)).collect(),
+        }
+      } else {
+        put(i)
+      };
+      Entry::<TypeConfig>::new_normal(openraft::testing::log_id::<TypeConfig>(1, 1, i), req)
+    })
+    .collect();
+
+  println!("{} 条 entry，value {} 字节", count, value_len);
+  for (name, encode) in [("json", encode_json as Encode), ("binary", encode_entry as Encode)] {
+    bench(name, encode, &entries)?;
+  }
+  Ok(())
+}
+
+fn bench(name: &str, encode: Encode, entries: &[Entry<TypeConfig>]) -> Result<(), io::Error> {
+  let dir = tempfile::tempdir()?;
+  let mut db_opts = Options::default();
+  db_opts.create_missing_column_families(true);
+  db_opts.create_if_missing(true);
+  let logs = ColumnFamilyDescriptor::new("logs", Options::default());
+  let db = DB::open_cf_descriptors(&db_opts, dir.path(), vec![logs]).map_err(io::Error::other)?;
+  let cf = db.cf_handle("logs").unwrap();
+
+  // 写入：与 RocksLogStore::append 相同，逐条编码后写入 logs 列族
+  let start = Instant::now();
+  let mut bytes = 0;
+  for entry in entries {
+    let buf = encode(entry)?;
+    bytes += buf.len();
+    db.put_cf(cf, entry.log_id.index.to_be_bytes(), buf)
+      .map_err(io::Error::other)?;
+  }
+  db.flush_wal(true).map_err(io::Error::other)?;
+  let append = start.elapsed();
+
+  // 读取：与 try_get_log_entries 相同，顺序迭代并解码
+  let start = Instant::now();
+  let mut read = 0;
+  for item in db.iterator_cf(cf, IteratorMode::Start) {
+    let (_, val) = item.map_err(io::Error::other)?;
+    let _entry: Entry<TypeConfig> = decode_entry(&val)?;
+    read += 1;
+  }
+  let scan = start.elapsed();
+  assert_eq!(read, entries.len());
+
+  let n = entries.len() as f64;
+  println!(
+    "{:>6}: 平均 {:>6.1} 字节/条，append {:>10.0} 条/s，read {:>10.0} 条/s",
+    name,
+    bytes as f64 / n,
+    n / append.as_secs_f64(),
+    n / scan.as_secs_f64(),
+  );
+  Ok(())
+}
@@ -1,16 +1,34 @@
-use std::collections::BTreeMap;
 use std::sync::Arc;
+use std::sync::atomic::AtomicU64;
 
 use openraft::Config;
 use tokio::sync::RwLock;
 
 use crate::NodeId;
+use crate::store::compaction::LogStats;
+use crate::store::kv::KvState;
+use crate::store::mvcc::VersionLog;
+use crate::store::ttl::TtlIndex;
+use crate::store::watch::ChangeFeed;
+use crate::tuning::RaftTuning;
 use crate::typ::Raft;
 
 pub struct App {
   pub id: NodeId,
   pub addr: String,
   pub raft: Raft,
-  pub key_values: Arc<RwLock<BTreeMap<String, String>>>,
+  pub key_values: Arc<RwLock<KvState>>,
+  // 状态机已 apply 的 log index
+  pub applied_index: Arc<AtomicU64>,
+  // 键的过期时间索引
+  pub ttl: Arc<std::sync::RwLock<TtlIndex>>,
+  // 变更事件流
+  pub changes: Arc<ChangeFeed>,
+  // 最近被修改键的旧版本，供按 log index 读取
+  pub versions: Arc<std::sync::RwLock<VersionLog>>,
+  // 快照和 log 压缩统计
+  pub log_stats: Arc<LogStats>,
+  // 启动时的调优参数（config 由它生成）
+  pub tuning: RaftTuning,
   pub config: Arc<Config>,
 }
@@ -1,5 +1,15 @@
+use std::path::PathBuf;
+use std::time::Duration;
+
 use clap::Parser;
+use clap::ValueEnum;
+use kv_store::openraft_network::Transport;
+use kv_store::NodeOptions;
 use kv_store::start_raft_node;
+use kv_store::store::kv::DEFAULT_CACHE_BYTES;
+use kv_store::store::kv::StateBackend;
+use kv_store::store::log_store::WalSync;
+use kv_store::tuning::RaftTuning;
 use tracing_subscriber::EnvFilter;
 
 #[derive(Parser, Clone, Debug)]
@@ -10,6 +20,139 @@ pub struct Opt {
 
   #[clap(long)]
   pub addr: String,
+
+  /// WAL 持久化方式：always（默认）每次 append 都 fsync；group 组提交；relaxed 不等待 fsync（仅用于基准测试）
+  #[clap(long, env = "KV_WAL_SYNC", value_enum, default_value = "always")]
+  pub wal_sync: WalSyncMode,
+
+  /// 组提交时一次 fsync 最多等待的微秒数，0 表示只合并已经排队的 append
+  #[clap(long, env = "KV_WAL_GROUP_DELAY_US", default_value_t = 0)]
+  pub wal_group_delay_us: u64,
+
+  /// 组提交时一次 fsync 最多合并的 append 数
+  #[clap(long, env = "KV_WAL_GROUP_MAX", default_value_t = 256)]
+  pub wal_group_max: usize,
+
+  /// 节点间 RPC 的传输方式：json（默认）与旧版本兼容；binary 二进制编码并压缩大消息；pipeline 在 binary 基础上流水线复制
+  #[clap(long, env = "KV_RAFT_TRANSPORT", value_enum, default_value = "json")]
+  pub raft_transport: TransportMode,
+
+  /// 状态机数据的存放方式：memory 全部在内存中，重启时从快照重建；rocksdb 保存在 RocksDB 中，内存中只有读缓存
+  #[clap(long, env = "KV_STATE_BACKEND", value_enum, default_value = "memory")]
+  pub state_backend: StateBackendMode,
+
+  /// rocksdb 模式下读缓存的最大字节数
+  #[clap(long, env = "KV_STATE_CACHE_BYTES", default_value_t = DEFAULT_CACHE_BYTES)]
+  pub state_cache_bytes: u64,
+
+  /// raft 调优参数文件（JSON，字段同 RaftTuning），下面的参数和环境变量优先于文件
+  #[clap(long, env = "KV_RAFT_CONFIG")]
+  pub raft_config: Option<PathBuf>,
+
+  /// leader 心跳间隔（毫秒），默认 250
+  #[clap(long, env = "KV_HEARTBEAT_INTERVAL")]
+  pub heartbeat_interval: Option<u64>,
+
+  /// 选举超时下限（毫秒），默认 299，须大于心跳间隔
+  #[clap(long, env = "KV_ELECTION_TIMEOUT_MIN")]
+  pub election_timeout_min: Option<u64>,
+
+  /// 选举超时上限（毫秒），默认 300
+  #[clap(long, env = "KV_ELECTION_TIMEOUT_MAX")]
+  pub election_timeout_max: Option<u64>,
+
+  /// 距上次快照新增多少条 log 后生成快照，默认 5000，0 表示不自动生成
+  #[clap(long, env = "KV_SNAPSHOT_LOGS")]
+  pub snapshot_logs_since_last: Option<u64>,
+
+  /// 距上次快照写入多少字节的 log 后生成快照，默认 0，即不按字节数触发
+  #[clap(long, env = "KV_SNAPSHOT_LOG_BYTES")]
+  pub snapshot_log_bytes: Option<u64>,
+
+  /// 快照之后保留的 log 条数，默认 1000
+  #[clap(long, env = "KV_SNAPSHOT_KEEP_LOGS")]
+  pub max_in_snapshot_log_to_keep: Option<u64>,
+
+  /// 每次清理 log 的最少条数，默认 1
+  #[clap(long, env = "KV_PURGE_BATCH")]
+  pub purge_batch_size: Option<u64>,
+
+  /// 一个 append-entries 最多携带的 log 条数，默认 300
+  #[clap(long, env = "KV_MAX_PAYLOAD_ENTRIES")]
+  pub max_payload_entries: Option<u64>,
+}
+
+#[derive(ValueEnum, Clone, Copy, Debug)]
+pub enum TransportMode {
+  Json,
+  Binary,
+  Pipeline,
+}
+
+#[derive(ValueEnum, Clone, Copy, Debug)]
+pub enum StateBackendMode {
+  Memory,
+  Rocksdb,
+}
+
+#[derive(ValueEnum, Clone, Copy, Debug)]
+pub enum WalSyncMode {
+  Always,
+  Group,
+  Relaxed,
+}
+
+impl Opt {
+  fn wal_sync(&self) -> WalSync {
+    match self.wal_sync {
+      WalSyncMode::Always => WalSync::Always,
+      WalSyncMode::Group => WalSync::Group {
+        max_delay: Duration::from_micros(self.wal_group_delay_us),
+        max_batch: self.wal_group_max,
+      },
+      WalSyncMode::Relaxed => WalSync::Relaxed,
+    }
+  }
+
+  fn raft_tuning(&self) -> std::io::Result<RaftTuning> {
+    let mut tuning = match &self.raft_config {
+      Some(path) => RaftTuning::load(path)?,
+      None => RaftTuning::default(),
+    };
+    let overrides = [
+      (self.heartbeat_interval, &mut tuning.heartbeat_interval),
+      (self.election_timeout_min, &mut tuning.election_timeout_min),
+      (self.election_timeout_max, &mut tuning.election_timeout_max),
+      (self.snapshot_logs_since_last, &mut tuning.snapshot_logs_since_last),
+      (self.snapshot_log_bytes, &mut tuning.snapshot_log_bytes),
+      (self.max_in_snapshot_log_to_keep, &mut tuning.max_in_snapshot_log_to_keep),
+      (self.purge_batch_size, &mut tuning.purge_batch_size),
+      (self.max_payload_entries, &mut tuning.max_payload_entries),
+    ];
+    for (value, field) in overrides {
+      if let Some(v) = value {
+        *field = v;
+      }
+    }
+    Ok(tuning)
+  }
+
+  fn state_backend(&self) -> StateBackend {
+    match self.state_backend {
+      StateBackendMode::Memory => StateBackend::Memory,
+      StateBackendMode::Rocksdb => StateBackend::Rocksdb {
+        cache_bytes: self.state_cache_bytes,
+      },
+    }
+  }
+
+  fn transport(&self) -> Transport {
+    match self.raft_transport {
+      TransportMode::Json => Transport::Json,
+      TransportMode::Binary => Transport::Binary,
+      TransportMode::Pipeline => Transport::Pipeline,
+    }
+  }
 }
 
 #[actix_web::main]
@@ -25,5 +168,17 @@ async fn main() -> std::io::Result<()> {
 
   let options = Opt::parse();
 
-  start_raft_node(options.id, format!("{}.db", options.addr), options.addr).await
+  let node_options = NodeOptions {
+    wal_sync: options.wal_sync(),
+    transport: options.transport(),
+    raft: options.raft_tuning()?,
+    state: options.state_backend(),
+  };
+  start_raft_node(
+    options.id,
+    format!("{}.db", options.addr),
+    options.addr,
+    node_options,
+  )
+  .await
 }
@@ -6,6 +6,7 @@ pub mod app; // 集群
 pub mod network; // 集群对外 web api 实现
 pub mod openraft_network; // raft 协议通信网络实现
 pub mod store; // log 和状态机存储；存储相关网络通信实现
+pub mod tuning; // raft 调优参数
 pub mod typ;
 
 use std::path::Path;
@@ -15,15 +16,18 @@ use actix_web::HttpServer;
 use actix_web::middleware;
 use actix_web::middleware::Logger;
 use actix_web::web::Data;
-use openraft::Config;
 
 use crate::app::App;
 use crate::network::api;
 use crate::network::management;
 use crate::network::raft;
+use crate::openraft_network::Transport;
 use crate::store::Request;
 use crate::store::Response;
+use crate::store::kv::StateBackend;
+use crate::store::log_store::WalSync;
 use crate::store::new_storage;
+use crate::tuning::RaftTuning;
 
 pub type NodeId = u64;
 
@@ -31,35 +35,53 @@ openraft::declare_raft_types!(
     pub TypeConfig:
         D = Request,
         R = Response,
+        // 快照以二进制文件保存，按块发送和接收
+        SnapshotData = store::snapshot::SnapshotFile,
 );
 
 pub type LogStore = store::log_store::RocksLogStore<TypeConfig>;
 pub type StateMachineStore = store::StateMachineStore;
 pub type Raft = openraft::Raft<TypeConfig>;
 
+/// 节点的启动参数
+#[derive(Debug, Clone, Default)]
+pub struct NodeOptions {
+  pub wal_sync: WalSync,
+  pub transport: Transport,
+  pub raft: RaftTuning,
+  pub state: StateBackend,
+}
+
 pub async fn start_raft_node<P>(
   node_id: NodeId,
   dir: P,
   addr: String,
+  options: NodeOptions,
 ) -> std::io::Result<()>
 where
   P: AsRef<Path>,
 {
   // 该 raft 节点的配置
-  let config = Config {
-    heartbeat_interval: 250,
-    election_timeout_min: 299,
-    ..Default::default()
-  };
+  let config = options
+    .raft
+    .to_config()
+    .map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidInput, e))?;
 
-  let config = Arc::new(config.validate().unwrap());
+  let config = Arc::new(config);
 
-  let (log_store, state_machine_store) = new_storage(&dir).await;
+  let (log_store, state_machine_store) = new_storage(&dir, options.wal_sync, options.state).await;
 
   let kvs = state_machine_store.data.kvs.clone();
+  let applied_index = state_machine_store.data.applied_index.clone();
+  let ttl = state_machine_store.data.ttl.clone();
+  let changes = state_machine_store.data.changes.clone();
+  let versions = state_machine_store.data.versions.clone();
+  let log_stats = state_machine_store.log_stats.clone();
 
   // openraft network
-  let network = openraft_network::NetworkFactory {};
+  let network = openraft_network::NetworkFactory {
+    transport: options.transport,
+  };
 
   // 创建 Raft 节点
   let raft = openraft::Raft::new(
@@ -72,11 +94,26 @@ where
   .await
   .unwrap();
 
+  // leader 定期删除到期的键
+  tokio::spawn(store::ttl::run_expirer(raft.clone(), node_id, ttl.clone()));
+  // log 写入量超过阈值时提前生成快照
+  tokio::spawn(store::compaction::run_snapshot_trigger(
+    raft.clone(),
+    log_stats.clone(),
+    options.raft.snapshot_log_bytes,
+  ));
+
   let app_data = Data::new(App {
     id: node_id,
     addr: addr.clone(),
     raft,
     key_values: kvs,
+    applied_index,
+    ttl,
+    changes,
+    versions,
+    log_stats,
+    tuning: options.raft,
     config,
   });
 
@@ -91,6 +128,10 @@ where
       .service(raft::append)
       .service(raft::snapshot)
       .service(raft::vote)
+      .service(raft::append_bin)
+      .service(raft::append_stream)
+      .service(raft::snapshot_stream)
+      .service(raft::vote_bin)
       // admin API
       .service(management::init)
       .service(management::add_learner)
@@ -100,6 +141,9 @@ where
       .service(api::write)
       .service(api::read)
       .service(api::read_all)
+      .service(api::range)
+      .service(api::read_many)
+      .service(api::watch)
   });
 
   let x = server.bind(addr)?;
@@ -1,37 +1,584 @@
+use std::io;
+use std::ops::Bound;
+use std::sync::Arc;
+use std::sync::atomic::Ordering;
+use std::time::Duration;
+
+use actix_web::HttpResponse;
 use actix_web::Responder;
+use actix_web::error;
 use actix_web::get;
 use actix_web::post;
 use actix_web::web;
+use actix_web::web::Bytes;
 use actix_web::web::Data;
-use openraft::error::Infallible;
+use futures::Stream;
+use openraft::ReadPolicy;
 use openraft::error::decompose::DecomposeResult;
+use serde::Deserialize;
+use serde::Serialize;
+use tokio::sync::RwLock;
 use web::Json;
 
+use crate::NodeId;
 use crate::app::App;
 use crate::store::Request;
+use crate::store::kv::KvState;
+use crate::store::mvcc;
+use crate::store::mvcc::VersionLog;
+use crate::store::mvcc::VersionPin;
+use crate::store::ttl::TtlIndex;
+use crate::store::ttl::now_ms;
+use crate::store::watch::ChangeEvent;
+use crate::store::watch::WatchFilter;
+use crate::typ::*;
+
+// 流式读取时每次持有读锁序列化的最大条目数，读锁在两次分块之间释放，不会长时间阻塞 apply
+const SCAN_CHUNK: usize = 1024;
+
+// 读己之写时等待本节点追上 min_index 的最长时间，超时后由调用方改读其他节点
+const MIN_INDEX_WAIT: Duration = Duration::from_millis(100);
+
+// 订阅长轮询的最长等待时间和一次返回的最大事件数
+const WATCH_MAX_WAIT_MS: u64 = 30_000;
+const WATCH_MAX_EVENTS: usize = 1024;
+
+/// 写入结果：提交该写入的 log index、处理请求的节点和操作结果
+#[derive(Serialize, Debug)]
+pub struct WriteResult {
+  pub index: u64,
+  pub node: NodeId,
+  // Put 为原值，Del 为被删除的值，键原本不存在时为 null
+  pub value: Option<String>,
+  // Batch 中每个操作的结果，与 ops 一一对应
+  #[serde(skip_serializing_if = "Vec::is_empty")]
+  pub results: Vec<Option<String>>,
+}
 
 #[post("/write")]
 pub async fn write(app: Data<App>, req: Json<Request>) -> actix_web::Result<impl Responder> {
-  // let _response = app.raft.client_write(req.0).await.decompose().unwrap();
   let response = app.raft.client_write(req.0).await.decompose().unwrap();
-  match response {
-      Ok(_) => Ok(Json("Ok")),
-      Err(_) => Ok(Json("Err")),
-  }
+  // 成功返回 {"Ok": WriteResult}，失败返回 {"Err": ...}（非 leader 时为 ForwardToLeader）
+  let res: Result<WriteResult, ClientWriteError> = response.map(|resp| WriteResult {
+    index: resp.log_id.index(),
+    node: app.id,
+    value: resp.data.value,
+    results: resp.data.results,
+  });
+  Ok(Json(res))
+}
+
+/// 读一致性级别
+#[derive(Deserialize, Debug, Clone, Copy, Default, PartialEq, Eq)]
+#[serde(rename_all = "lowercase")]
+pub enum Consistency {
+  // 直接读本地状态机，可能读到旧值
+  #[default]
+  Local,
+  // leader 在租约内直接读，不需要网络往返
+  Lease,
+  // ReadIndex：leader 与多数派确认领导权后再读
+  Linearizable,
+}
+
+/// 读请求：兼容直接发送字符串 key，或 {"key": k, "consistency": "local|lease|linearizable", "min_index": n, "at": n}
+#[derive(Deserialize, Debug)]
+#[serde(untagged)]
+pub enum ReadRequest {
+  Key(String),
+  Options {
+    key: String,
+    #[serde(default)]
+    consistency: Consistency,
+    // 读己之写：要求本节点已 apply 到该 log index
+    #[serde(default)]
+    min_index: Option<u64>,
+    // 读取 log index 为 at 时的值
+    #[serde(default)]
+    at: Option<u64>,
+  },
+}
+
+/// 读取结果：值（不存在为 null）、读取时状态机已 apply 的 log index 和处理请求的节点
+#[derive(Serialize, Debug)]
+pub struct ReadResult {
+  pub value: Option<String>,
+  pub index: u64,
+  pub node: NodeId,
 }
 
 #[post("/read")]
-pub async fn read(app: Data<App>, req: Json<String>) -> actix_web::Result<impl Responder> {
-  let key = req.0;
-  let kvs = app.key_values.read().await;
-  let value = kvs.get(&key);
+pub async fn read(app: Data<App>, req: Json<ReadRequest>) -> actix_web::Result<impl Responder> {
+  let (key, consistency, min_index, at) = match req.0 {
+    // 直接发送字符串 key 时保持原来的返回格式 {"Ok": value}，不存在的键为 ""
+    ReadRequest::Key(key) => {
+      let kvs = app.key_values.read().await;
+      let ttl = app.ttl.read().unwrap();
+      let value =
+        live_value(&kvs, &ttl, &key, now_ms()).map_err(error::ErrorInternalServerError)?;
+      let res: Result<String, LinearizableReadError> = Ok(value.unwrap_or_default());
+      return Ok(Json(serde_json::to_value(res)?));
+    }
+    ReadRequest::Options {
+      key,
+      consistency,
+      min_index,
+      at,
+    } => (key, consistency, min_index, at),
+  };
+
+  // 按时间点读取时同样要求本节点已 apply 到 at
+  let res: Result<ReadResult, serde_json::Value> =
+    match ensure_readable(&app, consistency, min_index.max(at)).await {
+      Ok(()) => {
+        let kvs = app.key_values.read().await;
+        match at {
+          Some(at) => {
+            let versions = app.versions.read().unwrap();
+            if at < versions.floor() {
+              Err(compacted(versions.floor()))
+            } else {
+              // 历史值不按当前时间过滤 TTL，at 之后才 apply 的 Expire 不影响结果
+              Ok(ReadResult {
+                value: versions
+                  .value_at(&kvs, &key, at)
+                  .map_err(error::ErrorInternalServerError)?,
+                index: at,
+                node: app.id,
+              })
+            }
+          }
+          None => {
+            let ttl = app.ttl.read().unwrap();
+            Ok(ReadResult {
+              value: live_value(&kvs, &ttl, &key, now_ms())
+                .map_err(error::ErrorInternalServerError)?,
+              index: app.applied_index.load(Ordering::Acquire),
+              node: app.id,
+            })
+          }
+        }
+      }
+      Err(e) => Err(e),
+    };
+  Ok(Json(serde_json::to_value(res)?))
+}
+
+/// 批量读请求：直接发送 key 列表，或 {"keys": [...], "consistency": ..., "min_index": n}
+#[derive(Deserialize, Debug)]
+#[serde(untagged)]
+pub enum ReadManyRequest {
+  Keys(Vec<String>),
+  Options {
+    keys: Vec<String>,
+    #[serde(default)]
+    consistency: Consistency,
+    #[serde(default)]
+    min_index: Option<u64>,
+  },
+}
+
+/// 批量读取结果：与请求顺序一致的值列表，以及 index/node（含义同 ReadResult）
+#[derive(Serialize, Debug)]
+pub struct ReadManyResult {
+  pub values: Vec<Option<String>>,
+  pub index: u64,
+  pub node: NodeId,
+}
+
+#[post("/read-many")]
+pub async fn read_many(
+  app: Data<App>,
+  req: Json<ReadManyRequest>,
+) -> actix_web::Result<impl Responder> {
+  let (keys, consistency, min_index, structured) = match req.0 {
+    ReadManyRequest::Keys(keys) => (keys, Consistency::Local, None, false),
+    ReadManyRequest::Options {
+      keys,
+      consistency,
+      min_index,
+    } => (keys, consistency, min_index, true),
+  };
+
+  if let Err(e) = ensure_readable(&app, consistency, min_index).await {
+    let res: Result<ReadManyResult, serde_json::Value> = Err(e);
+    return Ok(Json(serde_json::to_value(res)?));
+  }
+
+  // 所有 key 只获取一次读锁，按请求顺序返回，不存在的 key 为 null
+  let (values, index) = {
+    let kvs = app.key_values.read().await;
+    let ttl = app.ttl.read().unwrap();
+    let now = now_ms();
+    let values: Vec<Option<String>> = keys
+      .iter()
+      .map(|k| live_value(&kvs, &ttl, k, now))
+      .collect::<io::Result<_>>()
+      .map_err(error::ErrorInternalServerError)?;
+    (values, app.applied_index.load(Ordering::Acquire))
+  };
+
+  if !structured {
+    let res: Result<Vec<Option<String>>, serde_json::Value> = Ok(values);
+    return Ok(Json(serde_json::to_value(res)?));
+  }
+  let res: Result<ReadManyResult, serde_json::Value> = Ok(ReadManyResult {
+    values,
+    index,
+    node: app.id,
+  });
+  Ok(Json(serde_json::to_value(res)?))
+}
+
+// 已到期但删除尚未 apply 的键视为不存在；rocksdb 模式下读磁盘失败时返回错误，请求以 500 结束
+fn live_value(kvs: &KvState, ttl: &TtlIndex, key: &str, now: u64) -> io::Result<Option<String>> {
+  if ttl.is_expired(key, now) {
+    return Ok(None);
+  }
+  kvs.get(key)
+}
+
+// 时间点早于保留的最早版本
+fn compacted(floor: u64) -> serde_json::Value {
+  serde_json::json!({ "Compacted": { "floor": floor } })
+}
+
+// 读之前的检查，失败时返回 {"Err": ...} 中的内容：
+// 1. 按一致性级别确认领导权，并等待状态机 apply 到 read_log_id；非 leader 返回 ForwardToLeader
+// 2. 指定 min_index 时最多等待 MIN_INDEX_WAIT 让本节点 apply 到该位置，仍落后则返回 Lagging，由调用方换节点
+async fn ensure_readable(
+  app: &App,
+  consistency: Consistency,
+  min_index: Option<u64>,
+) -> Result<(), serde_json::Value> {
+  let policy = match consistency {
+    Consistency::Local => None,
+    Consistency::Lease => Some(ReadPolicy::LeaseRead),
+    Consistency::Linearizable => Some(ReadPolicy::ReadIndex),
+  };
+  if let Some(policy) = policy {
+    let ret = app.raft.ensure_linearizable(policy).await.decompose().unwrap();
+    if let Err(e) = ret {
+      return Err(serde_json::to_value(e).unwrap());
+    }
+  }
+
+  let Some(min_index) = min_index else {
+    return Ok(());
+  };
+  if app.applied_index.load(Ordering::Acquire) < min_index {
+    // metrics 中的 last_applied 在 apply 之后更新，等待结束后以 applied_index 为准
+    let _ = app
+      .raft
+      .wait(Some(MIN_INDEX_WAIT))
+      .applied_index_at_least(Some(min_index), "read-your-writes")
+      .await;
+  }
+  let applied = app.applied_index.load(Ordering::Acquire);
+  if applied < min_index {
+    return Err(serde_json::json!({ "Lagging": { "applied": applied, "required": min_index } }));
+  }
+  Ok(())
+}
+
+/// 订阅请求：key 为单个键，prefix 为键前缀（都缺省时订阅所有键）；
+/// 返回 index 大于 after 的变更（after 缺省时从当前位置开始），没有时最多等待 timeout_ms
+#[derive(Deserialize, Debug)]
+pub struct WatchRequest {
+  pub key: Option<String>,
+  pub prefix: Option<String>,
+  pub after: Option<u64>,
+  pub timeout_ms: Option<u64>,
+}
+
+/// 订阅结果：变更事件，以及下次订阅应使用的 after
+#[derive(Serialize, Debug)]
+pub struct WatchResult {
+  pub events: Vec<ChangeEvent>,
+  pub index: u64,
+}
+
+#[post("/watch")]
+pub async fn watch(app: Data<App>, req: Json<WatchRequest>) -> actix_web::Result<impl Responder> {
+  // 长轮询：有匹配的变更立即返回，否则等待新的变更或超时
+  let WatchRequest {
+    key,
+    prefix,
+    after,
+    timeout_ms,
+  } = req.0;
+  let filter = match key {
+    Some(key) => WatchFilter::Key(key),
+    None => WatchFilter::Prefix(prefix.unwrap_or_default()),
+  };
+  let timeout = Duration::from_millis(timeout_ms.unwrap_or(WATCH_MAX_WAIT_MS).min(WATCH_MAX_WAIT_MS));
+  let deadline = tokio::time::Instant::now() + timeout;
 
-  let res: Result<String, Infallible> = Ok(value.cloned().unwrap_or_default());
+  // 先订阅再检查历史，避免检查之后、等待之前发布的变更被错过
+  let mut latest = app.changes.subscribe();
+  let mut after = after.unwrap_or_else(|| app.changes.latest_index());
+  let res: Result<WatchResult, serde_json::Value> = loop {
+    match app.changes.since(after, &filter, WATCH_MAX_EVENTS) {
+      Err(floor) => {
+        // 订阅位置之后的事件已被丢弃，调用方需要重新读取数据后从 floor 继续
+        break Err(compacted(floor));
+      }
+      Ok((events, next)) => {
+        after = next;
+        if !events.is_empty() {
+          break Ok(WatchResult { events, index: next });
+        }
+      }
+    }
+    match tokio::time::timeout_at(deadline, latest.changed()).await {
+      Ok(Ok(())) => continue,
+      // 超时（或事件流关闭）时返回空结果，调用方从 index 继续订阅
+      _ => break Ok(WatchResult {
+        events: Vec::new(),
+        index: after,
+      }),
+    }
+  };
   Ok(Json(res))
 }
 
 #[get("/read-all")]
 pub async fn read_all(app: Data<App>) -> actix_web::Result<impl Responder> {
-  let kvs = app.key_values.read().await;
-  Ok(Json(kvs.clone()))
+  // 分块直接从 map 序列化为 JSON 对象 {"k1":"v1",...}，不复制整个 map；
+  // 导出的是开始时已 apply 的位置的快照，期间的写入不影响结果
+  let pin = match pin_current(&app) {
+    Ok(pin) => pin,
+    Err(e) => return Ok(HttpResponse::Ok().json(Err::<(), _>(e))),
+  };
+  let stream = scan_stream(
+    &app,
+    pin,
+    true,
+    Bound::Unbounded,
+    None,
+    usize::MAX,
+    ScanFormat::JsonObject,
+  );
+  Ok(
+    HttpResponse::Ok()
+      .content_type("application/json")
+      .streaming(stream),
+  )
+}
+
+/// 范围读取请求，[start, end) 区间内最多 limit 个键值对；字段缺省表示不限制。
+/// at 为读取的 log index，缺省时为开始扫描时已 apply 的位置
+#[derive(Deserialize, Debug)]
+pub struct RangeRequest {
+  pub start: Option<String>,
+  pub end: Option<String>,
+  pub limit: Option<usize>,
+  pub at: Option<u64>,
+}
+
+#[post("/range")]
+pub async fn range(app: Data<App>, req: Json<RangeRequest>) -> actix_web::Result<impl Responder> {
+  // 以 NDJSON 流式返回，每行一个 {"k":k,"v":v}；出错时只有一行 {"Err": ...}
+  let RangeRequest {
+    start,
+    end,
+    limit,
+    at,
+  } = req.0;
+  let pin = match at {
+    Some(at) => match ensure_readable(&app, Consistency::Local, Some(at)).await {
+      Ok(()) => mvcc::pin(&app.versions, at).map_err(compacted),
+      Err(e) => Err(e),
+    },
+    None => pin_current(&app),
+  };
+  let pin = match pin {
+    Ok(pin) => pin,
+    Err(e) => return Ok(HttpResponse::Ok().json(Err::<(), _>(e))),
+  };
+  let empty = matches!((&start, &end), (Some(s), Some(e)) if s >= e);
+  let start = match start {
+    Some(s) => Bound::Included(s),
+    None => Bound::Unbounded,
+  };
+  let limit = if empty { 0 } else { limit.unwrap_or(usize::MAX) };
+  let stream = scan_stream(
+    &app,
+    pin,
+    at.is_none(),
+    start,
+    end,
+    limit,
+    ScanFormat::Ndjson,
+  );
+  Ok(
+    HttpResponse::Ok()
+      .content_type("application/x-ndjson")
+      .streaming(stream),
+  )
+}
+
+// 固定当前已 apply 的位置作为扫描的读取点
+fn pin_current(app: &App) -> Result<VersionPin, serde_json::Value> {
+  let applied = app.applied_index.load(Ordering::Acquire);
+  mvcc::pin(&app.versions, applied).map_err(compacted)
+}
+
+#[derive(Clone, Copy)]
+enum ScanFormat {
+  // 整体是一个 JSON 对象
+  JsonObject,
+  // 每行一个 {"k":k,"v":v}
+  Ndjson,
+}
+
+struct ScanState {
+  kvs: Arc<RwLock<KvState>>,
+  ttl: Arc<std::sync::RwLock<TtlIndex>>,
+  versions: Arc<std::sync::RwLock<VersionLog>>,
+  // 读取点，扫描结束（或客户端断开）时随 state 释放
+  pin: VersionPin,
+  // 按当前时间过滤已到期的键，只用于不指定时间点的扫描
+  live: bool,
+  next: Bound<String>,
+  end: Option<String>,
+  remaining: usize,
+  format: ScanFormat,
+  started: bool,
+  done: bool,
+}
+
+// 按键顺序分块扫描读取点的 [next, end)，每块只在序列化期间持有读锁；
+// 块之间 apply 的写入由 VersionLog 中的旧值还原，整个扫描看到的是同一个时间点
+fn scan_stream(
+  app: &App,
+  pin: VersionPin,
+  live: bool,
+  start: Bound<String>,
+  end: Option<String>,
+  limit: usize,
+  format: ScanFormat,
+) -> impl Stream<Item = Result<Bytes, io::Error>> + 'static {
+  let state = ScanState {
+    kvs: app.key_values.clone(),
+    ttl: app.ttl.clone(),
+    versions: app.versions.clone(),
+    pin,
+    live,
+    next: start,
+    end,
+    remaining: limit,
+    format,
+    started: false,
+    done: false,
+  };
+
+  futures::stream::unfold(state, |mut state| async move {
+    if state.done {
+      return None;
+    }
+
+    let mut buf = Vec::new();
+    if !state.started {
+      if let ScanFormat::JsonObject = state.format {
+        buf.push(b'{');
+      }
+    }
+
+    let mut count = 0;
+    let mut last = None;
+    let mut failed = None;
+    {
+      let kvs = state.kvs.read().await;
+      let ttl = state.ttl.read().unwrap();
+      let versions = state.versions.read().unwrap();
+      // 固定超过 PIN_MAX_AGE（客户端读取过慢）或安装了快照时，读取点之后的旧版本可能已被回收，中止这次扫描：
+      // NDJSON 以一行 Compacted 错误结束，JSON 对象无法表示错误，直接断开
+      let floor = versions.floor();
+      if floor > state.pin.at() {
+        drop(versions);
+        drop(ttl);
+        drop(kvs);
+        state.done = true;
+        let item = match state.format {
+          ScanFormat::Ndjson => {
+            let mut line = serde_json::to_vec(&Err::<(), _>(compacted(floor))).unwrap();
+            line.push(b'\n');
+            Ok(Bytes::from(line))
+          }
+          ScanFormat::JsonObject => Err(io::Error::other("scan read point was compacted")),
+        };
+        return Some((item, state));
+      }
+      let now = now_ms();
+      let lower = match &state.next {
+        Bound::Included(k) => Bound::Included(k.as_str()),
+        Bound::Excluded(k) => Bound::Excluded(k.as_str()),
+        Bound::Unbounded => Bound::Unbounded,
+      };
+      let upper = match &state.end {
+        Some(e) => Bound::Excluded(e.as_str()),
+        None => Bound::Unbounded,
+      };
+
+      if state.remaining > 0 {
+        for item in versions.range_at(&kvs, lower, upper, state.pin.at()) {
+          let (k, v) = match item {
+            Ok(kv) => kv,
+            Err(e) => {
+              failed = Some(e);
+              break;
+            }
+          };
+          if state.live && ttl.is_expired(&k, now) {
+            continue;
+          }
+          match state.format {
+            ScanFormat::JsonObject => {
+              if state.started || count > 0 {
+                buf.push(b',');
+              }
+              serde_json::to_writer(&mut buf, &k).unwrap();
+              buf.push(b':');
+              serde_json::to_writer(&mut buf, &v).unwrap();
+            }
+            ScanFormat::Ndjson => {
+              buf.extend_from_slice(b"{\"k\":");
+              serde_json::to_writer(&mut buf, &k).unwrap();
+              buf.extend_from_slice(b",\"v\":");
+              serde_json::to_writer(&mut buf, &v).unwrap();
+              buf.extend_from_slice(b"}\n");
+            }
+          }
+          count += 1;
+          state.remaining -= 1;
+          if count == SCAN_CHUNK || state.remaining == 0 {
+            last = Some(k.into_owned());
+            break;
+          }
+        }
+      }
+    }
+
+    // 读取状态机失败：中断响应，客户端收到的是不完整的流而不是看似完整的结果
+    if let Some(e) = failed {
+      tracing::error!("failed to scan state machine: {}", e);
+      state.done = true;
+      return Some((Err(e), state));
+    }
+
+    state.started = true;
+    match last {
+      // 本块已满，下次从该键之后继续
+      Some(k) if state.remaining > 0 => state.next = Bound::Excluded(k),
+      _ => {
+        state.done = true;
+        if let ScanFormat::JsonObject = state.format {
+          buf.push(b'}');
+        }
+      }
+    }
+
+    Some((Ok(Bytes::from(buf)), state))
+  })
 }
@@ -1,50 +1,200 @@
 use std::collections::BTreeMap;
 use std::collections::BTreeSet;
+use std::time::Duration;
 
+use actix_web::HttpResponse;
 use actix_web::Responder;
+use actix_web::error;
 use actix_web::get;
 use actix_web::post;
 use actix_web::web::Data;
 use actix_web::web::Json;
+use actix_web::web::Query;
 use openraft::BasicNode;
-use openraft::error::Infallible;
+use openraft::Config;
 use openraft::error::decompose::DecomposeResult;
+use serde::Deserialize;
+use serde::Serialize;
 
 use crate::NodeId;
 use crate::app::App;
+use crate::store::compaction::CompactionMetrics;
+use crate::store::kv::StateMetrics;
 use crate::typ::*;
 
+// 为新 learner 生成快照的最长等待时间
+const SEED_SNAPSHOT_TIMEOUT: Duration = Duration::from_secs(60);
+
 // --- Cluster management
 
+#[derive(Debug, Deserialize)]
+pub struct AddLearnerParams {
+  /// 先在 leader 上生成快照，新节点从快照开始追赶
+  #[serde(default)]
+  pub seed: bool,
+  /// 等待新节点追上 leader 后再返回；为 false 时立即返回，追赶进度见 /metrics 的 catch_up
+  #[serde(default = "default_blocking")]
+  pub blocking: bool,
+}
+
+fn default_blocking() -> bool {
+  true
+}
+
 #[post("/add-learner")]
 pub async fn add_learner(
   app: Data<App>,
   req: Json<(NodeId, String)>,
+  params: Query<AddLearnerParams>,
 ) -> actix_web::Result<impl Responder> {
   let (node_id, api_addr) = req.0;
+  if params.seed {
+    seed_snapshot(&app).await?;
+  }
   let node = Node { addr: api_addr };
   let res = app
     .raft
-    .add_learner(node_id, node, true)
+    .add_learner(node_id, node, params.blocking)
     .await
     .decompose()
     .unwrap();
   Ok(Json(res))
 }
 
+/// 在 leader 上为新 learner 准备快照：生成包含当前已 apply 数据的快照，并清理快照之前、其他节点都已复制的 log。
+/// 新节点缺少的 log 已被清理，leader 会先发送流式二进制快照，新节点只需重放快照之后的 log
+async fn seed_snapshot(app: &App) -> actix_web::Result<()> {
+  let metrics = app.raft.metrics().borrow().clone();
+  // 不是 leader 时由随后的 add_learner 返回 ForwardToLeader
+  if metrics.current_leader != Some(app.id) {
+    return Ok(());
+  }
+  let Some(applied) = metrics.last_applied.map(|id| id.index()) else {
+    return Ok(());
+  };
+
+  if metrics.snapshot.map(|id| id.index()) < Some(applied) {
+    app
+      .raft
+      .trigger()
+      .snapshot()
+      .await
+      .map_err(error::ErrorInternalServerError)?;
+    app
+      .raft
+      .wait(Some(SEED_SNAPSHOT_TIMEOUT))
+      .metrics(
+        |m| m.snapshot.map(|id| id.index()) >= Some(applied),
+        "snapshot for new learner",
+      )
+      .await
+      .map_err(error::ErrorInternalServerError)?;
+  }
+
+  // 只清理其他节点都已复制的 log，避免它们也因此需要安装快照
+  let matched = metrics
+    .replication
+    .iter()
+    .flatten()
+    .filter(|(id, _)| **id != app.id)
+    .map(|(_, matched)| matched.as_ref().map(|id| id.index()).unwrap_or(0))
+    .min();
+  let upto = matched.map_or(applied, |m| m.min(applied));
+  app
+    .raft
+    .trigger()
+    .purge_log(upto)
+    .await
+    .map_err(error::ErrorInternalServerError)?;
+  Ok(())
+}
+
+/// learner 的复制进度（只在 leader 上可知）
+#[derive(Debug, Clone, Serialize)]
+pub struct LearnerProgress {
+  /// 已复制到的 log index，尚未复制任何 log 时为 None
+  pub matched: Option<u64>,
+  /// 落后 leader 最后一条 log 的条数
+  pub lag: u64,
+}
+
+fn learner_progress(metrics: &RaftMetrics) -> Option<BTreeMap<NodeId, LearnerProgress>> {
+  let replication = metrics.replication.as_ref()?;
+  let last = metrics.last_log_index.unwrap_or(0);
+  let learners = metrics
+    .membership_config
+    .membership()
+    .learner_ids()
+    .map(|id| {
+      let matched = replication
+        .get(&id)
+        .and_then(|m| m.as_ref())
+        .map(|log_id| log_id.index());
+      let lag = last.saturating_sub(matched.unwrap_or(0));
+      (id, LearnerProgress { matched, lag })
+    })
+    .collect();
+  Some(learners)
+}
+
+#[derive(Debug, Deserialize)]
+pub struct ChangeMembershipParams {
+  /// 要提升为投票成员的 learner 最多落后的 log 条数，缺省时不检查
+  pub max_lag: Option<u64>,
+}
+
+/// 提升 learner 前的检查未通过，不修改成员关系
+#[derive(Debug, Serialize)]
+pub enum MembershipGateError {
+  // 只有 leader 知道各 learner 的复制进度
+  NotLeader { leader: Option<NodeId> },
+  LearnerLagging { node_id: NodeId, lag: u64, max_lag: u64 },
+}
+
+fn check_learner_lag(
+  metrics: &RaftMetrics,
+  voters: &BTreeSet<NodeId>,
+  max_lag: u64,
+) -> Result<(), MembershipGateError> {
+  let Some(progress) = learner_progress(metrics) else {
+    return Err(MembershipGateError::NotLeader {
+      leader: metrics.current_leader,
+    });
+  };
+  for id in voters {
+    if let Some(p) = progress.get(id) {
+      if p.lag > max_lag {
+        return Err(MembershipGateError::LearnerLagging {
+          node_id: *id,
+          lag: p.lag,
+          max_lag,
+        });
+      }
+    }
+  }
+  Ok(())
+}
+
 #[post("/change-membership")]
 pub async fn change_membership(
   app: Data<App>,
   req: Json<BTreeSet<NodeId>>,
-) -> actix_web::Result<impl Responder> {
+  params: Query<ChangeMembershipParams>,
+) -> actix_web::Result<HttpResponse> {
   let body = req.0;
+  if let Some(max_lag) = params.max_lag {
+    let metrics = app.raft.metrics().borrow().clone();
+    if let Err(e) = check_learner_lag(&metrics, &body, max_lag) {
+      return Ok(HttpResponse::Ok().json(Err::<(), _>(e)));
+    }
+  }
   let res = app
     .raft
     .change_membership(body, false)
     .await
     .decompose()
     .unwrap();
-  Ok(Json(res))
+  Ok(HttpResponse::Ok().json(res))
 }
 
 #[post("/init")]
@@ -69,10 +219,35 @@ pub async fn init(
   Ok(Json(res))
 }
 
+/// /metrics 的响应：`Ok` 与此前的 `Result<RaftMetrics, _>` 格式相同，config 为生效的 raft 配置，
+/// compaction 为快照和 log 压缩统计，catch_up 为各 learner 的追赶进度（只在 leader 上有值）
+#[derive(Serialize)]
+pub struct MetricsResponse {
+  #[serde(rename = "Ok")]
+  pub metrics: RaftMetrics,
+  pub config: Config,
+  pub compaction: CompactionMetrics,
+  pub state: StateMetrics,
+  pub catch_up: Option<BTreeMap<NodeId, LearnerProgress>>,
+}
+
 #[get("/metrics")]
 pub async fn metrics(app: Data<App>) -> actix_web::Result<impl Responder> {
   let metrics = app.raft.metrics().borrow().clone();
 
-  let res: Result<RaftMetrics, Infallible> = Ok(metrics);
-  Ok(Json(res))
+  let last_log = metrics.last_log_index.unwrap_or(0);
+  let snapshot = metrics.snapshot.map(|id| id.index()).unwrap_or(0);
+  let compaction = app
+    .log_stats
+    .metrics(last_log.saturating_sub(snapshot), app.tuning.snapshot_log_bytes);
+  let catch_up = learner_progress(&metrics);
+  let state = app.key_values.read().await.metrics();
+
+  Ok(Json(MetricsResponse {
+    metrics,
+    config: app.config.as_ref().clone(),
+    compaction,
+    state,
+    catch_up,
+  }))
 }
@@ -1,10 +1,20 @@
+use actix_web::HttpResponse;
 use actix_web::Responder;
+use actix_web::error;
 use actix_web::post;
+use actix_web::web;
+use actix_web::web::Bytes;
 use actix_web::web::Data;
 use actix_web::web::Json;
+use futures::StreamExt;
+use futures::channel::mpsc;
 use openraft::error::decompose::DecomposeResult;
+use serde::Serialize;
+use tokio::io::AsyncWriteExt;
 
 use crate::app::App;
+use crate::openraft_network::codec;
+use crate::openraft_network::codec::FrameReader;
 use crate::typ::*;
 
 // --- Raft 内部 RPC 通信
@@ -32,3 +42,104 @@ pub async fn snapshot(
   let res = app.raft.install_snapshot(req.0).await.decompose().unwrap();
   Ok(Json(res))
 }
+
+// --- 二进制传输：请求和响应为 openraft_network::codec 定义的帧
+
+#[post("/vote-bin")]
+pub async fn vote_bin(app: Data<App>, body: web::Payload) -> actix_web::Result<HttpResponse> {
+  let req: VoteRequest = codec::decode_frame(&read_body(body).await?)?;
+  let res = app.raft.vote(req).await.decompose().unwrap();
+  frame_response(&res)
+}
+
+#[post("/append-bin")]
+pub async fn append_bin(app: Data<App>, body: web::Payload) -> actix_web::Result<HttpResponse> {
+  let req: AppendEntriesRequest = codec::decode_frame(&read_body(body).await?)?;
+  let res = app.raft.append_entries(req).await.decompose().unwrap();
+  frame_response(&res)
+}
+
+#[post("/append-stream")]
+pub async fn append_stream(app: Data<App>, mut body: web::Payload) -> actix_web::Result<HttpResponse> {
+  // 流水线复制：请求体中的每帧在到达时立即交给 raft，不等待前一个处理完成，结果按顺序写回响应体。
+  // Payload 只能在当前线程读取，由本地任务解码后转发给 raft
+  let (tx, rx) = mpsc::unbounded::<AppendEntriesRequest>();
+  actix_web::rt::spawn(async move {
+    let mut frames = FrameReader::default();
+    while let Some(Ok(chunk)) = body.next().await {
+      frames.push(&chunk);
+      loop {
+        let req = match frames.next_frame() {
+          Ok(Some(frame)) => codec::decode(&frame),
+          Ok(None) => break,
+          Err(e) => Err(e),
+        };
+        // 数据损坏时结束输入，已提交的请求仍会返回结果
+        let Ok(req) = req else {
+          return;
+        };
+        if tx.unbounded_send(req).is_err() {
+          return;
+        }
+      }
+    }
+  });
+
+  let results = app.raft.stream_append(rx).map(|res| codec::encode_frame(&res).map(Bytes::from));
+  Ok(
+    HttpResponse::Ok()
+      .content_type(codec::CONTENT_TYPE)
+      .streaming(results),
+  )
+}
+
+#[post("/snapshot-stream")]
+pub async fn snapshot_stream(app: Data<App>, mut body: web::Payload) -> actix_web::Result<HttpResponse> {
+  // 第一帧为 (vote, meta)，之后每帧为快照文件的一段，边收边写入接收文件，全部收到后安装
+  let mut file = app
+    .raft
+    .begin_receiving_snapshot()
+    .await
+    .map_err(error::ErrorInternalServerError)?;
+  let mut frames = FrameReader::default();
+  let mut header: Option<(Vote, SnapshotMeta)> = None;
+  while let Some(chunk) = body.next().await {
+    frames.push(&chunk?);
+    while let Some(frame) = frames.next_frame()? {
+      match header {
+        None => header = Some(codec::decode(&frame)?),
+        Some(_) => file.write_all(&frame).await?,
+      }
+    }
+  }
+  let (Some((vote, meta)), true) = (header, frames.is_empty()) else {
+    return Err(error::ErrorBadRequest("truncated snapshot stream"));
+  };
+  file.flush().await?;
+
+  let res = app
+    .raft
+    .install_full_snapshot(vote, Snapshot {
+      meta,
+      snapshot: file,
+    })
+    .await;
+  frame_response(&res)
+}
+
+async fn read_body(mut body: web::Payload) -> actix_web::Result<Vec<u8>> {
+  // raft 内部请求，不限制大小
+  let mut buf = Vec::new();
+  while let Some(chunk) = body.next().await {
+    buf.extend_from_slice(&chunk?);
+  }
+  Ok(buf)
+}
+
+fn frame_response<T: Serialize>(res: &T) -> actix_web::Result<HttpResponse> {
+  Ok(
+    HttpResponse::Ok()
+      .content_type(codec::CONTENT_TYPE)
+      .body(codec::encode_frame(res)?),
+  )
+}
@@ -0,0 +1,202 @@
+//! Raft 节点间 RPC 的二进制编码
+//!
+//! 消息用 bincode（变长整数）编码，按帧传输：`[数据长度 u32][标记 u8][数据]`（大端），
+//! 超过 COMPRESS_THRESHOLD 的数据用 zstd 压缩（压缩后确实变小才采用）。
+//! 单次 RPC 的请求体和响应体各是一个帧；流式 RPC 的请求体和响应体是连续的帧。
+
+use std::io;
+
+use bincode::Options;
+use byteorder::BigEndian;
+use byteorder::ByteOrder;
+use byteorder::WriteBytesExt;
+use serde::Serialize;
+use serde::de::DeserializeOwned;
+
+pub const CONTENT_TYPE: &str = "application/x-raft-frames";
+
+const COMPRESS_THRESHOLD: usize = 4096;
+const ZSTD_LEVEL: i32 = 1;
+
+const FLAG_RAW: u8 = 0;
+const FLAG_ZSTD: u8 = 1;
+const HEADER_LEN: usize = 5;
+
+fn codec() -> impl Options {
+  bincode::DefaultOptions::new()
+}
+
+/// 编码一个消息为帧
+pub fn encode_frame<T: Serialize>(msg: &T) -> io::Result<Vec<u8>> {
+  let data = codec()
+    .serialize(msg)
+    .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+  frame(&data)
+}
+
+/// 把一段原始数据（如快照文件的一块）封装为帧
+pub fn frame(data: &[u8]) -> io::Result<Vec<u8>> {
+  if data.len() > COMPRESS_THRESHOLD {
+    let compressed = zstd::bulk::compress(data, ZSTD_LEVEL)?;
+    if compressed.len() < data.len() {
+      return Ok(with_header(FLAG_ZSTD, &compressed));
+    }
+  }
+  Ok(with_header(FLAG_RAW, data))
+}
+
+fn with_header(flag: u8, data: &[u8]) -> Vec<u8> {
+  let mut buf = Vec::with_capacity(HEADER_LEN + data.len());
+  buf.write_u32::<BigEndian>(data.len() as u32).unwrap();
+  buf.push(flag);
+  buf.extend_from_slice(data);
+  buf
+}
+
+pub fn decode<T: DeserializeOwned>(data: &[u8]) -> io::Result<T> {
+  codec()
+    .deserialize(data)
+    .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))
+}
+
+/// 解码只包含一个帧的消息体
+pub fn decode_frame<T: DeserializeOwned>(body: &[u8]) -> io::Result<T> {
+  let mut frames = FrameReader::default();
+  frames.push(body);
+  match frames.next_frame()? {
+    Some(data) if frames.is_empty() => decode(&data),
+    _ => Err(io::Error::new(
+      io::ErrorKind::InvalidData,
+      "malformed raft frame",
+    )),
+  }
+}
+
+/// 从按块到达的字节流中切分出完整的帧
+#[derive(Default)]
+pub struct FrameReader {
+  buf: Vec<u8>,
+  // buf 中尚未消费的起始位置
+  pos: usize,
+}
+
+impl FrameReader {
+  pub fn push(&mut self, chunk: &[u8]) {
+    // 已消费的部分超过一半时再整理，避免每取出一帧都移动剩余数据
+    if self.pos > 0 && self.pos * 2 >= self.buf.len() {
+      self.buf.drain(..self.pos);
+      self.pos = 0;
+    }
+    self.buf.extend_from_slice(chunk);
+  }
+
+  /// 取出下一个完整的帧（已解压），数据不足时返回 None
+  pub fn next_frame(&mut self) -> io::Result<Option<Vec<u8>>> {
+    let rest = &self.buf[self.pos..];
+    if rest.len() < HEADER_LEN {
+      return Ok(None);
+    }
+    let len = BigEndian::read_u32(&rest[..4]) as usize;
+    if rest.len() < HEADER_LEN + len {
+      return Ok(None);
+    }
+    let data = &rest[HEADER_LEN..HEADER_LEN + len];
+    let frame = match rest[4] {
+      FLAG_RAW => data.to_vec(),
+      FLAG_ZSTD => zstd::stream::decode_all(data)?,
+      _ => {
+        return Err(io::Error::new(
+          io::ErrorKind::InvalidData,
+          "unknown raft frame flag",
+        ));
+      }
+    };
+    self.pos += HEADER_LEN + len;
+    Ok(Some(frame))
+  }
+
+  /// 没有剩余的未完成帧；流结束时不为空说明数据被截断
+  pub fn is_empty(&self) -> bool {
+    self.pos == self.buf.len()
+  }
+}
+
+#[cfg(test)]
+mod tests {
+  use super::*;
+
+  #[test]
+  fn test_small_frame_is_raw() -> io::Result<()> {
+    let msg = ("append".to_string(), vec![1u64, 2, 3]);
+    let body = encode_frame(&msg)?;
+    assert_eq!(body[4], FLAG_RAW);
+    assert_eq!(BigEndian::read_u32(&body[..4]) as usize, body.len() - HEADER_LEN);
+    let decoded: (String, Vec<u64>) = decode_frame(&body)?;
+    assert_eq!(decoded, msg);
+    Ok(())
+  }
+
+  #[test]
+  fn test_large_frame_is_compressed() -> io::Result<()> {
+    let msg = "v".repeat(COMPRESS_THRESHOLD * 4);
+    let body = encode_frame(&msg)?;
+    assert_eq!(body[4], FLAG_ZSTD);
+    assert!(body.len() < msg.len());
+    let decoded: String = decode_frame(&body)?;
+    assert_eq!(decoded, msg);
+    Ok(())
+  }
+
+  #[test]
+  fn test_incompressible_frame_stays_raw() -> io::Result<()> {
+    // 伪随机数据压缩后不会变小
+    let mut x = 1u64;
+    let data: Vec<u8> = (0..COMPRESS_THRESHOLD * 2)
+      .map(|_| {
+        x = x.wrapping_mul(6364136223846793005).wrapping_add(1442695040888963407);
+        (x >> 56) as u8
+      })
+      .collect();
+    let body = frame(&data)?;
+    assert_eq!(body[4], FLAG_RAW);
+    assert_eq!(&body[HEADER_LEN..], data.as_slice());
+    Ok(())
+  }
+
+  #[test]
+  fn test_reader_splits_chunks() -> io::Result<()> {
+    let big = "x".repeat(COMPRESS_THRESHOLD * 2);
+    let mut stream = Vec::new();
+    for msg in ["a", big.as_str(), ""] {
+      stream.extend(encode_frame(&msg.to_string())?);
+    }
+
+    // 逐字节到达，帧可能跨越任意块边界
+    let mut frames = FrameReader::default();
+    let mut decoded = Vec::new();
+    for b in &stream {
+      frames.push(std::slice::from_ref(b));
+      while let Some(data) = frames.next_frame()? {
+        decoded.push(decode::<String>(&data)?);
+      }
+    }
+    assert!(frames.is_empty());
+    assert_eq!(decoded, vec!["a".to_string(), big, String::new()]);
+    Ok(())
+  }
+
+  #[test]
+  fn test_malformed_frames() -> io::Result<()> {
+    let mut body = encode_frame(&"a".to_string())?;
+    // 截断或带有多余数据的消息体
+    assert!(decode_frame::<String>(&body[..body.len() - 1]).is_err());
+    let mut extra = body.clone();
+    extra.push(0);
+    assert!(decode_frame::<String>(&extra).is_err());
+
+    body[4] = 9;
+    let err = decode_frame::<String>(&body).unwrap_err();
+    assert_eq!(err.kind(), io::ErrorKind::InvalidData);
+    Ok(())
+  }
+}
@@ -1,41 +1,83 @@
 use std::fmt::Display;
+use std::future::Future;
+use std::io;
+use std::io::SeekFrom;
+use std::marker::PhantomData;
 
+use actix_web::web::Bytes;
+use futures::FutureExt;
+use futures::Stream;
+use futures::StreamExt;
+use futures::channel::mpsc;
+use futures::future::Either;
 use openraft::BasicNode;
+use openraft::OptionalSend;
 use openraft::RaftTypeConfig;
+use openraft::Snapshot;
+use openraft::alias::VoteOf;
+use openraft::base::BoxFuture;
+use openraft::base::BoxStream;
+use openraft::entry::RaftEntry;
+use openraft::error::Fatal;
 use openraft::error::Infallible;
-use openraft::error::InstallSnapshotError;
 use openraft::error::NetworkError;
 use openraft::error::RPCError;
-use openraft::error::RaftError;
-use openraft::error::RemoteError;
+use openraft::error::ReplicationClosed;
+use openraft::error::StreamingError;
 use openraft::error::Unreachable;
 use openraft::network::RPCOption;
-use openraft::network::RaftNetwork;
 use openraft::network::RaftNetworkFactory;
+use openraft::network::v2::RaftNetworkV2;
 use openraft::raft::AppendEntriesRequest;
 use openraft::raft::AppendEntriesResponse;
-use openraft::raft::InstallSnapshotRequest;
-use openraft::raft::InstallSnapshotResponse;
+use openraft::raft::SnapshotResponse;
+use openraft::raft::StreamAppendResult;
 use openraft::raft::VoteRequest;
 use openraft::raft::VoteResponse;
+use reqwest::Body;
 use reqwest::Client;
+use reqwest::StatusCode;
+use reqwest::header::CONTENT_TYPE;
 use serde::Serialize;
 use serde::de::DeserializeOwned;
 use tokio::io::AsyncRead;
+use tokio::io::AsyncReadExt;
 use tokio::io::AsyncSeek;
-use tokio::io::AsyncWrite;
+use tokio::io::AsyncSeekExt;
 
-pub struct NetworkFactory {}
+pub mod codec;
+
+// 流水线复制时最多同时在途的 AppendEntries 数
+const PIPELINE_DEPTH: usize = 64;
+
+// 流式发送快照时每帧的大小
+const SNAPSHOT_FRAME_SIZE: usize = 1024 * 1024;
+
+/// 节点间 RPC 的传输方式，默认 Json 以便与旧版本节点混合部署，Binary/Pipeline 需显式开启
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Default)]
+pub enum Transport {
+  // 每个 RPC 一个 JSON 请求（与旧版本节点兼容）
+  #[default]
+  Json,
+  // 每个 RPC 一个二进制帧请求，大消息压缩
+  Binary,
+  // 二进制编码，AppendEntries 在一个长连接上流水线发送，不等待前一个响应
+  Pipeline,
+}
+
+pub struct NetworkFactory {
+  pub transport: Transport,
+}
 
 impl<C> RaftNetworkFactory<C> for NetworkFactory
 where
   C: RaftTypeConfig<Node = BasicNode>,
-  <C as RaftTypeConfig>::SnapshotData: AsyncRead + AsyncWrite + AsyncSeek + Unpin,
+  <C as RaftTypeConfig>::SnapshotData: AsyncRead + AsyncSeek + Unpin,
 {
   type Network = Network<C>;
 
   #[tracing::instrument(level = "debug", skip_all)]
-  async fn new_client(&mut self, target: C::NodeId, node: &BasicNode) -> Self::Network {
+  async fn new_client(&mut self, _target: C::NodeId, node: &BasicNode) -> Self::Network {
     let addr = node.addr.clone();
 
     let client = Client::builder().no_proxy().build().unwrap();
@@ -43,7 +85,8 @@ where
     Network {
       addr,
       client,
-      target,
+      transport: self.transport,
+      _p: PhantomData,
     }
   }
 }
@@ -54,13 +97,18 @@ where
 {
   addr: String,
   client: Client,
-  target: C::NodeId,
+  transport: Transport,
+  _p: PhantomData<C>,
 }
 
 impl<C> Network<C>
 where
   C: RaftTypeConfig,
 {
+  fn url(&self, uri: impl Display) -> String {
+    format!("http://{}/{}", self.addr, uri)
+  }
+
   async fn request<Req, Resp, Err>(
     &mut self,
     uri: impl Display,
@@ -71,74 +119,131 @@ where
     Resp: Serialize + DeserializeOwned,
     Err: std::error::Error + Serialize + DeserializeOwned,
   {
-    let url = format!("http://{}/{}", self.addr, uri);
-    // println!(
-    //     ">>> network send request to {}: {}",
-    //     url,
-    //     serde_json::to_string_pretty(&req).unwrap()
-    // );
-
     let resp = self
       .client
-      .post(url.clone())
+      .post(self.url(uri))
       .json(&req)
       .send()
       .await
-      .map_err(|e| {
-        if e.is_connect() {
-          // `Unreachable` informs the caller to backoff for a short while to avoid error log flush.
-          RPCError::Unreachable(Unreachable::new(&e))
-        } else {
-          RPCError::Network(NetworkError::new(&e))
-        }
-      })?;
+      .map_err(send_err)?;
 
     let res: Result<Resp, Err> = resp.json().await.map_err(|e| NetworkError::new(&e))?;
-    // println!(
-    //     "<<< network recv reply from {}: {}",
-    //     url,
-    //     serde_json::to_string_pretty(&res).unwrap()
-    // );
+    Ok(res)
+  }
 
+  // 与 request 相同，请求和响应都是一个二进制帧
+  async fn request_bin<Req, Resp, Err>(
+    &mut self,
+    uri: impl Display,
+    req: Req,
+  ) -> Result<Result<Resp, Err>, RPCError<C>>
+  where
+    Req: Serialize + 'static,
+    Resp: DeserializeOwned,
+    Err: DeserializeOwned,
+  {
+    let body = codec::encode_frame(&req).map_err(|e| NetworkError::new(&e))?;
+    let resp = self
+      .client
+      .post(self.url(uri))
+      .header(CONTENT_TYPE, codec::CONTENT_TYPE)
+      .body(body)
+      .send()
+      .await
+      .map_err(send_err)?
+      .error_for_status()
+      .map_err(|e| NetworkError::new(&e))?;
+
+    let body = resp.bytes().await.map_err(|e| NetworkError::new(&e))?;
+    let res = codec::decode_frame(&body).map_err(|e| NetworkError::new(&e))?;
     Ok(res)
   }
 }
 
-#[allow(clippy::blocks_in_conditions)]
-impl<C> RaftNetwork<C> for Network<C>
+fn send_err<C: RaftTypeConfig>(e: reqwest::Error) -> RPCError<C> {
+  if e.is_connect() {
+    // `Unreachable` informs the caller to backoff for a short while to avoid error log flush.
+    RPCError::Unreachable(Unreachable::new(&e))
+  } else {
+    RPCError::Network(NetworkError::new(&e))
+  }
+}
+
+fn network_err(msg: &str) -> NetworkError {
+  NetworkError::new(&io::Error::other(msg.to_string()))
+}
+
+impl<C> RaftNetworkV2<C> for Network<C>
 where
-  C: RaftTypeConfig,
+  C: RaftTypeConfig<Node = BasicNode>,
+  <C as RaftTypeConfig>::SnapshotData: AsyncRead + AsyncSeek + Unpin,
 {
   #[tracing::instrument(level = "debug", skip_all, err(Debug))]
   async fn append_entries(
     &mut self,
     req: AppendEntriesRequest<C>,
     _option: RPCOption,
-  ) -> Result<AppendEntriesResponse<C>, RPCError<C, RaftError<C>>> {
-    let res = self
-      .request::<_, _, Infallible>("append", req)
-      .await
-      .map_err(RPCError::with_raft_error)?;
+  ) -> Result<AppendEntriesResponse<C>, RPCError<C>> {
+    let res = match self.transport {
+      Transport::Json => self.request::<_, _, Infallible>("append", req).await?,
+      _ => self.request_bin::<_, _, Infallible>("append-bin", req).await?,
+    };
     Ok(res.unwrap())
   }
 
-  #[tracing::instrument(level = "debug", skip_all, err(Debug))]
-  async fn install_snapshot(
-    &mut self,
-    req: InstallSnapshotRequest<C>,
-    _option: RPCOption,
-  ) -> Result<InstallSnapshotResponse<C>, RPCError<C, RaftError<C, InstallSnapshotError>>> {
-    let res = self
-      .request("snapshot", req)
-      .await
-      .map_err(RPCError::with_raft_error)?;
-    match res {
-      Ok(resp) => Ok(resp),
-      Err(e) => Err(RPCError::RemoteError(RemoteError::new(
-        self.target.clone(),
-        RaftError::APIError(e),
-      ))),
+  fn stream_append<'s, S>(
+    &'s mut self,
+    input: S,
+    option: RPCOption,
+  ) -> BoxFuture<'s, Result<BoxStream<'s, Result<StreamAppendResult<C>, RPCError<C>>>, RPCError<C>>>
+  where
+    S: Stream<Item = AppendEntriesRequest<C>> + OptionalSend + Unpin + 's,
+  {
+    if self.transport != Transport::Pipeline {
+      return sequential_append(self, input, option);
     }
+
+    Box::pin(async move {
+      // 请求体由 channel 中的帧组成，连接建立后持续写入；响应体按相同顺序返回每个请求的结果
+      let (tx, rx) = mpsc::unbounded::<io::Result<Vec<u8>>>();
+      let resp = self
+        .client
+        .post(self.url("append-stream"))
+        .header(CONTENT_TYPE, codec::CONTENT_TYPE)
+        .body(Body::wrap_stream(rx))
+        .send()
+        .await
+        .map_err(send_err)?;
+
+      if resp.status() == StatusCode::NOT_FOUND {
+        // 对端不支持流水线（旧版本），之后改用逐个请求的二进制传输
+        self.transport = Transport::Binary;
+        return Err(RPCError::Network(network_err("append-stream not supported")));
+      }
+      let resp = resp.error_for_status().map_err(|e| NetworkError::new(&e))?;
+
+      let pipeline = Pipeline {
+        input: Some(input),
+        tx: Some(tx),
+        body: Box::pin(resp.bytes_stream()),
+        frames: codec::FrameReader::default(),
+        in_flight: 0,
+        _p: PhantomData,
+      };
+      let strm = futures::stream::unfold(Some(pipeline), |state| async move {
+        let mut pipeline = state?;
+        match pipeline.next().await? {
+          // 冲突或遇到更高的 vote 时结束
+          Ok(res) => {
+            let next = if res.is_ok() { Some(pipeline) } else { None };
+            Some((Ok(res), next))
+          }
+          Err(e) => Some((Err(e), None)),
+        }
+      });
+      let strm: BoxStream<'s, _> = Box::pin(strm);
+      Ok(strm)
+    })
   }
 
   #[tracing::instrument(level = "debug", skip_all, err(Debug))]
@@ -146,11 +251,186 @@ where
     &mut self,
     req: VoteRequest<C>,
     _option: RPCOption,
-  ) -> Result<VoteResponse<C>, RPCError<C, RaftError<C>>> {
-    let res = self
-      .request::<_, _, Infallible>("vote", req)
-      .await
-      .map_err(RPCError::with_raft_error)?;
+  ) -> Result<VoteResponse<C>, RPCError<C>> {
+    let res = match self.transport {
+      Transport::Json => self.request::<_, _, Infallible>("vote", req).await?,
+      _ => self.request_bin::<_, _, Infallible>("vote-bin", req).await?,
+    };
     Ok(res.unwrap())
   }
+
+  async fn full_snapshot(
+    &mut self,
+    vote: VoteOf<C>,
+    snapshot: Snapshot<C>,
+    cancel: impl Future<Output = ReplicationClosed> + OptionalSend + 'static,
+    _option: RPCOption,
+  ) -> Result<SnapshotResponse<C>, StreamingError<C>> {
+    // 快照在一个请求中流式发送：第一帧为 (vote, meta)，之后每帧为快照文件的一段（较大的帧会被压缩），
+    // 接收端边收边写入文件，全部收到后安装
+    let Snapshot { meta, snapshot: mut data } = snapshot;
+    data
+      .seek(SeekFrom::Start(0))
+      .await
+      .map_err(|e| NetworkError::new(&e))?;
+    let header = codec::encode_frame(&(vote, meta)).map_err(|e| NetworkError::new(&e))?;
+
+    let chunks = futures::stream::unfold(Some(data), |state| async move {
+      let mut data = state?;
+      let mut buf = Vec::with_capacity(SNAPSHOT_FRAME_SIZE);
+      let read = (&mut data).take(SNAPSHOT_FRAME_SIZE as u64).read_to_end(&mut buf).await;
+      if let Err(e) = read {
+        return Some((Err(e), None));
+      }
+      if buf.is_empty() {
+        return None;
+      }
+      Some((codec::frame(&buf), Some(data)))
+    });
+    let body = futures::stream::once(async move { Ok(header) }).chain(chunks);
+
+    let send = async {
+      let resp = self
+        .client
+        .post(self.url("snapshot-stream"))
+        .header(CONTENT_TYPE, codec::CONTENT_TYPE)
+        .body(Body::wrap_stream(body))
+        .send()
+        .await
+        .map_err(|e| match send_err::<C>(e) {
+          RPCError::Unreachable(e) => StreamingError::Unreachable(e),
+          e => StreamingError::Network(NetworkError::new(&e)),
+        })?
+        .error_for_status()
+        .map_err(|e| NetworkError::new(&e))?;
+      let body = resp.bytes().await.map_err(|e| NetworkError::new(&e))?;
+      let res: Result<SnapshotResponse<C>, Fatal<C>> =
+        codec::decode_frame(&body).map_err(|e| NetworkError::new(&e))?;
+      res.map_err(|e| StreamingError::<C>::Network(NetworkError::new(&e)))
+    };
+
+    match futures::future::select(Box::pin(cancel), Box::pin(send)).await {
+      Either::Left((closed, _)) => Err(closed.into()),
+      Either::Right((res, _)) => res,
+    }
+  }
+}
+
+// 非流水线方式：逐个发送 AppendEntries，收到响应后再发送下一个
+fn sequential_append<'s, C, S>(
+  network: &'s mut Network<C>,
+  input: S,
+  option: RPCOption,
+) -> BoxFuture<'s, Result<BoxStream<'s, Result<StreamAppendResult<C>, RPCError<C>>>, RPCError<C>>>
+where
+  C: RaftTypeConfig<Node = BasicNode>,
+  <C as RaftTypeConfig>::SnapshotData: AsyncRead + AsyncSeek + Unpin,
+  S: Stream<Item = AppendEntriesRequest<C>> + OptionalSend + Unpin + 's,
+{
+  let strm = futures::stream::unfold(Some((network, input)), move |state| {
+    let option = option.clone();
+    async move {
+      let (network, mut input) = state?;
+      let req = input.next().await?;
+      let (prev, last) = log_id_range(&req);
+      match network.append_entries(req, option).await {
+        Ok(resp) => {
+          let res = resp.into_stream_result(prev, last);
+          let next = if res.is_ok() { Some((network, input)) } else { None };
+          Some((Ok(res), next))
+        }
+        Err(e) => Some((Err(e), None)),
+      }
+    }
+  });
+  let strm: BoxStream<'s, _> = Box::pin(strm);
+  async move { Ok(strm) }.boxed()
+}
+
+// 请求覆盖的 log 范围 (prev_log_id, last_log_id]
+fn log_id_range<C: RaftTypeConfig>(
+  req: &AppendEntriesRequest<C>,
+) -> (Option<openraft::alias::LogIdOf<C>>, Option<openraft::alias::LogIdOf<C>>) {
+  let last = match req.entries.last() {
+    Some(entry) => Some(entry.log_id()),
+    None => req.prev_log_id.clone(),
+  };
+  (req.prev_log_id.clone(), last)
+}
+
+// 流水线复制的状态：请求不断写入请求体，同时从响应体中按顺序读取结果
+struct Pipeline<C, S>
+where
+  C: RaftTypeConfig,
+{
+  input: Option<S>,
+  tx: Option<mpsc::UnboundedSender<io::Result<Vec<u8>>>>,
+  body: BoxStream<'static, reqwest::Result<Bytes>>,
+  frames: codec::FrameReader,
+  in_flight: usize,
+  _p: PhantomData<C>,
+}
+
+enum Step<C: RaftTypeConfig> {
+  Input(Option<AppendEntriesRequest<C>>),
+  Body(Option<reqwest::Result<Bytes>>),
+}
+
+impl<C, S> Pipeline<C, S>
+where
+  C: RaftTypeConfig,
+  S: Stream<Item = AppendEntriesRequest<C>> + OptionalSend + Unpin,
+{
+  async fn next(&mut self) -> Option<Result<StreamAppendResult<C>, RPCError<C>>> {
+    loop {
+      match self.frames.next_frame() {
+        Ok(Some(frame)) => {
+          self.in_flight -= 1;
+          return Some(codec::decode(&frame).map_err(|e| RPCError::Network(NetworkError::new(&e))));
+        }
+        Ok(None) => {}
+        Err(e) => return Some(Err(RPCError::Network(NetworkError::new(&e)))),
+      }
+      if self.input.is_none() && self.in_flight == 0 {
+        return None;
+      }
+
+      // 在途请求未满时同时等待新的请求和响应数据，否则只等待响应
+      let step = match self.input.as_mut() {
+        Some(input) if self.in_flight < PIPELINE_DEPTH => {
+          match futures::future::select(input.next(), self.body.next()).await {
+            Either::Left((req, _)) => Step::Input(req),
+            Either::Right((chunk, _)) => Step::Body(chunk),
+          }
+        }
+        _ => Step::Body(self.body.next().await),
+      };
+
+      match step {
+        Step::Input(Some(req)) => {
+          let frame = match codec::encode_frame(&req) {
+            Ok(frame) => frame,
+            Err(e) => return Some(Err(RPCError::Network(NetworkError::new(&e)))),
+          };
+          if self.tx.as_ref().unwrap().unbounded_send(Ok(frame)).is_err() {
+            return Some(Err(RPCError::Network(network_err("append stream closed"))));
+          }
+          self.in_flight += 1;
+        }
+        Step::Input(None) => {
+          // 输入结束，关闭请求体；继续读取剩余的响应
+          self.input = None;
+          self.tx = None;
+        }
+        Step::Body(Some(Ok(chunk))) => self.frames.push(&chunk),
+        Step::Body(Some(Err(e))) => return Some(Err(RPCError::Network(NetworkError::new(&e)))),
+        Step::Body(None) => {
+          if self.in_flight > 0 || !self.frames.is_empty() {
+            return Some(Err(RPCError::Network(network_err("append stream closed by peer"))));
+          }
+          return None;
+        }
+      }
+    }
+  }
 }
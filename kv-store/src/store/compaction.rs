@@ -0,0 +1,154 @@
+//! log 压缩策略与统计
+//!
+//! openraft 按新增 log 条数触发快照；这里再按写入 log 的字节数触发，避免大 value 时 log 在两次快照之间占用过多磁盘。
+//! 快照之后 openraft 清理（purge）旧 log，log store 随即对已删除的范围做 RocksDB compaction，及时回收空间。
+
+use std::sync::Arc;
+use std::sync::atomic::AtomicBool;
+use std::sync::atomic::AtomicU64;
+use std::sync::atomic::Ordering;
+use std::time::Duration;
+use std::time::Instant;
+
+use rocksdb::DB;
+use serde::Serialize;
+
+use crate::typ::Raft;
+
+// 检查是否需要按字节数触发快照的间隔
+const CHECK_INTERVAL: Duration = Duration::from_secs(1);
+
+/// log store 与状态机共享的统计，通过 /metrics 的 compaction 字段展示
+#[derive(Debug)]
+pub struct LogStats {
+  db: Arc<DB>,
+  // 本次启动以来写入 log 的总字节数
+  appended_bytes: AtomicU64,
+  // 最近一次开始构建快照时的 appended_bytes
+  snapshot_base: AtomicU64,
+  snapshots: AtomicU64,
+  last_snapshot_ms: AtomicU64,
+  last_snapshot_bytes: AtomicU64,
+  purges: AtomicU64,
+  compactions: AtomicU64,
+  last_compaction_ms: AtomicU64,
+  // 同一时间只做一次 compaction
+  compacting: AtomicBool,
+}
+
+#[derive(Debug, Clone, Serialize)]
+pub struct CompactionMetrics {
+  /// logs 列族占用的磁盘和内存表大小
+  pub log_bytes_on_disk: u64,
+  /// 最后一条 log 与快照之间的条数
+  pub entries_since_snapshot: u64,
+  /// 上次开始构建快照以来写入 log 的字节数
+  pub bytes_since_snapshot: u64,
+  /// 按字节数触发快照的阈值，0 表示不按字节数触发
+  pub snapshot_log_bytes: u64,
+  pub snapshot_count: u64,
+  pub last_snapshot_ms: u64,
+  pub last_snapshot_bytes: u64,
+  pub purge_count: u64,
+  pub compaction_count: u64,
+  pub last_compaction_ms: u64,
+}
+
+impl LogStats {
+  pub fn new(db: Arc<DB>) -> Self {
+    Self {
+      db,
+      appended_bytes: AtomicU64::new(0),
+      snapshot_base: AtomicU64::new(0),
+      snapshots: AtomicU64::new(0),
+      last_snapshot_ms: AtomicU64::new(0),
+      last_snapshot_bytes: AtomicU64::new(0),
+      purges: AtomicU64::new(0),
+      compactions: AtomicU64::new(0),
+      last_compaction_ms: AtomicU64::new(0),
+      compacting: AtomicBool::new(false),
+    }
+  }
+
+  pub(crate) fn record_append(&self, bytes: u64) {
+    self.appended_bytes.fetch_add(bytes, Ordering::Relaxed);
+  }
+
+  /// 开始构建快照：快照点之前写入的 log 将被快照覆盖
+  pub(crate) fn snapshot_started(&self) {
+    let appended = self.appended_bytes.load(Ordering::Relaxed);
+    self.snapshot_base.store(appended, Ordering::Relaxed);
+  }
+
+  pub(crate) fn record_snapshot(&self, elapsed: Duration, file_bytes: u64) {
+    self.snapshots.fetch_add(1, Ordering::Relaxed);
+    self.last_snapshot_ms.store(elapsed.as_millis() as u64, Ordering::Relaxed);
+    self.last_snapshot_bytes.store(file_bytes, Ordering::Relaxed);
+  }
+
+  pub fn bytes_since_snapshot(&self) -> u64 {
+    let appended = self.appended_bytes.load(Ordering::Relaxed);
+    appended.saturating_sub(self.snapshot_base.load(Ordering::Relaxed))
+  }
+
+  /// purge 删除 [0, end) 之后调用：在后台线程 compact 这段范围，回收被删除 log 占用的空间；
+  /// 上一次 compaction 尚未结束时跳过，下次 purge 会覆盖这次的范围
+  pub(crate) fn purged(self: &Arc<Self>, end: Vec<u8>) {
+    self.purges.fetch_add(1, Ordering::Relaxed);
+    if self.compacting.swap(true, Ordering::AcqRel) {
+      return;
+    }
+    let stats = self.clone();
+    tokio::task::spawn_blocking(move || {
+      let start = Instant::now();
+      let cf = stats.db.cf_handle("logs").unwrap();
+      stats.db.compact_range_cf(cf, None::<&[u8]>, Some(end.as_slice()));
+      stats.compactions.fetch_add(1, Ordering::Relaxed);
+      stats
+        .last_compaction_ms
+        .store(start.elapsed().as_millis() as u64, Ordering::Relaxed);
+      stats.compacting.store(false, Ordering::Release);
+    });
+  }
+
+  pub fn log_bytes_on_disk(&self) -> u64 {
+    let cf = self.db.cf_handle("logs").unwrap();
+    ["rocksdb.total-sst-files-size", "rocksdb.cur-size-all-mem-tables"]
+      .iter()
+      .filter_map(|name| self.db.property_int_value_cf(cf, *name).ok().flatten())
+      .sum()
+  }
+
+  pub fn metrics(&self, entries_since_snapshot: u64, snapshot_log_bytes: u64) -> CompactionMetrics {
+    CompactionMetrics {
+      log_bytes_on_disk: self.log_bytes_on_disk(),
+      entries_since_snapshot,
+      bytes_since_snapshot: self.bytes_since_snapshot(),
+      snapshot_log_bytes,
+      snapshot_count: self.snapshots.load(Ordering::Relaxed),
+      last_snapshot_ms: self.last_snapshot_ms.load(Ordering::Relaxed),
+      last_snapshot_bytes: self.last_snapshot_bytes.load(Ordering::Relaxed),
+      purge_count: self.purges.load(Ordering::Relaxed),
+      compaction_count: self.compactions.load(Ordering::Relaxed),
+      last_compaction_ms: self.last_compaction_ms.load(Ordering::Relaxed),
+    }
+  }
+}
+
+/// 自上次快照以来写入 log 的字节数超过 limit 时触发快照；limit 为 0 时不启动
+pub async fn run_snapshot_trigger(raft: Raft, stats: Arc<LogStats>, limit: u64) {
+  if limit == 0 {
+    return;
+  }
+  let mut ticker = tokio::time::interval(CHECK_INTERVAL);
+  loop {
+    ticker.tick().await;
+    if stats.bytes_since_snapshot() < limit {
+      continue;
+    }
+    // 正在构建快照时 openraft 会忽略这次触发；构建开始后 bytes_since_snapshot 清零
+    if let Err(e) = raft.trigger().snapshot().await {
+      tracing::warn!("failed to trigger snapshot: {}", e);
+    }
+  }
+}
@@ -0,0 +1,532 @@
+//! 状态机的键值数据
+//!
+//! 默认全部保存在内存的 BTreeMap 中，重启时从快照重建；数据量受内存限制，启动时间随数据量增长。
+//! rocksdb 模式把数据保存在 store 列族中（`kv/` 前缀为键值，`ttl/` 前缀为过期时间，`applied` 为已 apply 的位置），
+//! 前面是按字节数限制大小的读缓存；每次 apply 的修改连同 applied 在一个 WriteBatch 中原子写入，
+//! 重启时直接使用列族中的数据，只需重放 applied 之后的 log。
+
+use std::borrow::Cow;
+use std::collections::BTreeMap;
+use std::collections::HashMap;
+use std::collections::VecDeque;
+use std::io;
+use std::ops::Bound;
+use std::path::Path;
+use std::sync::Arc;
+use std::sync::Mutex;
+
+use byteorder::BigEndian;
+use byteorder::ByteOrder;
+use rocksdb::DB;
+use rocksdb::Direction;
+use rocksdb::IteratorMode;
+use rocksdb::WriteBatch;
+use serde::Deserialize;
+use serde::Serialize;
+
+use super::snapshot;
+use super::ttl::TtlIndex;
+use crate::typ::*;
+
+const STORE_CF: &str = "store";
+const KV_PREFIX: &[u8] = b"kv/";
+// 紧跟在前缀范围之后的键（'/' 的下一个字符是 '0'），用于删除整个前缀
+const KV_END: &[u8] = b"kv0";
+const TTL_PREFIX: &[u8] = b"ttl/";
+const TTL_END: &[u8] = b"ttl0";
+const APPLIED_KEY: &[u8] = b"applied";
+
+// 从快照写入 store 列族时每个 WriteBatch 的记录数
+const LOAD_BATCH: usize = 4096;
+
+pub const DEFAULT_CACHE_BYTES: u64 = 64 * 1024 * 1024;
+
+/// 状态机数据的存放方式
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Default)]
+pub enum StateBackend {
+  // 全部在内存中，重启时从快照重建
+  #[default]
+  Memory,
+  // 保存在 RocksDB 的 store 列族中，读缓存最多占用 cache_bytes
+  Rocksdb { cache_bytes: u64 },
+}
+
+/// 持久化的 apply 位置，与数据在同一个 WriteBatch 中写入
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub(crate) struct AppliedState {
+  pub last_applied_log_id: Option<LogId>,
+  pub last_membership: StoredMembership,
+}
+
+#[derive(Debug, Clone, Serialize)]
+pub struct StateMetrics {
+  pub backend: &'static str,
+  pub cache_entries: usize,
+  pub cache_bytes: u64,
+  pub cache_capacity: u64,
+  pub cache_hits: u64,
+  pub cache_misses: u64,
+}
+
+/// range 产出的键值对，rocksdb 模式下读取失败时为错误
+pub type KvIter<'a> = Box<dyn Iterator<Item = io::Result<(Cow<'a, str>, Cow<'a, str>)>> + 'a>;
+
+#[derive(Debug)]
+pub enum KvState {
+  Memory(BTreeMap<String, String>),
+  Disk(DiskKv),
+}
+
+impl Default for KvState {
+  fn default() -> Self {
+    KvState::Memory(BTreeMap::new())
+  }
+}
+
+#[derive(Debug)]
+pub struct DiskKv {
+  db: Arc<DB>,
+  // 本次 apply 中尚未写入 RocksDB 的修改，None 表示删除；apply 结束时由 commit 写入并清空
+  pending: BTreeMap<String, Option<String>>,
+  // 读请求在 kvs 读锁下并发访问
+  cache: Mutex<ReadCache>,
+}
+
+impl KvState {
+  pub(crate) fn disk(db: Arc<DB>, cache_bytes: u64) -> Self {
+    KvState::Disk(DiskKv {
+      db,
+      pending: BTreeMap::new(),
+      cache: Mutex::new(ReadCache::new(cache_bytes)),
+    })
+  }
+
+  pub fn is_disk(&self) -> bool {
+    matches!(self, KvState::Disk(_))
+  }
+
+  /// 读取 key 的值；rocksdb 模式下缓存未命中时读磁盘，读取失败返回错误，内存模式总是成功
+  pub fn get(&self, key: &str) -> io::Result<Option<String>> {
+    match self {
+      KvState::Memory(map) => Ok(map.get(key).cloned()),
+      KvState::Disk(disk) => disk.get(key),
+    }
+  }
+
+  pub fn contains_key(&self, key: &str) -> io::Result<bool> {
+    match self {
+      KvState::Memory(map) => Ok(map.contains_key(key)),
+      KvState::Disk(disk) => Ok(disk.get(key)?.is_some()),
+    }
+  }
+
+  /// 写入 key，返回原值；rocksdb 模式下在 commit 之前只对本次 apply 可见。
+  /// 读取原值失败时不做修改
+  pub(crate) fn insert(&mut self, key: String, value: String) -> io::Result<Option<String>> {
+    match self {
+      KvState::Memory(map) => Ok(map.insert(key, value)),
+      KvState::Disk(disk) => {
+        let old = disk.get(&key)?;
+        disk.pending.insert(key, Some(value));
+        Ok(old)
+      }
+    }
+  }
+
+  pub(crate) fn remove(&mut self, key: &str) -> io::Result<Option<String>> {
+    match self {
+      KvState::Memory(map) => Ok(map.remove(key)),
+      KvState::Disk(disk) => {
+        let old = disk.get(key)?;
+        disk.pending.insert(key.to_string(), None);
+        Ok(old)
+      }
+    }
+  }
+
+  /// 按键顺序遍历 (lower, upper) 区间内的键值对；内存模式直接借用 map 中的数据。
+  /// rocksdb 模式只读取已 commit 的数据，调用方持有 kvs 读锁，此时没有未 commit 的修改；
+  /// 读取失败或数据损坏时产出一个错误后结束，调用方不能把此前的结果当作完整的范围
+  pub fn range<'a>(&'a self, lower: Bound<&str>, upper: Bound<&str>) -> KvIter<'a> {
+    match self {
+      KvState::Memory(map) => Box::new(
+        map
+          .range::<str, _>((lower, upper))
+          .map(|(k, v)| Ok((Cow::Borrowed(k.as_str()), Cow::Borrowed(v.as_str())))),
+      ),
+      KvState::Disk(disk) => disk.range(lower, upper),
+    }
+  }
+
+  /// 把本次 apply 的修改、相应键的过期时间和 apply 位置原子地写入 RocksDB，内存模式不做任何事
+  pub(crate) fn commit(&mut self, ttl: &TtlIndex, applied: &AppliedState) -> io::Result<()> {
+    let KvState::Disk(disk) = self else {
+      return Ok(());
+    };
+    let cf = disk.db.cf_handle(STORE_CF).unwrap();
+    let mut batch = WriteBatch::default();
+    for (key, value) in &disk.pending {
+      match value {
+        Some(v) => batch.put_cf(cf, kv_key(key), v),
+        None => batch.delete_cf(cf, kv_key(key)),
+      }
+      match ttl.get(key) {
+        Some(at) => batch.put_cf(cf, ttl_key(key), at.to_be_bytes()),
+        None => batch.delete_cf(cf, ttl_key(key)),
+      }
+    }
+    batch.put_cf(cf, APPLIED_KEY, serde_json::to_vec(applied)?);
+    disk.db.write(batch).map_err(io::Error::other)?;
+
+    let mut cache = disk.cache.lock().unwrap();
+    for (key, value) in std::mem::take(&mut disk.pending) {
+      cache.refresh(key, value);
+    }
+    Ok(())
+  }
+
+  /// 安装快照后缓存中的数据全部失效
+  pub(crate) fn clear_cache(&mut self) {
+    if let KvState::Disk(disk) = self {
+      disk.pending.clear();
+      disk.cache.lock().unwrap().clear();
+    }
+  }
+
+  pub fn metrics(&self) -> StateMetrics {
+    match self {
+      KvState::Memory(_) => StateMetrics {
+        backend: "memory",
+        cache_entries: 0,
+        cache_bytes: 0,
+        cache_capacity: 0,
+        cache_hits: 0,
+        cache_misses: 0,
+      },
+      KvState::Disk(disk) => {
+        let cache = disk.cache.lock().unwrap();
+        StateMetrics {
+          backend: "rocksdb",
+          cache_entries: cache.entries.len(),
+          cache_bytes: cache.bytes,
+          cache_capacity: cache.capacity,
+          cache_hits: cache.hits,
+          cache_misses: cache.misses,
+        }
+      }
+    }
+  }
+}
+
+impl DiskKv {
+  fn get(&self, key: &str) -> io::Result<Option<String>> {
+    if let Some(value) = self.pending.get(key) {
+      return Ok(value.clone());
+    }
+    if let Some(value) = self.cache.lock().unwrap().get(key) {
+      return Ok(value);
+    }
+    // 读磁盘时不持有缓存的锁，其他读请求仍可以命中缓存；调用方持有 kvs 的锁，读到的值在放入缓存前不会被 commit 覆盖
+    let cf = self.db.cf_handle(STORE_CF).unwrap();
+    // 读取失败交给调用方：apply 时作为存储错误返回给 openraft，读请求返回错误，都不放入缓存
+    let value = self
+      .db
+      .get_cf(cf, kv_key(key))
+      .map_err(io::Error::other)?
+      .map(|v| String::from_utf8(v).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e)))
+      .transpose()?;
+    self.cache.lock().unwrap().insert(key.to_string(), value.clone());
+    Ok(value)
+  }
+
+  fn range<'a>(&'a self, lower: Bound<&str>, upper: Bound<&str>) -> KvIter<'a> {
+    let start = match lower {
+      Bound::Included(k) | Bound::Excluded(k) => kv_key(k),
+      Bound::Unbounded => KV_PREFIX.to_vec(),
+    };
+    let skip = match lower {
+      Bound::Excluded(k) => Some(k.to_string()),
+      _ => None,
+    };
+    let end = match upper {
+      Bound::Included(k) => {
+        let mut end = kv_key(k);
+        end.push(0);
+        end
+      }
+      Bound::Excluded(k) => kv_key(k),
+      Bound::Unbounded => KV_END.to_vec(),
+    };
+    let cf = self.db.cf_handle(STORE_CF).unwrap();
+    let iter = self
+      .db
+      .iterator_cf(cf, IteratorMode::From(&start, Direction::Forward));
+    // 出错后不再继续读取
+    let mut failed = false;
+    Box::new(
+      iter
+        .map_while(move |item| {
+          if failed {
+            return None;
+          }
+          let res = match item {
+            Ok((k, _)) if &*k >= end.as_slice() => return None,
+            Ok((k, v)) => decode_record(&k, v.into_vec()),
+            Err(e) => Err(io::Error::other(e)),
+          };
+          failed = res.is_err();
+          Some(res)
+        })
+        .filter(move |res| !matches!(res, Ok((k, _)) if skip.as_deref() == Some(k.as_str())))
+        .map(|res| res.map(|(k, v)| (Cow::Owned(k), Cow::Owned(v)))),
+    )
+  }
+}
+
+// store 列族中的一条键值记录，键带有 KV_PREFIX
+fn decode_record(k: &[u8], v: Vec<u8>) -> io::Result<(String, String)> {
+  let invalid = |e: std::string::FromUtf8Error| io::Error::new(io::ErrorKind::InvalidData, e);
+  let key = String::from_utf8(k[KV_PREFIX.len()..].to_vec()).map_err(invalid)?;
+  let value = String::from_utf8(v).map_err(invalid)?;
+  Ok((key, value))
+}
+
+fn kv_key(key: &str) -> Vec<u8> {
+  [KV_PREFIX, key.as_bytes()].concat()
+}
+
+fn ttl_key(key: &str) -> Vec<u8> {
+  [TTL_PREFIX, key.as_bytes()].concat()
+}
+
+/// 读取 store 列族中持久化的状态机：apply 位置和过期时间索引；没有时（首次以 rocksdb 模式启动）返回 None
+pub(crate) fn load_applied(db: &DB) -> io::Result<Option<(AppliedState, TtlIndex)>> {
+  let cf = db.cf_handle(STORE_CF).unwrap();
+  let Some(data) = db.get_cf(cf, APPLIED_KEY).map_err(io::Error::other)? else {
+    return Ok(None);
+  };
+  let applied: AppliedState = serde_json::from_slice(&data)?;
+
+  let mut ttl = TtlIndex::default();
+  for item in db.iterator_cf(cf, IteratorMode::From(TTL_PREFIX, Direction::Forward)) {
+    let (k, v) = item.map_err(io::Error::other)?;
+    if !k.starts_with(TTL_PREFIX) {
+      break;
+    }
+    let key = String::from_utf8(k[TTL_PREFIX.len()..].to_vec())
+      .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+    ttl.set(&key, Some(BigEndian::read_u64(&v)));
+  }
+  Ok(Some((applied, ttl)))
+}
+
+/// 用快照文件替换 store 列族中的状态机，最后写入 applied；返回过期时间索引
+pub(crate) fn load_snapshot(db: &DB, path: &Path, applied: &AppliedState) -> io::Result<TtlIndex> {
+  let cf = db.cf_handle(STORE_CF).unwrap();
+  // 先删除 applied：中途失败后重启时不会把写了一半的数据当作完整的状态机
+  let mut batch = WriteBatch::default();
+  batch.delete_cf(cf, APPLIED_KEY);
+  batch.delete_range_cf(cf, KV_PREFIX, KV_END);
+  batch.delete_range_cf(cf, TTL_PREFIX, TTL_END);
+  db.write(batch).map_err(io::Error::other)?;
+
+  let mut batch = WriteBatch::default();
+  let ttl = snapshot::read_snapshot_with(path, |key, value| {
+    batch.put_cf(cf, kv_key(&key), value);
+    if batch.len() >= LOAD_BATCH {
+      db.write(std::mem::take(&mut batch)).map_err(io::Error::other)?;
+    }
+    Ok(())
+  })?;
+  for (key, at) in ttl.iter() {
+    batch.put_cf(cf, ttl_key(key), at.to_be_bytes());
+  }
+  batch.put_cf(cf, APPLIED_KEY, serde_json::to_vec(applied)?);
+  db.write(batch).map_err(io::Error::other)?;
+  Ok(ttl)
+}
+
+/// 以内存模式启动时删除之前 rocksdb 模式留下的状态机，避免之后切换回来时使用过期的数据
+pub(crate) fn discard(db: &DB) -> io::Result<()> {
+  let cf = db.cf_handle(STORE_CF).unwrap();
+  if db.get_cf(cf, APPLIED_KEY).map_err(io::Error::other)?.is_none() {
+    return Ok(());
+  }
+  let mut batch = WriteBatch::default();
+  batch.delete_cf(cf, APPLIED_KEY);
+  batch.delete_range_cf(cf, KV_PREFIX, KV_END);
+  batch.delete_range_cf(cf, TTL_PREFIX, TTL_END);
+  db.write(batch).map_err(io::Error::other)
+}
+
+/// 按字节数限制大小的读缓存（包括不存在的键），超出时先进先出淘汰
+#[derive(Debug)]
+struct ReadCache {
+  entries: HashMap<String, Option<String>>,
+  order: VecDeque<String>,
+  bytes: u64,
+  capacity: u64,
+  hits: u64,
+  misses: u64,
+}
+
+impl ReadCache {
+  fn new(capacity: u64) -> Self {
+    Self {
+      entries: HashMap::new(),
+      order: VecDeque::new(),
+      bytes: 0,
+      capacity,
+      hits: 0,
+      misses: 0,
+    }
+  }
+
+  fn get(&mut self, key: &str) -> Option<Option<String>> {
+    match self.entries.get(key) {
+      Some(value) => {
+        self.hits += 1;
+        Some(value.clone())
+      }
+      None => {
+        self.misses += 1;
+        None
+      }
+    }
+  }
+
+  fn insert(&mut self, key: String, value: Option<String>) {
+    let size = entry_size(&key, &value);
+    if size > self.capacity {
+      // 放不下的值不缓存，同时丢弃该键的旧值；order 中的位置也一并删除，
+      // 否则之后再插入该键时会重复加入 order，order 不受容量限制地增长
+      if let Some(old) = self.entries.remove(&key) {
+        self.bytes -= entry_size(&key, &old);
+        self.order.retain(|k| k != &key);
+      }
+      return;
+    }
+    if let Some(old) = self.entries.insert(key.clone(), value) {
+      self.bytes -= entry_size(&key, &old);
+    } else {
+      self.order.push_back(key);
+    }
+    self.bytes += size;
+    while self.bytes > self.capacity {
+      let Some(evicted) = self.order.pop_front() else {
+        break;
+      };
+      if let Some(old) = self.entries.remove(&evicted) {
+        self.bytes -= entry_size(&evicted, &old);
+      }
+    }
+  }
+
+  /// 写入已 commit：只更新已缓存的键，不让写入挤占读缓存
+  fn refresh(&mut self, key: String, value: Option<String>) {
+    if self.entries.contains_key(&key) {
+      self.insert(key, value);
+    }
+  }
+
+  fn clear(&mut self) {
+    self.entries.clear();
+    self.order.clear();
+    self.bytes = 0;
+  }
+}
+
+fn entry_size(key: &str, value: &Option<String>) -> u64 {
+  (key.len() + value.as_ref().map_or(0, |v| v.len())) as u64
+}
+
+#[cfg(test)]
+mod tests {
+  use super::*;
+
+  fn some(v: &str) -> Option<String> {
+    Some(v.to_string())
+  }
+
+  #[test]
+  fn test_read_cache_evicts_oldest() {
+    let mut cache = ReadCache::new(8);
+    cache.insert("a".to_string(), some("123"));
+    cache.insert("b".to_string(), some("123"));
+    assert_eq!(cache.bytes, 8);
+    cache.insert("c".to_string(), None);
+    assert_eq!(cache.get("a"), None);
+    assert_eq!(cache.get("b"), Some(some("123")));
+    assert_eq!(cache.get("c"), Some(None));
+    assert_eq!(cache.bytes, 5);
+    assert_eq!((cache.hits, cache.misses), (2, 1));
+  }
+
+  #[test]
+  fn test_read_cache_overwrite_keeps_one_order_entry() {
+    let mut cache = ReadCache::new(8);
+    cache.insert("a".to_string(), some("1"));
+    cache.insert("a".to_string(), some("123"));
+    assert_eq!(cache.bytes, 4);
+    assert_eq!(cache.order.len(), 1);
+  }
+
+  #[test]
+  fn test_read_cache_oversize_drops_order_entry() {
+    // 同一个键反复在放得下和放不下之间切换，order 不能累积重复的键
+    let mut cache = ReadCache::new(8);
+    for _ in 0..100 {
+      cache.insert("a".to_string(), some("1"));
+      cache.insert("a".to_string(), some("123456789"));
+    }
+    assert!(cache.entries.is_empty());
+    assert!(cache.order.is_empty());
+    assert_eq!(cache.bytes, 0);
+
+    cache.insert("a".to_string(), some("1"));
+    cache.insert("b".to_string(), some("1"));
+    assert_eq!(cache.order.len(), cache.entries.len());
+  }
+
+  #[test]
+  fn test_read_cache_refresh_only_cached() {
+    let mut cache = ReadCache::new(8);
+    cache.refresh("a".to_string(), some("1"));
+    assert!(cache.entries.is_empty());
+    cache.insert("b".to_string(), some("1"));
+    cache.refresh("b".to_string(), None);
+    assert_eq!(cache.get("b"), Some(None));
+  }
+
+  #[test]
+  fn test_disk_reports_bad_record() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    let db = Arc::new(super::super::open_db(dir.path()));
+    let cf = db.cf_handle(STORE_CF).unwrap();
+    db.put_cf(cf, kv_key("a"), "1").map_err(io::Error::other)?;
+    db.put_cf(cf, kv_key("b"), [0xffu8]).map_err(io::Error::other)?;
+    db.put_cf(cf, kv_key("c"), "3").map_err(io::Error::other)?;
+    let kvs = KvState::disk(db.clone(), 1024);
+
+    // 范围读取在损坏的记录处产出错误并结束，而不是跳过它返回看似完整的结果
+    let items: Vec<_> = kvs.range(Bound::Unbounded, Bound::Unbounded).collect();
+    assert_eq!(items.len(), 2);
+    assert_eq!(items[0].as_ref().unwrap().0, "a");
+    assert_eq!(items[1].as_ref().unwrap_err().kind(), io::ErrorKind::InvalidData);
+
+    assert_eq!(kvs.get("b").unwrap_err().kind(), io::ErrorKind::InvalidData);
+    assert_eq!(kvs.get("c")?, some("3"));
+    Ok(())
+  }
+
+  #[test]
+  fn test_memory_state() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    assert_eq!(kvs.insert("a".to_string(), "1".to_string())?, None);
+    assert_eq!(kvs.insert("a".to_string(), "2".to_string())?, some("1"));
+    assert!(kvs.contains_key("a")?);
+    assert_eq!(kvs.remove("a")?, some("2"));
+    assert_eq!(kvs.get("a")?, None);
+    Ok(())
+  }
+}
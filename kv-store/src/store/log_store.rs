@@ -4,13 +4,19 @@ use std::io;
 use std::marker::PhantomData;
 use std::ops::RangeBounds;
 use std::sync::Arc;
+use std::sync::mpsc;
+use std::time::Duration;
+use std::time::Instant;
 
+use bincode::Options;
 use byteorder::BigEndian;
 use byteorder::ReadBytesExt;
 use byteorder::WriteBytesExt;
 
 use meta::StoreMeta;
 
+use super::compaction::LogStats;
+
 use openraft::LogState;
 use openraft::OptionalSend;
 use openraft::RaftLogReader;
@@ -27,15 +33,46 @@ use openraft::storage::RaftLogStorage;
 use rocksdb::ColumnFamily;
 use rocksdb::DB;
 use rocksdb::Direction;
+use rocksdb::WriteBatch;
 
+use serde::Serialize;
+use serde::de::DeserializeOwned;
 use tokio::task::spawn_blocking;
 
+// log entry 的存储格式：第一个字节为格式版本，之后是 bincode 编码（变长整数）的 entry。
+// 旧版本直接保存 JSON，第一个字节总是 `{`，读取时仍按 JSON 解析
+const LOG_FORMAT_BINARY: u8 = 1;
+const LOG_FORMAT_JSON: u8 = b'{';
+
+/// append 之后如何把 WAL 持久化到磁盘
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum WalSync {
+  // 每次 append 单独 fsync
+  Always,
+  // 组提交：相近到达的 append 共享一次 fsync；一次 fsync 最多等待 max_delay 收集最多 max_batch 个 append
+  Group { max_delay: Duration, max_batch: usize },
+  // 写入 WAL 缓冲后立即确认，不等待 fsync；宕机可能丢失已确认的 log，只用于基准测试
+  Relaxed,
+}
+
+// 默认与之前的版本一样每次 append 单独 fsync，组提交需显式开启
+impl Default for WalSync {
+  fn default() -> Self {
+    WalSync::Always
+  }
+}
+
 #[derive(Debug, Clone)]
 pub struct RocksLogStore<C>
 where
   C: RaftTypeConfig,
 {
   db: Arc<DB>,
+  wal_sync: WalSync,
+  // 组提交时等待 fsync 的回调，由后台线程批量确认
+  group_commit: Option<mpsc::Sender<IOFlushed<C>>>,
+  // 写入字节数、purge 和 compaction 统计
+  stats: Arc<LogStats>,
   _p: PhantomData<C>,
 }
 
@@ -43,15 +80,35 @@ impl<C> RocksLogStore<C>
 where
   C: RaftTypeConfig,
 {
-  pub fn new(db: Arc<DB>) -> Self {
+  pub fn new(db: Arc<DB>, wal_sync: WalSync, stats: Arc<LogStats>) -> Self {
     // 确保 RocksDB column family：`meta` 用于存储元数据，`logs` 用于存储日志条目
     db.cf_handle("meta")
       .expect("column family `meta` not found");
     db.cf_handle("logs")
       .expect("column family `logs` not found");
 
+    let group_commit = match wal_sync {
+      WalSync::Group {
+        max_delay,
+        max_batch,
+      } => {
+        let (tx, rx) = mpsc::channel();
+        let db = db.clone();
+        // 所有 store 副本被释放后 channel 关闭，线程退出
+        std::thread::Builder::new()
+          .name("wal-group-commit".to_string())
+          .spawn(move || group_commit_loop::<C>(db, rx, max_delay, max_batch.max(1)))
+          .expect("failed to spawn wal group commit thread");
+        Some(tx)
+      }
+      _ => None,
+    };
+
     Self {
       db,
+      wal_sync,
+      group_commit,
+      stats,
       _p: Default::default(),
     }
   }
@@ -125,7 +182,7 @@ where
         break;
       }
 
-      let entry: EntryOf<C> = serde_json::from_slice(&val).map_err(read_logs_err)?;
+      let entry: EntryOf<C> = decode_entry(&val)?;
 
       // assert_eq!(id, entry.index());
       res.push(entry);
@@ -155,7 +212,7 @@ where
       None => None,
       Some(res) => {
         let (_log_index, entry_bytes) = res.map_err(read_logs_err)?;
-        let ent = serde_json::from_slice::<EntryOf<C>>(&entry_bytes).map_err(read_logs_err)?;
+        let ent = decode_entry::<EntryOf<C>>(&entry_bytes)?;
         Some(ent.log_id())
       }
     };
@@ -183,7 +240,7 @@ where
     // 将投票写入
     self.put_meta::<meta::Vote>(vote)?;
 
-    // 在返回前把 vote 持久化到磁盘
+    // 在返回前把 vote 持久化到磁盘（与 WalSync 无关，vote 丢失可能导致同一 term 投出两票）
     let db = self.db.clone();
     spawn_blocking(move || db.flush_wal(true))
       .await
@@ -197,25 +254,36 @@ where
   where
     I: IntoIterator<Item = EntryOf<C>> + Send,
   {
-    // 将传入的每个 entry 写入 `logs` 列族
+    // 将传入的 entry 作为一个 WriteBatch 写入 `logs` 列族
+    let mut batch = WriteBatch::default();
     for entry in entries {
-      let id = id_to_bin(entry.index());
-      self
-        .db
-        .put_cf(
-          self.cf_logs(),
-          id,
-          serde_json::to_vec(&entry).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?,
-        )
-        .map_err(|e| io::Error::other(e.to_string()))?;
+      batch.put_cf(self.cf_logs(), id_to_bin(entry.index()), encode_entry(&entry)?);
+    }
+    let bytes = batch.size_in_bytes() as u64;
+    self
+      .db
+      .write(batch)
+      .map_err(|e| io::Error::other(e.to_string()))?;
+    self.stats.record_append(bytes);
+
+    // entry 已写入 WAL，fsync 之后才能通知 raft 这些 log 已持久化
+    match self.wal_sync {
+      WalSync::Always => {
+        let db = self.db.clone();
+        let handle = spawn_blocking(move || {
+          let res = db.flush_wal(true).map_err(io::Error::other);
+          callback.io_completed(res);
+        });
+        drop(handle);
+      }
+      WalSync::Group { .. } => {
+        // 后台线程在下一次 fsync 完成后确认；线程已退出时 send 会交还回调，只能报错
+        if let Err(mpsc::SendError(callback)) = self.group_commit.as_ref().unwrap().send(callback) {
+          callback.io_completed(Err(io::Error::other("wal group commit thread stopped")));
+        }
+      }
+      WalSync::Relaxed => callback.io_completed(Ok(())),
     }
-
-    let db = self.db.clone();
-    let handle = spawn_blocking(move || {
-      let res = db.flush_wal(true).map_err(io::Error::other);
-      callback.io_completed(res);
-    });
-    drop(handle);
 
     Ok(())
   }
@@ -244,6 +312,8 @@ where
       .db
       .delete_range_cf(self.cf_logs(), &from, &to)
       .map_err(|e| io::Error::other(e.to_string()))?;
+    // delete_range 只写入删除标记，compact 之后才真正释放磁盘空间
+    self.stats.purged(to);
 
     Ok(())
   }
@@ -286,6 +356,61 @@ mod meta {
   }
 }
 
+// 组提交：取出第一个等待的回调后，在 max_delay 内继续收集（已排队的回调总是一并取出），
+// 一次 fsync 使这些回调之前写入的所有 entry 持久化，然后统一确认。
+// fsync 进行期间到达的 append 自然地进入下一批
+fn group_commit_loop<C: RaftTypeConfig>(
+  db: Arc<DB>,
+  rx: mpsc::Receiver<IOFlushed<C>>,
+  max_delay: Duration,
+  max_batch: usize,
+) {
+  while let Ok(first) = rx.recv() {
+    let deadline = Instant::now() + max_delay;
+    let mut callbacks = vec![first];
+    while callbacks.len() < max_batch {
+      match rx.recv_timeout(deadline.saturating_duration_since(Instant::now())) {
+        Ok(callback) => callbacks.push(callback),
+        Err(_) => break,
+      }
+    }
+
+    let res = db.flush_wal(true);
+    for callback in callbacks {
+      callback.io_completed(res.as_ref().map(|_| ()).map_err(|e| io::Error::other(e.to_string())));
+    }
+  }
+}
+
+fn codec() -> impl Options {
+  bincode::DefaultOptions::new()
+}
+
+/// 按当前格式编码一个 log entry
+pub fn encode_entry<E: Serialize>(entry: &E) -> Result<Vec<u8>, io::Error> {
+  let mut buf = vec![LOG_FORMAT_BINARY];
+  codec()
+    .serialize_into(&mut buf, entry)
+    .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+  Ok(buf)
+}
+
+/// 按第一个字节的格式版本解码一个 log entry
+pub fn decode_entry<E: DeserializeOwned>(bytes: &[u8]) -> Result<E, io::Error> {
+  match bytes.first() {
+    Some(&LOG_FORMAT_BINARY) => codec()
+      .deserialize(&bytes[1..])
+      .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e)),
+    Some(&LOG_FORMAT_JSON) => {
+      serde_json::from_slice(bytes).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))
+    }
+    _ => Err(io::Error::new(
+      io::ErrorKind::InvalidData,
+      "unknown log entry format",
+    )),
+  }
+}
+
 fn id_to_bin(id: u64) -> Vec<u8> {
   let mut buf = Vec::with_capacity(8);
   buf.write_u64::<BigEndian>(id).unwrap();
@@ -299,3 +424,88 @@ fn bin_to_id(buf: &[u8]) -> u64 {
 fn read_logs_err(e: impl Error + 'static) -> io::Error {
   io::Error::other(e.to_string())
 }
+
+#[cfg(test)]
+mod tests {
+  use openraft::Entry;
+  use openraft::testing::log_id;
+
+  use super::*;
+  use crate::TypeConfig;
+  use crate::store::Guard;
+  use crate::store::Request;
+
+  fn entries() -> Vec<Entry<TypeConfig>> {
+    let put = |key: &str, expire_at| Request::Put {
+      key: key.to_string(),
+      value: "v".repeat(300),
+      expire_at,
+    };
+    let requests = vec![
+      put("a", None),
+      put("b", Some(u64::MAX)),
+      Request::Del { key: "a".to_string() },
+      Request::Batch {
+        ops: vec![put("c", None), Request::Del { key: "d".to_string() }],
+      },
+      Request::Txn {
+        guards: vec![
+          Guard::Equals {
+            key: "c".to_string(),
+            value: None,
+          },
+          Guard::Exists { key: "d".to_string() },
+        ],
+        ops: vec![put("e", Some(1))],
+      },
+      Request::Expire {
+        keys: vec![("b".to_string(), 7)],
+      },
+    ];
+    let mut entries = vec![Entry::<TypeConfig>::new_blank(log_id::<TypeConfig>(1, 1, 1))];
+    for (i, req) in requests.into_iter().enumerate() {
+      entries.push(Entry::new_normal(log_id::<TypeConfig>(1, 1, i as u64 + 2), req));
+    }
+    entries
+  }
+
+  // Request 没有实现 PartialEq，按 JSON 比较
+  fn json(entry: &Entry<TypeConfig>) -> serde_json::Value {
+    serde_json::to_value(entry).unwrap()
+  }
+
+  #[test]
+  fn test_binary_round_trip() -> io::Result<()> {
+    for entry in entries() {
+      let bytes = encode_entry(&entry)?;
+      assert_eq!(bytes[0], LOG_FORMAT_BINARY);
+      let decoded: Entry<TypeConfig> = decode_entry(&bytes)?;
+      assert_eq!(json(&decoded), json(&entry));
+    }
+    Ok(())
+  }
+
+  #[test]
+  fn test_decode_legacy_json() -> io::Result<()> {
+    for entry in entries() {
+      let bytes = serde_json::to_vec(&entry)?;
+      assert_eq!(bytes[0], LOG_FORMAT_JSON);
+      let decoded: Entry<TypeConfig> = decode_entry(&bytes)?;
+      assert_eq!(json(&decoded), json(&entry));
+    }
+    Ok(())
+  }
+
+  #[test]
+  fn test_unknown_format() {
+    let entry = &entries()[1];
+    let mut bytes = encode_entry(entry).unwrap();
+    bytes[0] = 2;
+    let err = decode_entry::<Entry<TypeConfig>>(&bytes).unwrap_err();
+    assert_eq!(err.kind(), io::ErrorKind::InvalidData);
+    assert!(decode_entry::<Entry<TypeConfig>>(&[]).is_err());
+    // 截断的二进制 entry 不能被当作完整的 entry
+    let bytes = encode_entry(entry).unwrap();
+    assert!(decode_entry::<Entry<TypeConfig>>(&bytes[..bytes.len() - 1]).is_err());
+  }
+}
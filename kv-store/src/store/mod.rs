@@ -2,13 +2,24 @@ use std::collections::BTreeMap;
 use std::fmt;
 use std::fmt::Debug;
 use std::io;
-use std::io::Cursor;
+use std::ops::Bound;
 use std::path::Path;
+use std::path::PathBuf;
 use std::sync::Arc;
+use std::sync::Mutex;
+use std::sync::atomic::AtomicU64;
+use std::sync::atomic::Ordering;
+use std::time::Instant;
 
+use compaction::LogStats;
 use futures::Stream;
 use futures::TryStreamExt;
+use kv::AppliedState;
+use kv::KvState;
+use kv::StateBackend;
 use log_store::RocksLogStore;
+use log_store::WalSync;
+use mvcc::VersionLog;
 use openraft::EntryPayload;
 use openraft::OptionalSend;
 use openraft::RaftSnapshotBuilder;
@@ -20,18 +31,75 @@ use rocksdb::DB;
 use rocksdb::Options;
 use serde::Deserialize;
 use serde::Serialize;
+use snapshot::SnapshotFile;
+use snapshot::UndoLog;
+use tokio::fs::File;
+use tokio::io::AsyncWriteExt;
 use tokio::sync::RwLock;
+use tokio::task::spawn_blocking;
+use ttl::TtlIndex;
+use watch::ChangeEvent;
+use watch::ChangeFeed;
 
 use crate::TypeConfig;
 use crate::typ::*;
 
+pub mod compaction;
+pub mod kv;
 pub mod log_store;
+pub mod mvcc;
+pub mod snapshot;
+pub mod ttl;
+pub mod watch;
+
+// 构建快照时每次持有读锁序列化的最大条目数
+const SNAPSHOT_CHUNK: usize = 4096;
 
 #[derive(Serialize, Deserialize, Debug, Clone)]
 pub enum Request {
   // log 内部信息 记录其如何被 apply(解释)， 这里直接用 Request
-  Put { key: String, value: String },
+  // expire_at 为过期时间（unix 毫秒），缺省表示不过期
+  // log 以 bincode 保存，字段需要总是序列化（不能使用 skip_serializing_if）
+  Put {
+    key: String,
+    value: String,
+    #[serde(default)]
+    expire_at: Option<u64>,
+  },
   Del { key: String },
+  // 多个写操作合并为一条 log，一次共识提交
+  Batch { ops: Vec<Request> },
+  // 事务：所有 guard 成立时才执行 ops，检查与执行在同一次 apply 中原子完成；
+  // CAS 即一个 Equals guard 加一个 Put/Del
+  Txn { guards: Vec<Guard>, ops: Vec<Request> },
+  // 由 leader 提交，删除到期的键；只有过期时间仍与 log 中记录的一致时才删除（期间被重新写入的键不受影响）
+  Expire { keys: Vec<(String, u64)> },
+}
+
+/// 事务执行的前提条件，比较的是 kv-store 中保存的值
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub enum Guard {
+  // 键存在且值等于 value；value 为 None 时要求键不存在
+  Equals { key: String, value: Option<String> },
+  Exists { key: String },
+  Missing { key: String },
+}
+
+impl Guard {
+  pub fn key(&self) -> &str {
+    match self {
+      Guard::Equals { key, .. } | Guard::Exists { key } | Guard::Missing { key } => key,
+    }
+  }
+
+  fn holds(&self, kvs: &KvState) -> io::Result<bool> {
+    // guard 比较的是状态机中的值；已到期但尚未被 Expire 删除的键仍视为存在
+    Ok(match self {
+      Guard::Equals { key, value } => kvs.get(key)?.as_ref() == value.as_ref(),
+      Guard::Exists { key } => kvs.contains_key(key)?,
+      Guard::Missing { key } => !kvs.contains_key(key)?,
+    })
+  }
 }
 
 impl fmt::Display for Request {
@@ -39,22 +107,125 @@ impl fmt::Display for Request {
     match self {
       Request::Put { key, value, .. } => write!(f, "Put {{ key: {}, value: {} }}", key, value),
       Request::Del { key } => write!(f, "Del {{ key: {} }}", key),
+      Request::Batch { ops } => write!(f, "Batch {{ ops: {} }}", ops.len()),
+      Request::Txn { guards, ops } => {
+        write!(f, "Txn {{ guards: {}, ops: {} }}", guards.len(), ops.len())
+      }
+      Request::Expire { keys } => write!(f, "Expire {{ keys: {} }}", keys.len()),
     }
   }
 }
 
+// 将一个写操作作用到 kv 数据上，调用方已持有写锁；实际发生的变更追加到 events，修改前的值记入 versions。
+// 读取状态机失败（rocksdb 模式）时返回错误，由 apply 作为存储错误交给 openraft
+fn apply_request(
+  kvs: &mut KvState,
+  ttl: &mut TtlIndex,
+  versions: &mut VersionLog,
+  req: Request,
+  index: u64,
+  events: &mut Vec<ChangeEvent>,
+) -> io::Result<Response> {
+  Ok(match req {
+    Request::Put {
+      key,
+      value,
+      expire_at,
+    } => {
+      // 返回原值，新增的键为 None
+      let old = kvs.insert(key.clone(), value.clone())?;
+      events.push(ChangeEvent {
+        index,
+        key: key.clone(),
+        value: Some(value),
+      });
+      ttl.set(&key, expire_at);
+      versions.record(index, key, old.clone());
+      Response::new(old)
+    }
+    Request::Del { key } => {
+      // delete 操作，返回被删除的值，键不存在时为 None
+      let removed = kvs.remove(&key)?;
+      ttl.set(&key, None);
+      if removed.is_some() {
+        events.push(ChangeEvent {
+          index,
+          key: key.clone(),
+          value: None,
+        });
+        versions.record(index, key, removed.clone());
+      }
+      Response::new(removed)
+    }
+    Request::Batch { ops } => {
+      // 每个操作的结果：Put 为原值，Del 为被删除的值，键原本不存在时为 None
+      let mut results = Vec::with_capacity(ops.len());
+      for op in ops {
+        results.push(apply_request(kvs, ttl, versions, op, index, events)?.value);
+      }
+      Response {
+        value: Some("Ok".to_string()),
+        results,
+      }
+    }
+    Request::Txn { guards, ops } => {
+      // guard 全部成立：value 为 "Ok"，results 为每个操作的结果（同 Batch）；
+      // 否则不执行任何操作，value 为 None，results 为各 guard 键的当前值，调用方可据此重试而不必再读一次
+      for g in &guards {
+        if !g.holds(kvs)? {
+          return Ok(Response {
+            value: None,
+            results: guards.iter().map(|g| kvs.get(g.key())).collect::<io::Result<_>>()?,
+          });
+        }
+      }
+      let mut response = apply_request(kvs, ttl, versions, Request::Batch { ops }, index, events)?;
+      response.value = Some("Ok".to_string());
+      response
+    }
+    Request::Expire { keys } => {
+      // 过期时间与 leader 提交时一致才删除，各副本的结果相同，与本地时钟无关
+      for (key, at) in keys {
+        if ttl.expired_at(&key, at) {
+          apply_request(kvs, ttl, versions, Request::Del { key }, index, events)?;
+        }
+      }
+      Response::new(None)
+    }
+  })
+}
+
 // 一个 log 被 apply 的结果，这里直接写为 Response
 #[derive(Serialize, Deserialize, Debug, Clone)]
 pub struct Response {
   pub value: Option<String>,
+  // Batch 中每个操作的结果，与 ops 一一对应
+  #[serde(default, skip_serializing_if = "Vec::is_empty")]
+  pub results: Vec<Option<String>>,
+}
+
+impl Response {
+  pub fn new(value: Option<String>) -> Self {
+    Self {
+      value,
+      results: Vec::new(),
+    }
+  }
 }
 
 #[derive(Serialize, Deserialize, Debug, Clone)]
 pub struct StoredSnapshot {
   // 日志数据
   pub meta: SnapshotMeta,
-  /// 状态机数据
-  pub data: Vec<u8>,
+  /// 状态机数据所在的二进制快照文件
+  pub path: PathBuf,
+}
+
+/// 旧版本保存的快照：状态机数据（kvs 的 JSON）直接放在 store 列族中
+#[derive(Deserialize)]
+struct LegacyStoredSnapshot {
+  meta: SnapshotMeta,
+  data: Vec<u8>,
 }
 
 #[derive(Debug, Clone)]
@@ -65,6 +236,18 @@ pub struct StateMachineStore {
 
   /// snapshot
   db: Arc<DB>,
+
+  /// 快照文件目录
+  snapshot_dir: PathBuf,
+
+  /// 快照点的过期时间索引（只在快照构建器中使用）
+  snapshot_ttl: TtlIndex,
+
+  /// 与 log store 共享的快照和 log 压缩统计
+  pub log_stats: Arc<LogStats>,
+
+  /// 状态机数据保存在内存中还是 store 列族中
+  backend: StateBackend,
 }
 
 #[derive(Debug, Clone)]
@@ -74,21 +257,32 @@ pub struct StateMachineData {
   pub last_membership: StoredMembership,
 
   /// log apply 后的数据 最后记录为 snapshot
-  pub kvs: Arc<RwLock<BTreeMap<String, String>>>,
+  pub kvs: Arc<RwLock<KvState>>,
+
+  /// 已 apply 的 log index，在持有 kvs 写锁时更新，读请求在读锁下取得与数据一致的值
+  pub applied_index: Arc<AtomicU64>,
+
+  /// 键的过期时间索引，在持有 kvs 写锁时更新
+  pub ttl: Arc<std::sync::RwLock<TtlIndex>>,
+
+  /// 写操作产生的变更事件，供 /watch 订阅
+  pub changes: Arc<ChangeFeed>,
+
+  /// 构建快照期间记录被修改键的旧值，使快照可以分块扫描 kvs 而不阻塞 apply
+  pub snapshot_undo: Arc<Mutex<Option<UndoLog>>>,
+
+  /// 最近 VERSION_RETAIN 条 log 内被修改键的旧值，供按 log index 读取和扫描，在持有 kvs 写锁时更新
+  pub versions: Arc<std::sync::RwLock<VersionLog>>,
 }
 
 impl RaftSnapshotBuilder<TypeConfig> for StateMachineStore {
   async fn build_snapshot(&mut self) -> Result<Snapshot, io::Error> {
     // 构造当前数据状态的 snapshot
+    // last_applied 与 undo 记录的起点在 get_snapshot_builder 中同时确定
+    let start = Instant::now();
     let last_applied_log = self.data.last_applied_log_id;
     let last_membership = self.data.last_membership.clone();
 
-    let kv_json = {
-      // 序列化数据
-      let kvs = self.data.kvs.read().await;
-      serde_json::to_vec(&*kvs).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?
-    };
-
     let snapshot_id = if let Some(last) = last_applied_log {
       format!(
         "{}-{}-{}",
@@ -100,6 +294,14 @@ impl RaftSnapshotBuilder<TypeConfig> for StateMachineStore {
       format!("--{}", self.snapshot_idx)
     };
 
+    let path = self.snapshot_path(&snapshot_id);
+    let tmp = path.with_extension("tmp");
+    let res = self.write_snapshot_file(&tmp).await;
+    // 无论成功与否，都停止记录 undo
+    *self.data.snapshot_undo.lock().unwrap() = None;
+    res?;
+    tokio::fs::rename(&tmp, &path).await?;
+
     let meta = SnapshotMeta {
       last_log_id: last_applied_log,
       last_membership,
@@ -108,61 +310,263 @@ impl RaftSnapshotBuilder<TypeConfig> for StateMachineStore {
 
     let snapshot = StoredSnapshot {
       meta: meta.clone(),
-      data: kv_json.clone(),
+      path: path.clone(),
     };
 
-    self.set_current_snapshot_(snapshot)?;
+    self.set_current_snapshot_(snapshot).await?;
+
+    let file = SnapshotFile::open(&path).await?;
+    let file_bytes = file.len().await?;
+    self.log_stats.record_snapshot(start.elapsed(), file_bytes);
 
     Ok(Snapshot {
       meta,
-      snapshot: Cursor::new(kv_json),
+      snapshot: file,
     })
   }
 }
 
 impl StateMachineStore {
-  async fn new(db: Arc<DB>) -> Result<StateMachineStore, io::Error> {
+  async fn new(
+    db: Arc<DB>,
+    snapshot_dir: PathBuf,
+    log_stats: Arc<LogStats>,
+    backend: StateBackend,
+  ) -> Result<StateMachineStore, io::Error> {
+    let kvs = match backend {
+      StateBackend::Memory => {
+        kv::discard(&db)?;
+        KvState::default()
+      }
+      StateBackend::Rocksdb { cache_bytes } => KvState::disk(db.clone(), cache_bytes),
+    };
     let mut sm = Self {
       data: StateMachineData {
         last_applied_log_id: None,
         last_membership: Default::default(),
-        kvs: Arc::new(Default::default()),
+        kvs: Arc::new(RwLock::new(kvs)),
+        applied_index: Arc::new(AtomicU64::new(0)),
+        ttl: Arc::new(Default::default()),
+        changes: Arc::new(ChangeFeed::default()),
+        snapshot_undo: Arc::new(Mutex::new(None)),
+        versions: Arc::new(Default::default()),
       },
       snapshot_idx: 0,
       db,
+      snapshot_dir,
+      snapshot_ttl: TtlIndex::default(),
+      log_stats,
+      backend,
     };
+    sm.upgrade_legacy_snapshot_().await?;
 
-    let snapshot = sm.get_current_snapshot_()?;
-    if let Some(snap) = snapshot {
+    // rocksdb 模式下 store 列族中已有状态机时直接使用，只需重放之后的 log
+    let applied = match backend {
+      StateBackend::Memory => None,
+      StateBackend::Rocksdb { .. } => kv::load_applied(&sm.db)?,
+    };
+    if let Some((applied, ttl)) = applied {
+      sm.restore_applied_(applied, ttl);
+    } else if let Some(snap) = sm.get_current_snapshot_()? {
       sm.update_state_machine_(snap).await?; // 初始化时调用 update 更新状态机
     }
 
     Ok(sm)
   }
 
+  fn restore_applied_(&mut self, applied: AppliedState, ttl: TtlIndex) {
+    let index = applied.last_applied_log_id.map(|id| id.index()).unwrap_or(0);
+    self.data.last_applied_log_id = applied.last_applied_log_id;
+    self.data.last_membership = applied.last_membership;
+    *self.data.ttl.write().unwrap() = ttl;
+    self.data.applied_index.store(index, Ordering::Release);
+    self.data.changes.reset(index);
+    self.data.versions.write().unwrap().reset(index);
+  }
+
   async fn update_state_machine_(&mut self, snapshot: StoredSnapshot) -> Result<(), io::Error> {
-    let kvs: BTreeMap<String, String> = serde_json::from_slice(&snapshot.data)
-      .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+    let path = snapshot.path.clone();
+    // 持有写锁直到状态全部更新
+    let _kvs = match self.backend {
+      StateBackend::Memory => {
+        // 在阻塞线程中流式解析快照文件，解析完成后再获取写锁
+        let (kvs, ttl) = spawn_blocking(move || snapshot::read_snapshot(&path))
+          .await
+          .map_err(io::Error::other)??;
+        let mut x = self.data.kvs.write().await;
+        *x = KvState::Memory(kvs);
+        *self.data.ttl.write().unwrap() = ttl;
+        x
+      }
+      StateBackend::Rocksdb { .. } => {
+        // 快照直接写入 store 列族；持有写锁，读请求不会看到写了一半的数据
+        let mut x = self.data.kvs.write().await;
+        let db = self.db.clone();
+        let applied = AppliedState {
+          last_applied_log_id: snapshot.meta.last_log_id,
+          last_membership: snapshot.meta.last_membership.clone(),
+        };
+        let ttl = spawn_blocking(move || kv::load_snapshot(&db, &path, &applied))
+          .await
+          .map_err(io::Error::other)??;
+        x.clear_cache();
+        *self.data.ttl.write().unwrap() = ttl;
+        x
+      }
+    };
 
     self.data.last_applied_log_id = snapshot.meta.last_log_id;
     self.data.last_membership = snapshot.meta.last_membership.clone();
-    let mut x = self.data.kvs.write().await;
-    *x = kvs;
+    let index = snapshot.meta.last_log_id.map(|id| id.index()).unwrap_or(0);
+    self.data.applied_index.store(index, Ordering::Release);
+    // 快照之前的变更事件和旧版本不再可用
+    self.data.changes.reset(index);
+    self.data.versions.write().unwrap().reset(index);
 
     Ok(())
   }
 
+  /// 分块扫描 kvs 写入快照文件，每块只在序列化期间持有读锁；
+  /// 快照点之后被修改的键使用 undo 中记录的旧值，得到与 last_applied 一致的快照
+  async fn write_snapshot_file(&self, path: &Path) -> Result<(), io::Error> {
+    let mut file = File::create(path).await?;
+    let mut buf = Vec::new();
+    snapshot::write_header(&mut buf);
+
+    let mut next: Bound<String> = Bound::Unbounded;
+    loop {
+      let mut count = 0;
+      let mut last = None;
+      {
+        let kvs = self.data.kvs.read().await;
+        let undo = self.data.snapshot_undo.lock().unwrap();
+        let lower = match &next {
+          Bound::Excluded(k) => Bound::Excluded(k.as_str()),
+          _ => Bound::Unbounded,
+        };
+        for item in kvs.range(lower, Bound::Unbounded) {
+          // 读取失败时放弃这次快照，不能生成缺少数据的快照
+          let (k, v) = item?;
+          match undo.as_ref().and_then(|u| u.get(k.as_ref())) {
+            // 快照点之后被修改过
+            Some(Some(old)) => snapshot::write_record(&mut buf, &k, old),
+            // 快照点之后才插入
+            Some(None) => {}
+            None => snapshot::write_record(&mut buf, &k, &v),
+          }
+          count += 1;
+          if count == SNAPSHOT_CHUNK {
+            last = Some(k.into_owned());
+            break;
+          }
+        }
+      }
+
+      file.write_all(&buf).await?;
+      buf.clear();
+
+      match last {
+        Some(k) => next = Bound::Excluded(k),
+        None => break,
+      }
+    }
+
+    {
+      // 快照点之后被删除的键
+      let kvs = self.data.kvs.read().await;
+      let undo = self.data.snapshot_undo.lock().unwrap();
+      if let Some(undo) = undo.as_ref() {
+        for (k, old) in undo.iter() {
+          if let Some(old) = old {
+            if !kvs.contains_key(k)? {
+              snapshot::write_record(&mut buf, k, old);
+            }
+          }
+        }
+      }
+    }
+
+    snapshot::write_end(&mut buf);
+    for (key, at) in self.snapshot_ttl.iter() {
+      snapshot::write_ttl(&mut buf, key, *at);
+    }
+    snapshot::write_end(&mut buf);
+    file.write_all(&buf).await?;
+    file.sync_all().await?;
+    Ok(())
+  }
+
+  fn snapshot_path(&self, snapshot_id: &str) -> PathBuf {
+    let name: String = snapshot_id
+      .chars()
+      .map(|c| if c.is_ascii_alphanumeric() || c == '-' { c } else { '_' })
+      .collect();
+    self.snapshot_dir.join(format!("{}.snap", name))
+  }
+
   fn get_current_snapshot_(&self) -> Result<Option<StoredSnapshot>, io::Error> {
-    Ok(
-      self
-        .db
-        .get_cf(self.store(), b"snapshot")
-        .map_err(io::Error::other)?
-        .and_then(|v| serde_json::from_slice(&v).ok()),
-    )
+    self
+      .db
+      .get_cf(self.store(), b"snapshot")
+      .map_err(io::Error::other)?
+      .map(|v| serde_json::from_slice(&v))
+      .transpose()
+      .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))
+  }
+
+  /// 把旧版本以 JSON 保存的快照转换为快照文件。
+  /// 快照之前的 log 已按清理策略删除，不能丢弃旧快照从 log 重建；无法识别的格式使启动失败
+  async fn upgrade_legacy_snapshot_(&self) -> Result<(), io::Error> {
+    let Some(v) = self.db.get_cf(self.store(), b"snapshot").map_err(io::Error::other)? else {
+      return Ok(());
+    };
+    if serde_json::from_slice::<StoredSnapshot>(&v).is_ok() {
+      return Ok(());
+    }
+    let legacy: LegacyStoredSnapshot = serde_json::from_slice(&v).map_err(|e| {
+      io::Error::new(
+        io::ErrorKind::InvalidData,
+        format!("unknown stored snapshot format: {}", e),
+      )
+    })?;
+    let kvs: BTreeMap<String, String> = serde_json::from_slice(&legacy.data)
+      .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+
+    let path = self.snapshot_path(&legacy.meta.snapshot_id);
+    let tmp = path.with_extension("tmp");
+    let mut buf = Vec::new();
+    snapshot::write_header(&mut buf);
+    for (k, v) in &kvs {
+      snapshot::write_record(&mut buf, k, v);
+    }
+    // 旧格式没有过期时间
+    snapshot::write_end(&mut buf);
+    snapshot::write_end(&mut buf);
+    let mut file = File::create(&tmp).await?;
+    file.write_all(&buf).await?;
+    file.sync_all().await?;
+    tokio::fs::rename(&tmp, &path).await?;
+
+    tracing::info!(
+      "converted legacy snapshot {} ({} keys) to {}",
+      legacy.meta.snapshot_id,
+      kvs.len(),
+      path.display()
+    );
+    // 旧记录无法按当前格式解析，不经过 set_current_snapshot_ 直接覆盖
+    let snap = StoredSnapshot {
+      meta: legacy.meta,
+      path,
+    };
+    self
+      .db
+      .put_cf(self.store(), b"snapshot", serde_json::to_vec(&snap)?)
+      .map_err(io::Error::other)?;
+    self.db.flush_wal(true).map_err(io::Error::other)
   }
 
-  fn set_current_snapshot_(&self, snap: StoredSnapshot) -> Result<(), io::Error> {
+  async fn set_current_snapshot_(&self, snap: StoredSnapshot) -> Result<(), io::Error> {
+    let old = self.get_current_snapshot_()?;
     self
       .db
       .put_cf(
@@ -172,6 +576,13 @@ impl StateMachineStore {
       )
       .map_err(io::Error::other)?;
     self.db.flush_wal(true).map_err(io::Error::other)?;
+
+    // 删除被替换的快照文件（正在发送它的文件句柄不受影响）
+    if let Some(old) = old {
+      if old.path != snap.path {
+        tokio::fs::remove_file(&old.path).await.ok();
+      }
+    }
     Ok(())
   }
 
@@ -191,51 +602,90 @@ impl RaftStateMachine<TypeConfig> for StateMachineStore {
     ))
   }
 
-  async fn apply<Strm>(&mut self, mut entries: Strm) -> Result<(), io::Error>
+  async fn apply<Strm>(&mut self, entries: Strm) -> Result<(), io::Error>
   where
     Strm: Stream<Item = Result<EntryResponder<TypeConfig>, io::Error>> + Unpin + OptionalSend,
   {
-    while let Some((entry, responder)) = entries.try_next().await? {
-      self.data.last_applied_log_id = Some(entry.log_id);
-
-      let response = match entry.payload {
-        // 将 log 的 payload 解构
-        EntryPayload::Blank => Response { value: None },
-        EntryPayload::Normal(req) => match req {
-          Request::Put { key, value } => {
-            let mut st = self.data.kvs.write().await;
-            st.insert(key, value.clone());
-            Response { value: Some(value) }
-          }
-          Request::Del { key } => {
-            let mut st = self.data.kvs.write().await;
-            // delete 操作
-            st.remove(&key);
-            Response {
-              value: Some("Ok".to_string()),
+    let entries: Vec<EntryResponder<TypeConfig>> = entries.try_collect().await?;
+    let mut replies = Vec::with_capacity(entries.len());
+    let mut events = Vec::new();
+    let mut last_index = 0;
+
+    {
+      // 整批 entry 只获取一次写锁
+      let kvs = self.data.kvs.clone();
+      let mut st = kvs.write().await;
+
+      for (entry, responder) in entries {
+        self.data.last_applied_log_id = Some(entry.log_id);
+
+        let response = match entry.payload {
+          // 将 log 的 payload 解构
+          EntryPayload::Blank => Response::new(None),
+          EntryPayload::Normal(req) => {
+            // 正在构建快照时，先记录将被修改的键的旧值
+            if let Some(undo) = self.data.snapshot_undo.lock().unwrap().as_mut() {
+              snapshot::record_undo(undo, &st, &req)?;
             }
+            let mut ttl = self.data.ttl.write().unwrap();
+            let mut versions = self.data.versions.write().unwrap();
+            apply_request(
+              &mut st,
+              &mut ttl,
+              &mut versions,
+              req,
+              entry.log_id.index(),
+              &mut events,
+            )?
           }
-        },
-        EntryPayload::Membership(mem) => {
-          self.data.last_membership = StoredMembership::new(Some(entry.log_id), mem);
-          Response { value: None }
-        }
-      };
+          EntryPayload::Membership(mem) => {
+            self.data.last_membership = StoredMembership::new(Some(entry.log_id), mem);
+            Response::new(None)
+          }
+        };
+        self.data.applied_index.store(entry.log_id.index(), Ordering::Release);
+        last_index = entry.log_id.index();
 
-      if let Some(responder) = responder {
-        responder.send(response);
+        if let Some(responder) = responder {
+          replies.push((responder, response));
+        }
+      }
+      self.data.versions.write().unwrap().collect(last_index);
+
+      // rocksdb 模式：整批修改连同 apply 位置一次写入，释放写锁之前读请求看不到这批修改
+      if st.is_disk() {
+        let applied = AppliedState {
+          last_applied_log_id: self.data.last_applied_log_id,
+          last_membership: self.data.last_membership.clone(),
+        };
+        st.commit(&self.data.ttl.read().unwrap(), &applied)?;
       }
     }
+
+    // 释放写锁后再通知客户端和订阅者
+    for (responder, response) in replies {
+      responder.send(response);
+    }
+    if !events.is_empty() {
+      self.data.changes.publish(events, last_index);
+    }
     Ok(())
   }
 
   async fn get_snapshot_builder(&mut self) -> Self::SnapshotBuilder {
     self.snapshot_idx += 1;
-    self.clone()
+    // apply 与此处串行执行，此刻的 last_applied 与 kvs 一致；从此刻起记录被修改键的旧值
+    *self.data.snapshot_undo.lock().unwrap() = Some(UndoLog::new());
+    self.log_stats.snapshot_started();
+    let mut builder = self.clone();
+    // 过期索引只包含带 TTL 的键，直接复制快照点的状态
+    builder.snapshot_ttl = self.data.ttl.read().unwrap().clone();
+    builder
   }
 
-  async fn begin_receiving_snapshot(&mut self) -> Result<Cursor<Vec<u8>>, io::Error> {
-    Ok(Cursor::new(Vec::new()))
+  async fn begin_receiving_snapshot(&mut self) -> Result<SnapshotFile, io::Error> {
+    // 接收到的快照分块直接写入本次接收独占的临时文件
+    SnapshotFile::receive(&self.snapshot_dir).await
   }
 
   async fn install_snapshot(
@@ -243,31 +693,33 @@ impl RaftStateMachine<TypeConfig> for StateMachineStore {
     meta: &SnapshotMeta,
     snapshot: SnapshotData,
   ) -> Result<(), io::Error> {
+    let path = self.snapshot_path(&meta.snapshot_id);
+    snapshot.persist(&path).await?;
+
     let new_snapshot = StoredSnapshot {
       meta: meta.clone(),
-      data: snapshot.into_inner(),
+      path,
     };
     // 更新状态机
     self.update_state_machine_(new_snapshot.clone()).await?;
     // 更新快照
-    self.set_current_snapshot_(new_snapshot)?;
+    self.set_current_snapshot_(new_snapshot).await?;
 
     Ok(())
   }
 
   async fn get_current_snapshot(&mut self) -> Result<Option<Snapshot>, io::Error> {
-    let x = self.get_current_snapshot_()?;
-    Ok(x.map(|s| Snapshot {
-      meta: s.meta.clone(),
-      snapshot: Cursor::new(s.data.clone()),
+    let Some(s) = self.get_current_snapshot_()? else {
+      return Ok(None);
+    };
+    Ok(Some(Snapshot {
+      meta: s.meta,
+      snapshot: SnapshotFile::open(&s.path).await?,
     }))
   }
 }
 
-// app storage
-pub(crate) async fn new_storage<P: AsRef<Path>>(
-  db_path: P,
-) -> (RocksLogStore<TypeConfig>, StateMachineStore) {
+fn open_db(db_path: &Path) -> DB {
   let mut db_opts = Options::default();
   db_opts.create_missing_column_families(true);
   db_opts.create_if_missing(true);
@@ -276,11 +728,136 @@ pub(crate) async fn new_storage<P: AsRef<Path>>(
   let meta = ColumnFamilyDescriptor::new("meta", Options::default());
   let logs = ColumnFamilyDescriptor::new("logs", Options::default());
 
-  let db = DB::open_cf_descriptors(&db_opts, db_path, vec![store, meta, logs]).unwrap();
-  let db = Arc::new(db);
+  DB::open_cf_descriptors(&db_opts, db_path, vec![store, meta, logs]).unwrap()
+}
+
+// app storage
+pub(crate) async fn new_storage<P: AsRef<Path>>(
+  db_path: P,
+  wal_sync: WalSync,
+  backend: StateBackend,
+) -> (RocksLogStore<TypeConfig>, StateMachineStore) {
+  // 二进制快照文件保存在数据库目录下
+  let snapshot_dir = db_path.as_ref().join("snapshot");
+
+  let db = Arc::new(open_db(db_path.as_ref()));
+  std::fs::create_dir_all(&snapshot_dir).unwrap();
+  snapshot::remove_receiving(&snapshot_dir).unwrap();
 
-  let log_store = RocksLogStore::new(db.clone());
-  let sm_store = StateMachineStore::new(db).await.unwrap();
+  let log_stats = Arc::new(LogStats::new(db.clone()));
+  let log_store = RocksLogStore::new(db.clone(), wal_sync, log_stats.clone());
+  let sm_store = StateMachineStore::new(db, snapshot_dir, log_stats, backend)
+    .await
+    .unwrap();
 
   (log_store, sm_store)
 }
+
+#[cfg(test)]
+mod tests {
+  use super::*;
+
+  fn put(key: &str, value: &str, expire_at: Option<u64>) -> Request {
+    Request::Put {
+      key: key.to_string(),
+      value: value.to_string(),
+      expire_at,
+    }
+  }
+
+  #[test]
+  fn test_expire_only_matching_deadline() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    let mut ttl = TtlIndex::default();
+    let mut versions = VersionLog::default();
+    let mut events = Vec::new();
+    apply_request(&mut kvs, &mut ttl, &mut versions, put("a", "1", Some(10)), 1, &mut events)?;
+    apply_request(&mut kvs, &mut ttl, &mut versions, put("b", "1", Some(10)), 2, &mut events)?;
+    // leader 取出到期的 a 之后、Expire 提交之前 a 被重新写入，新的过期时间不同，不应删除
+    apply_request(&mut kvs, &mut ttl, &mut versions, put("a", "2", Some(99)), 3, &mut events)?;
+    let keys = vec![("a".to_string(), 10), ("b".to_string(), 10)];
+    apply_request(&mut kvs, &mut ttl, &mut versions, Request::Expire { keys }, 4, &mut events)?;
+
+    assert_eq!(kvs.get("a")?, Some("2".to_string()));
+    assert_eq!(kvs.get("b")?, None);
+    assert_eq!(ttl.get("a"), Some(99));
+    assert_eq!(ttl.get("b"), None);
+    assert_eq!(events.last().map(|e| (e.key.as_str(), e.index)), Some(("b", 4)));
+    Ok(())
+  }
+
+  #[test]
+  fn test_put_without_ttl_clears_deadline() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    let mut ttl = TtlIndex::default();
+    let mut versions = VersionLog::default();
+    let mut events = Vec::new();
+    apply_request(&mut kvs, &mut ttl, &mut versions, put("a", "1", Some(10)), 1, &mut events)?;
+    apply_request(&mut kvs, &mut ttl, &mut versions, put("a", "2", None), 2, &mut events)?;
+    let keys = vec![("a".to_string(), 10)];
+    apply_request(&mut kvs, &mut ttl, &mut versions, Request::Expire { keys }, 3, &mut events)?;
+    assert_eq!(kvs.get("a")?, Some("2".to_string()));
+    assert!(ttl.due(u64::MAX, 10).is_empty());
+    Ok(())
+  }
+
+  #[tokio::test]
+  async fn test_open_legacy_json_snapshot() -> io::Result<()> {
+    let backends = [StateBackend::Memory, StateBackend::Rocksdb { cache_bytes: 1024 }];
+    for backend in backends {
+      let dir = tempfile::tempdir()?;
+      let meta = SnapshotMeta {
+        last_log_id: Some(openraft::testing::log_id::<TypeConfig>(1, 1, 7000)),
+        last_membership: StoredMembership::default(),
+        snapshot_id: "1-7000-3".to_string(),
+      };
+      let kvs = maplit::btreemap! {
+        "a".to_string() => "1".to_string(),
+        "b".to_string() => "2".to_string(),
+      };
+      {
+        // 旧版本写入的记录：{"meta": ..., "data": kvs 的 JSON 字节}，快照之前的 log 已被清理
+        let (_log_store, sm) = new_storage(dir.path(), WalSync::Always, backend).await;
+        let legacy = serde_json::json!({ "meta": meta, "data": serde_json::to_vec(&kvs)? });
+        sm.db
+          .put_cf(sm.store(), b"snapshot", serde_json::to_vec(&legacy)?)
+          .map_err(io::Error::other)?;
+      }
+
+      let (_log_store, sm) = new_storage(dir.path(), WalSync::Always, backend).await;
+      assert_eq!(sm.data.last_applied_log_id.map(|id| id.index()), Some(7000));
+      {
+        let st = sm.data.kvs.read().await;
+        assert_eq!(st.get("a")?, Some("1".to_string()));
+        assert_eq!(st.get("b")?, Some("2".to_string()));
+      }
+      // 转换后的快照文件可以发送给其他节点
+      let snap = sm.get_current_snapshot_()?.unwrap();
+      assert_eq!(snap.meta.snapshot_id, "1-7000-3");
+      assert_eq!(snapshot::read_snapshot(&snap.path)?.0, kvs);
+    }
+    Ok(())
+  }
+
+  #[tokio::test]
+  async fn test_unknown_stored_snapshot_fails() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    {
+      let (_log_store, sm) = new_storage(dir.path(), WalSync::Always, StateBackend::Memory).await;
+      sm.db
+        .put_cf(sm.store(), b"snapshot", b"{\"unexpected\": 1}")
+        .map_err(io::Error::other)?;
+    }
+    let db = Arc::new(open_db(dir.path()));
+    let err = StateMachineStore::new(
+      db.clone(),
+      dir.path().join("snapshot"),
+      Arc::new(LogStats::new(db)),
+      StateBackend::Memory,
+    )
+    .await
+    .unwrap_err();
+    assert_eq!(err.kind(), io::ErrorKind::InvalidData);
+    Ok(())
+  }
+}
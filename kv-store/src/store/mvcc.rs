@@ -0,0 +1,298 @@
+//! 按 log index 的多版本读取
+//!
+//! kvs 只保存最新值；apply 修改一个键时，把修改前的值按修改它的 log index 记入 VersionLog。
+//! 读取 log index 为 at 时的值：键在 at 之后被修改过，取 at 之后第一次修改前的值，否则取当前值。
+//! 只保留最近 VERSION_RETAIN 条 log 内的旧版本；进行中的扫描固定（pin）其读取点，期间不回收该点之后的版本，
+//! 但最多 PIN_MAX_AGE：客户端停止读取的扫描不能无限期地保留旧版本，超时后被回收，扫描以 Compacted 结束。
+
+use std::borrow::Cow;
+use std::cmp::Ordering;
+use std::collections::BTreeMap;
+use std::collections::VecDeque;
+use std::collections::btree_map;
+use std::io;
+use std::iter::Peekable;
+use std::ops::Bound;
+use std::sync::Arc;
+use std::sync::RwLock;
+use std::time::Duration;
+use std::time::Instant;
+
+use super::kv::KvIter;
+use super::kv::KvState;
+
+// 保留旧版本的 log 条数，更早的时间点返回 Compacted
+pub const VERSION_RETAIN: u64 = 10_000;
+
+// 固定读取点的最长时间，超过后不再推迟回收
+pub const PIN_MAX_AGE: Duration = Duration::from_secs(60);
+
+// 一个键的旧版本：修改它的 log index -> 修改前的值，None 表示修改前不存在
+type History = BTreeMap<u64, Option<String>>;
+
+#[derive(Debug, Default)]
+pub struct VersionLog {
+  changes: BTreeMap<String, History>,
+  // 按 log index 排序的 (index, key)，回收时从最旧的开始
+  order: VecDeque<(u64, String)>,
+  // 不小于 floor 的时间点都可以读取
+  floor: u64,
+  // 正在扫描的 (读取点, 编号) -> 固定的时间
+  pins: BTreeMap<(u64, u64), Instant>,
+  next_pin: u64,
+}
+
+impl VersionLog {
+  /// 记录 index 处的 entry 修改 key 之前的值；同一个 entry 多次修改一个键时只记录第一次
+  pub(crate) fn record(&mut self, index: u64, key: String, old: Option<String>) {
+    let history = self.changes.entry(key.clone()).or_default();
+    if let btree_map::Entry::Vacant(e) = history.entry(index) {
+      e.insert(old);
+      self.order.push_back((index, key));
+    }
+  }
+
+  /// 回收 applied - VERSION_RETAIN 之前的旧版本，不越过正在扫描的读取点；固定超过 PIN_MAX_AGE 的读取点不再计入
+  pub(crate) fn collect(&mut self, applied: u64) {
+    let now = Instant::now();
+    self.pins.retain(|_, since| now.duration_since(*since) < PIN_MAX_AGE);
+    let mut target = applied.saturating_sub(VERSION_RETAIN);
+    if let Some((&(pinned, _), _)) = self.pins.first_key_value() {
+      target = target.min(pinned);
+    }
+    if target <= self.floor {
+      return;
+    }
+    while let Some((index, _)) = self.order.front() {
+      if *index > target {
+        break;
+      }
+      let (index, key) = self.order.pop_front().unwrap();
+      if let Some(history) = self.changes.get_mut(&key) {
+        history.remove(&index);
+        if history.is_empty() {
+          self.changes.remove(&key);
+        }
+      }
+    }
+    self.floor = target;
+  }
+
+  /// 安装快照后之前的版本不再连续，清空历史，从快照位置重新开始
+  pub(crate) fn reset(&mut self, index: u64) {
+    self.changes.clear();
+    self.order.clear();
+    self.floor = index;
+  }
+
+  pub fn floor(&self) -> u64 {
+    self.floor
+  }
+
+  /// key 在 log index 为 at 时的值，调用方已确认 floor <= at <= 已 apply 的 index
+  pub fn value_at(&self, kvs: &KvState, key: &str, at: u64) -> io::Result<Option<String>> {
+    match later_change(self.changes.get(key), at) {
+      Some(old) => Ok(old.clone()),
+      None => kvs.get(key),
+    }
+  }
+
+  /// 按键顺序遍历 log index 为 at 时 (lower, upper) 区间内的键值对：
+  /// 当前的键与有旧版本的键（包括 at 之后被删除的键）合并，跳过 at 时不存在的键
+  pub fn range_at<'a>(
+    &'a self,
+    kvs: &'a KvState,
+    lower: Bound<&str>,
+    upper: Bound<&str>,
+    at: u64,
+  ) -> RangeAt<'a> {
+    RangeAt {
+      current: kvs.range(lower, upper).peekable(),
+      changed: self.changes.range::<str, _>((lower, upper)).peekable(),
+      at,
+    }
+  }
+
+  fn pin(&mut self, at: u64) -> u64 {
+    let id = self.next_pin;
+    self.next_pin += 1;
+    self.pins.insert((at, id), Instant::now());
+    id
+  }
+
+  // 已超时被移除的读取点不需要再释放
+  fn unpin(&mut self, at: u64, id: u64) {
+    self.pins.remove(&(at, id));
+  }
+}
+
+// at 之后第一次修改前的值；at 之后没有修改时为 None，值即为当前值
+fn later_change(history: Option<&History>, at: u64) -> Option<&Option<String>> {
+  history.and_then(|h| h.range(at + 1..).next()).map(|(_, old)| old)
+}
+
+type KeyValue<'a> = (Cow<'a, str>, Cow<'a, str>);
+
+pub struct RangeAt<'a> {
+  current: Peekable<KvIter<'a>>,
+  changed: Peekable<btree_map::Range<'a, String, History>>,
+  at: u64,
+}
+
+// 读取当前数据出错时产出该错误，之后结束
+impl<'a> Iterator for RangeAt<'a> {
+  type Item = io::Result<KeyValue<'a>>;
+
+  fn next(&mut self) -> Option<Self::Item> {
+    loop {
+      if let Some(Err(_)) = self.current.peek() {
+        return self.current.next();
+      }
+      let order = match (self.current.peek(), self.changed.peek()) {
+        (None, None) => return None,
+        (Some(_), None) => Ordering::Less,
+        (None, Some(_)) => Ordering::Greater,
+        (Some(Ok((k, _))), Some((c, _))) => (**k).cmp(c.as_str()),
+        (Some(Err(_)), _) => unreachable!(),
+      };
+      let (key, current, history) = match order {
+        Ordering::Less => {
+          let (k, v) = self.next_current();
+          (k, Some(v), None)
+        }
+        Ordering::Greater => {
+          let (k, h) = self.changed.next().unwrap();
+          (Cow::Borrowed(k.as_str()), None, Some(h))
+        }
+        Ordering::Equal => {
+          let (k, v) = self.next_current();
+          let (_, h) = self.changed.next().unwrap();
+          (k, Some(v), Some(h))
+        }
+      };
+      let value = match later_change(history, self.at) {
+        Some(old) => old.as_deref().map(Cow::Borrowed),
+        None => current,
+      };
+      if let Some(value) = value {
+        return Some(Ok((key, value)));
+      }
+    }
+  }
+}
+
+impl<'a> RangeAt<'a> {
+  // 已确认下一个是成功读取的键值对
+  fn next_current(&mut self) -> KeyValue<'a> {
+    match self.current.next() {
+      Some(Ok(kv)) => kv,
+      _ => unreachable!(),
+    }
+  }
+}
+
+/// 固定一个读取点，drop 时释放；固定超过 PIN_MAX_AGE 后读取点之后的旧版本可能被回收，
+/// 使用者需在每次读取前检查 floor 是否已越过 at
+#[derive(Debug)]
+pub struct VersionPin {
+  versions: Arc<RwLock<VersionLog>>,
+  at: u64,
+  id: u64,
+}
+
+impl VersionPin {
+  pub fn at(&self) -> u64 {
+    self.at
+  }
+}
+
+impl Drop for VersionPin {
+  fn drop(&mut self) {
+    self.versions.write().unwrap().unpin(self.at, self.id);
+  }
+}
+
+/// 固定读取点 at，at 之后的旧版本在释放前不会被回收；at 早于 floor 时返回 Err(floor)
+pub fn pin(versions: &Arc<RwLock<VersionLog>>, at: u64) -> Result<VersionPin, u64> {
+  let mut v = versions.write().unwrap();
+  if at < v.floor {
+    return Err(v.floor);
+  }
+  let id = v.pin(at);
+  Ok(VersionPin {
+    versions: versions.clone(),
+    at,
+    id,
+  })
+}
+
+#[cfg(test)]
+mod tests {
+  use super::*;
+
+  fn versions_with(kvs: &mut KvState) -> io::Result<Arc<RwLock<VersionLog>>> {
+    // index 1 写入 a=1，index 2 改为 a=2，index 3 删除 a
+    let mut v = VersionLog::default();
+    v.record(1, "a".to_string(), kvs.insert("a".to_string(), "1".to_string())?);
+    v.record(2, "a".to_string(), kvs.insert("a".to_string(), "2".to_string())?);
+    v.record(3, "a".to_string(), kvs.remove("a")?);
+    Ok(Arc::new(RwLock::new(v)))
+  }
+
+  #[test]
+  fn test_value_at() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    let versions = versions_with(&mut kvs)?;
+    let v = versions.read().unwrap();
+    assert_eq!(v.value_at(&kvs, "a", 0)?, None);
+    assert_eq!(v.value_at(&kvs, "a", 1)?, Some("1".to_string()));
+    assert_eq!(v.value_at(&kvs, "a", 2)?, Some("2".to_string()));
+    assert_eq!(v.value_at(&kvs, "a", 3)?, None);
+
+    let at_2 = v
+      .range_at(&kvs, Bound::Unbounded, Bound::Unbounded, 2)
+      .map(|res| res.map(|(k, v)| (k.into_owned(), v.into_owned())))
+      .collect::<io::Result<Vec<_>>>()?;
+    assert_eq!(at_2, vec![("a".to_string(), "2".to_string())]);
+    Ok(())
+  }
+
+  #[test]
+  fn test_pin_delays_collect() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    let versions = versions_with(&mut kvs)?;
+    let scan = pin(&versions, 1).unwrap();
+    versions.write().unwrap().collect(VERSION_RETAIN + 3);
+    assert_eq!(versions.read().unwrap().floor(), 1);
+    let v = versions.read().unwrap().value_at(&kvs, "a", scan.at())?;
+    assert_eq!(v, Some("1".to_string()));
+
+    drop(scan);
+    versions.write().unwrap().collect(VERSION_RETAIN + 3);
+    assert_eq!(versions.read().unwrap().floor(), 3);
+    assert_eq!(pin(&versions, 2).err(), Some(3));
+    Ok(())
+  }
+
+  #[test]
+  fn test_expired_pin_does_not_delay_collect() -> io::Result<()> {
+    let mut kvs = KvState::default();
+    let versions = versions_with(&mut kvs)?;
+    let scan = pin(&versions, 1).unwrap();
+    {
+      // 把固定时间调到 PIN_MAX_AGE 之前，模拟停止读取的扫描
+      let mut v = versions.write().unwrap();
+      let since = v.pins.get_mut(&(1, scan.id)).unwrap();
+      *since = Instant::now().checked_sub(PIN_MAX_AGE).unwrap();
+      v.collect(VERSION_RETAIN + 3);
+      assert!(v.pins.is_empty());
+      assert!(v.floor() > scan.at());
+    }
+    // 超时被移除后再释放不影响其他读取点
+    let other = pin(&versions, 3).unwrap();
+    drop(scan);
+    assert_eq!(versions.read().unwrap().pins.len(), 1);
+    drop(other);
+    Ok(())
+  }
+}
@@ -0,0 +1,354 @@
+//! 二进制快照格式
+//!
+//! 文件结构：8 字节魔数 `KVSNAP02`，随后是若干条记录
+//! `[key 长度 u32][key][value 长度 u32][value]`（大端），以 key 长度为 `u32::MAX` 的结束标记收尾；
+//! 之后是过期时间记录 `[key 长度 u32][key][过期时间 u64]`，同样以结束标记收尾。
+//! `KVSNAP01` 没有过期时间部分，仍可读取。
+//! 快照按块写入、按流读取，内存占用只与块大小有关。
+//! 接收中的快照写入各自的临时文件 `receiving-<n>.tmp`，安装时改名为正式的快照文件。
+
+use std::collections::BTreeMap;
+use std::fs::File;
+use std::io;
+use std::io::BufReader;
+use std::io::Read;
+use std::io::SeekFrom;
+use std::path::Path;
+use std::path::PathBuf;
+use std::pin::Pin;
+use std::sync::atomic::AtomicU64;
+use std::sync::atomic::Ordering;
+use std::task::Context;
+use std::task::Poll;
+
+use byteorder::BigEndian;
+use byteorder::ReadBytesExt;
+use byteorder::WriteBytesExt;
+use tokio::io::AsyncRead;
+use tokio::io::AsyncSeek;
+use tokio::io::AsyncWrite;
+use tokio::io::ReadBuf;
+
+use super::Request;
+use super::kv::KvState;
+use super::ttl::TtlIndex;
+
+const MAGIC: &[u8; 8] = b"KVSNAP02";
+const MAGIC_V1: &[u8; 8] = b"KVSNAP01";
+const END: u32 = u32::MAX;
+
+const RECEIVING_PREFIX: &str = "receiving-";
+// 接收临时文件的编号，重试或并发的快照接收互不覆盖
+static RECEIVING_SEQ: AtomicU64 = AtomicU64::new(0);
+
+/// 快照期间被修改的键在快照点的旧值，None 表示快照点时该键不存在
+pub type UndoLog = BTreeMap<String, Option<String>>;
+
+pub(crate) fn write_header(buf: &mut Vec<u8>) {
+  buf.extend_from_slice(MAGIC);
+}
+
+pub(crate) fn write_record(buf: &mut Vec<u8>, key: &str, value: &str) {
+  buf.write_u32::<BigEndian>(key.len() as u32).unwrap();
+  buf.extend_from_slice(key.as_bytes());
+  buf.write_u32::<BigEndian>(value.len() as u32).unwrap();
+  buf.extend_from_slice(value.as_bytes());
+}
+
+pub(crate) fn write_ttl(buf: &mut Vec<u8>, key: &str, expire_at: u64) {
+  buf.write_u32::<BigEndian>(key.len() as u32).unwrap();
+  buf.extend_from_slice(key.as_bytes());
+  buf.write_u64::<BigEndian>(expire_at).unwrap();
+}
+
+pub(crate) fn write_end(buf: &mut Vec<u8>) {
+  buf.write_u32::<BigEndian>(END).unwrap();
+}
+
+/// 从快照文件中流式读取，重建 kv 数据和过期时间索引
+pub(crate) fn read_snapshot(path: &Path) -> io::Result<(BTreeMap<String, String>, TtlIndex)> {
+  let mut kvs = BTreeMap::new();
+  let ttl = read_snapshot_with(path, |key, value| {
+    kvs.insert(key, value);
+    Ok(())
+  })?;
+  Ok((kvs, ttl))
+}
+
+/// 从快照文件中流式读取，每条键值记录交给 on_record，返回过期时间索引
+pub(crate) fn read_snapshot_with(
+  path: &Path,
+  mut on_record: impl FnMut(String, String) -> io::Result<()>,
+) -> io::Result<TtlIndex> {
+  let mut r = BufReader::new(File::open(path)?);
+
+  let mut magic = [0u8; 8];
+  r.read_exact(&mut magic)?;
+  if &magic != MAGIC && &magic != MAGIC_V1 {
+    return Err(io::Error::new(
+      io::ErrorKind::InvalidData,
+      "unknown snapshot format",
+    ));
+  }
+
+  loop {
+    let key_len = r.read_u32::<BigEndian>()?;
+    if key_len == END {
+      break;
+    }
+    let key = read_string(&mut r, key_len)?;
+    let value_len = r.read_u32::<BigEndian>()?;
+    let value = read_string(&mut r, value_len)?;
+    on_record(key, value)?;
+  }
+
+  let mut ttl = TtlIndex::default();
+  if &magic == MAGIC {
+    loop {
+      let key_len = r.read_u32::<BigEndian>()?;
+      if key_len == END {
+        break;
+      }
+      let key = read_string(&mut r, key_len)?;
+      ttl.set(&key, Some(r.read_u64::<BigEndian>()?));
+    }
+  }
+  Ok(ttl)
+}
+
+fn read_string(r: &mut impl Read, len: u32) -> io::Result<String> {
+  let mut buf = vec![0u8; len as usize];
+  r.read_exact(&mut buf)?;
+  String::from_utf8(buf).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))
+}
+
+/// 在 req 修改 kvs 之前，记录它将修改的键在快照点的值（每个键只记录第一次）
+pub(crate) fn record_undo(undo: &mut UndoLog, kvs: &KvState, req: &Request) -> io::Result<()> {
+  match req {
+    Request::Put { key, .. } | Request::Del { key } => {
+      if !undo.contains_key(key) {
+        undo.insert(key.clone(), kvs.get(key)?);
+      }
+    }
+    Request::Expire { keys } => {
+      for (key, _) in keys {
+        if !undo.contains_key(key) {
+          undo.insert(key.clone(), kvs.get(key)?);
+        }
+      }
+    }
+    // 事务的 guard 不成立时不会修改任何键，多记录的旧值与当前值相同，不影响快照
+    Request::Batch { ops } | Request::Txn { ops, .. } => {
+      for op in ops {
+        record_undo(undo, kvs, op)?;
+      }
+    }
+  }
+  Ok(())
+}
+
+/// 状态机的快照数据（SnapshotData）：一个打开的快照文件。
+/// 用于接收时对应一个独占的临时文件，安装时改名；安装前被丢弃（连接中断、被新的快照取代）时删除临时文件
+#[derive(Debug)]
+pub struct SnapshotFile {
+  file: tokio::fs::File,
+  receiving: Option<PathBuf>,
+}
+
+impl SnapshotFile {
+  pub async fn open(path: impl AsRef<Path>) -> io::Result<Self> {
+    Ok(Self {
+      file: tokio::fs::File::open(path).await?,
+      receiving: None,
+    })
+  }
+
+  /// 在 dir 下创建一个新的临时文件，用于接收快照
+  pub async fn receive(dir: &Path) -> io::Result<Self> {
+    let seq = RECEIVING_SEQ.fetch_add(1, Ordering::Relaxed);
+    let path = dir.join(format!("{}{}.tmp", RECEIVING_PREFIX, seq));
+    Ok(Self {
+      file: tokio::fs::File::create(&path).await?,
+      receiving: Some(path),
+    })
+  }
+
+  pub async fn len(&self) -> io::Result<u64> {
+    Ok(self.file.metadata().await?.len())
+  }
+
+  /// 接收完成：落盘后把临时文件改名为 path
+  pub async fn persist(mut self, path: &Path) -> io::Result<()> {
+    self.file.sync_all().await?;
+    let Some(tmp) = self.receiving.take() else {
+      return Err(io::Error::new(
+        io::ErrorKind::InvalidInput,
+        "snapshot file is not being received",
+      ));
+    };
+    drop(self);
+    tokio::fs::rename(tmp, path).await
+  }
+}
+
+impl Drop for SnapshotFile {
+  fn drop(&mut self) {
+    if let Some(path) = self.receiving.take() {
+      let _ = std::fs::remove_file(path);
+    }
+  }
+}
+
+impl AsyncRead for SnapshotFile {
+  fn poll_read(self: Pin<&mut Self>, cx: &mut Context<'_>, buf: &mut ReadBuf<'_>) -> Poll<io::Result<()>> {
+    Pin::new(&mut self.get_mut().file).poll_read(cx, buf)
+  }
+}
+
+impl AsyncWrite for SnapshotFile {
+  fn poll_write(self: Pin<&mut Self>, cx: &mut Context<'_>, buf: &[u8]) -> Poll<io::Result<usize>> {
+    Pin::new(&mut self.get_mut().file).poll_write(cx, buf)
+  }
+
+  fn poll_flush(self: Pin<&mut Self>, cx: &mut Context<'_>) -> Poll<io::Result<()>> {
+    Pin::new(&mut self.get_mut().file).poll_flush(cx)
+  }
+
+  fn poll_shutdown(self: Pin<&mut Self>, cx: &mut Context<'_>) -> Poll<io::Result<()>> {
+    Pin::new(&mut self.get_mut().file).poll_shutdown(cx)
+  }
+}
+
+impl AsyncSeek for SnapshotFile {
+  fn start_seek(self: Pin<&mut Self>, position: SeekFrom) -> io::Result<()> {
+    Pin::new(&mut self.get_mut().file).start_seek(position)
+  }
+
+  fn poll_complete(self: Pin<&mut Self>, cx: &mut Context<'_>) -> Poll<io::Result<u64>> {
+    Pin::new(&mut self.get_mut().file).poll_complete(cx)
+  }
+}
+
+/// 删除上次运行时留下的接收临时文件（包括旧版本的 receiving.tmp）
+pub fn remove_receiving(dir: &Path) -> io::Result<()> {
+  for entry in std::fs::read_dir(dir)? {
+    let entry = entry?;
+    let name = entry.file_name();
+    let name = name.to_string_lossy();
+    if name.starts_with(RECEIVING_PREFIX) || name == "receiving.tmp" {
+      std::fs::remove_file(entry.path())?;
+    }
+  }
+  Ok(())
+}
+
+#[cfg(test)]
+mod tests {
+  use tokio::io::AsyncReadExt;
+  use tokio::io::AsyncWriteExt;
+
+  use super::*;
+
+  #[test]
+  fn test_snapshot_round_trip() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    let path = dir.path().join("1.snap");
+    let mut buf = Vec::new();
+    write_header(&mut buf);
+    write_record(&mut buf, "a", "1");
+    write_record(&mut buf, "", "");
+    write_record(&mut buf, "键", &"v".repeat(100_000));
+    write_end(&mut buf);
+    write_ttl(&mut buf, "a", 42);
+    write_end(&mut buf);
+    assert_eq!(&buf[..8], MAGIC);
+    std::fs::write(&path, &buf)?;
+
+    let (kvs, ttl) = read_snapshot(&path)?;
+    assert_eq!(kvs.len(), 3);
+    assert_eq!(kvs["a"], "1");
+    assert_eq!(kvs[""], "");
+    assert_eq!(kvs["键"].len(), 100_000);
+    assert_eq!(ttl.get("a"), Some(42));
+    assert_eq!(ttl.get("键"), None);
+    Ok(())
+  }
+
+  #[test]
+  fn test_read_v1_snapshot() -> io::Result<()> {
+    // KVSNAP01 在键值记录之后直接结束，没有过期时间部分
+    let dir = tempfile::tempdir()?;
+    let path = dir.path().join("1.snap");
+    let mut buf = MAGIC_V1.to_vec();
+    write_record(&mut buf, "a", "1");
+    write_end(&mut buf);
+    std::fs::write(&path, &buf)?;
+
+    let (kvs, ttl) = read_snapshot(&path)?;
+    assert_eq!(kvs["a"], "1");
+    assert_eq!(ttl.iter().count(), 0);
+    Ok(())
+  }
+
+  #[test]
+  fn test_reject_bad_snapshot() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    let path = dir.path().join("1.snap");
+    std::fs::write(&path, b"KVSNAP99")?;
+    assert_eq!(read_snapshot(&path).unwrap_err().kind(), io::ErrorKind::InvalidData);
+
+    // 缺少结束标记的快照（如写入中断）不能被当作完整的快照
+    let mut buf = Vec::new();
+    write_header(&mut buf);
+    write_record(&mut buf, "a", "1");
+    std::fs::write(&path, &buf)?;
+    assert!(read_snapshot(&path).is_err());
+    Ok(())
+  }
+
+  #[tokio::test]
+  async fn test_receiving_files_are_separate() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    let mut a = SnapshotFile::receive(dir.path()).await?;
+    let mut b = SnapshotFile::receive(dir.path()).await?;
+    a.write_all(b"a").await?;
+    b.write_all(b"b").await?;
+    a.flush().await?;
+    b.flush().await?;
+
+    // 被丢弃的接收不影响另一个，也不留下临时文件
+    drop(b);
+    let path = dir.path().join("1.snap");
+    a.persist(&path).await?;
+    assert_eq!(std::fs::read(&path)?, b"a");
+    assert_eq!(std::fs::read_dir(dir.path())?.count(), 1);
+
+    let mut s = String::new();
+    SnapshotFile::open(&path).await?.read_to_string(&mut s).await?;
+    assert_eq!(s, "a");
+    Ok(())
+  }
+
+  #[tokio::test]
+  async fn test_remove_receiving() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    std::fs::write(dir.path().join("receiving.tmp"), b"")?;
+    std::fs::write(dir.path().join("receiving-7.tmp"), b"")?;
+    std::fs::write(dir.path().join("1.snap"), b"")?;
+    remove_receiving(dir.path())?;
+    let names: Vec<_> = std::fs::read_dir(dir.path())?.map(|e| e.unwrap().file_name()).collect();
+    assert_eq!(names, vec!["1.snap"]);
+    Ok(())
+  }
+
+  #[tokio::test]
+  async fn test_persist_requires_receiving() -> io::Result<()> {
+    let dir = tempfile::tempdir()?;
+    let path = dir.path().join("1.snap");
+    std::fs::write(&path, b"x")?;
+    let file = SnapshotFile::open(&path).await?;
+    assert!(file.persist(&dir.path().join("2.snap")).await.is_err());
+    assert!(path.exists());
+    Ok(())
+  }
+}
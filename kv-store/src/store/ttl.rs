@@ -0,0 +1,133 @@
+//! 键的过期时间（TTL）
+//!
+//! Put 携带绝对过期时间（unix 毫秒），由写入方计算后写入 log，各副本看到相同的值。
+//! 过期索引按时间排序，leader 定期取出已到期的键，通过 raft 提交 Expire 删除，
+//! 清理代价只与到期的键数有关；在删除被 apply 之前，读请求按当前时间把到期的键视为不存在。
+
+use std::collections::BTreeSet;
+use std::collections::HashMap;
+use std::sync::Arc;
+use std::sync::RwLock;
+use std::time::Duration;
+use std::time::SystemTime;
+use std::time::UNIX_EPOCH;
+
+use crate::NodeId;
+use crate::store::Request;
+use crate::typ::Raft;
+
+// leader 检查到期键的间隔，以及一次 Expire 提交的最大键数
+const EXPIRE_INTERVAL: Duration = Duration::from_millis(500);
+const EXPIRE_BATCH: usize = 1024;
+
+pub fn now_ms() -> u64 {
+  SystemTime::now()
+    .duration_since(UNIX_EPOCH)
+    .map(|d| d.as_millis() as u64)
+    .unwrap_or(0)
+}
+
+#[derive(Debug, Default, Clone)]
+pub struct TtlIndex {
+  // key -> 过期时间
+  deadlines: HashMap<String, u64>,
+  // 按过期时间排序的 (过期时间, key)
+  by_time: BTreeSet<(u64, String)>,
+}
+
+impl TtlIndex {
+  /// 设置或清除 key 的过期时间（不带 TTL 的 Put 会清除之前的 TTL）
+  pub fn set(&mut self, key: &str, expire_at: Option<u64>) {
+    if let Some(old) = self.deadlines.remove(key) {
+      self.by_time.remove(&(old, key.to_string()));
+    }
+    if let Some(at) = expire_at {
+      self.deadlines.insert(key.to_string(), at);
+      self.by_time.insert((at, key.to_string()));
+    }
+  }
+
+  pub fn get(&self, key: &str) -> Option<u64> {
+    self.deadlines.get(key).copied()
+  }
+
+  pub fn is_expired(&self, key: &str, now: u64) -> bool {
+    matches!(self.deadlines.get(key), Some(&at) if at <= now)
+  }
+
+  /// key 的过期时间仍为 at（期间没有被重新写入或删除）
+  pub fn expired_at(&self, key: &str, at: u64) -> bool {
+    self.deadlines.get(key) == Some(&at)
+  }
+
+  /// 到 now 为止已到期的键，最多 limit 个，按过期时间顺序
+  pub fn due(&self, now: u64, limit: usize) -> Vec<(String, u64)> {
+    self
+      .by_time
+      .iter()
+      .take_while(|(at, _)| *at <= now)
+      .take(limit)
+      .map(|(at, key)| (key.clone(), *at))
+      .collect()
+  }
+
+  pub fn iter(&self) -> impl Iterator<Item = (&String, &u64)> {
+    self.deadlines.iter()
+  }
+}
+
+/// 在 leader 上定期把到期的键通过 raft 删除；非 leader 只等待
+pub async fn run_expirer(raft: Raft, node_id: NodeId, ttl: Arc<RwLock<TtlIndex>>) {
+  let mut ticker = tokio::time::interval(EXPIRE_INTERVAL);
+  loop {
+    ticker.tick().await;
+    if raft.current_leader().await != Some(node_id) {
+      continue;
+    }
+    loop {
+      let keys = ttl.read().unwrap().due(now_ms(), EXPIRE_BATCH);
+      if keys.is_empty() {
+        break;
+      }
+      let full = keys.len() == EXPIRE_BATCH;
+      // 提交失败（如失去 leader）时等下一轮重试
+      if raft.client_write(Request::Expire { keys }).await.is_err() || !full {
+        break;
+      }
+    }
+  }
+}
+
+#[cfg(test)]
+mod tests {
+  use super::*;
+
+  #[test]
+  fn test_due_in_time_order() {
+    let mut ttl = TtlIndex::default();
+    ttl.set("b", Some(20));
+    ttl.set("a", Some(10));
+    ttl.set("c", Some(30));
+    assert!(ttl.due(5, 10).is_empty());
+    assert_eq!(ttl.due(20, 10), vec![("a".to_string(), 10), ("b".to_string(), 20)]);
+    assert_eq!(ttl.due(30, 1), vec![("a".to_string(), 10)]);
+  }
+
+  #[test]
+  fn test_set_replaces_and_clears() {
+    let mut ttl = TtlIndex::default();
+    ttl.set("a", Some(10));
+    ttl.set("a", Some(50));
+    assert!(!ttl.is_expired("a", 10));
+    assert!(ttl.is_expired("a", 50));
+    assert!(!ttl.expired_at("a", 10));
+    assert!(ttl.expired_at("a", 50));
+    assert_eq!(ttl.due(100, 10), vec![("a".to_string(), 50)]);
+
+    // 不带 TTL 的 Put 清除过期时间
+    ttl.set("a", None);
+    assert_eq!(ttl.get("a"), None);
+    assert!(!ttl.is_expired("a", 100));
+    assert!(ttl.due(100, 10).is_empty());
+  }
+}
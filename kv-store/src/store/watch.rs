@@ -0,0 +1,129 @@
+//! 变更事件流
+//!
+//! 状态机 apply 写操作时发布每个键的变更，保存最近 WATCH_HISTORY 个事件；
+//! 订阅者按 log index 长轮询，断开后可以从上次返回的 index 继续。
+
+use std::collections::VecDeque;
+use std::sync::Mutex;
+
+use serde::Serialize;
+use tokio::sync::watch;
+
+// 保留的最近变更事件数，更早的事件被丢弃，从更早的位置继续订阅会返回 Compacted
+const WATCH_HISTORY: usize = 4096;
+
+/// 一个键的变更，value 为 None 表示被删除
+#[derive(Serialize, Debug, Clone)]
+pub struct ChangeEvent {
+  pub index: u64,
+  pub key: String,
+  pub value: Option<String>,
+}
+
+/// 订阅的范围
+pub enum WatchFilter {
+  Key(String),
+  Prefix(String),
+}
+
+impl WatchFilter {
+  fn matches(&self, key: &str) -> bool {
+    match self {
+      WatchFilter::Key(k) => key == k,
+      WatchFilter::Prefix(p) => key.starts_with(p.as_str()),
+    }
+  }
+}
+
+#[derive(Debug)]
+struct History {
+  events: VecDeque<ChangeEvent>,
+  // 不大于 floor 的 index 的事件可能已被丢弃
+  floor: u64,
+}
+
+#[derive(Debug)]
+pub struct ChangeFeed {
+  history: Mutex<History>,
+  // 最近发布的 log index，用于唤醒等待中的订阅者
+  latest: watch::Sender<u64>,
+}
+
+impl Default for ChangeFeed {
+  fn default() -> Self {
+    Self {
+      history: Mutex::new(History {
+        events: VecDeque::new(),
+        floor: 0,
+      }),
+      latest: watch::channel(0).0,
+    }
+  }
+}
+
+impl ChangeFeed {
+  /// 发布一批变更（同一次 apply 产生），index 为这批 entry 中最后一个的 log index
+  pub fn publish(&self, events: Vec<ChangeEvent>, index: u64) {
+    {
+      let mut h = self.history.lock().unwrap();
+      for event in events {
+        if h.events.len() == WATCH_HISTORY {
+          let dropped = h.events.pop_front().unwrap();
+          h.floor = dropped.index;
+        }
+        h.events.push_back(event);
+      }
+    }
+    self.latest.send_replace(index);
+  }
+
+  /// 安装快照后之前的事件不再连续，清空历史，从快照位置重新开始
+  pub fn reset(&self, index: u64) {
+    {
+      let mut h = self.history.lock().unwrap();
+      h.events.clear();
+      h.floor = index;
+    }
+    self.latest.send_replace(index);
+  }
+
+  /// 当前位置：从这里开始订阅只会收到之后的变更
+  pub fn latest_index(&self) -> u64 {
+    let h = self.history.lock().unwrap();
+    h.floor.max(h.events.back().map_or(0, |e| e.index))
+  }
+
+  pub fn subscribe(&self) -> watch::Receiver<u64> {
+    self.latest.subscribe()
+  }
+
+  /// 返回 index 大于 after 且匹配 filter 的事件（最多约 limit 个，不会截断同一个 index 的事件），
+  /// 以及下次应该继续的位置；after 之后的事件已被丢弃时返回 Err(floor)
+  pub fn since(
+    &self,
+    after: u64,
+    filter: &WatchFilter,
+    limit: usize,
+  ) -> Result<(Vec<ChangeEvent>, u64), u64> {
+    let h = self.history.lock().unwrap();
+    if after < h.floor {
+      return Err(h.floor);
+    }
+
+    let mut out: Vec<ChangeEvent> = Vec::new();
+    // 没有截断时下次从历史中最后一个事件之后继续
+    let mut next = after.max(h.floor).max(h.events.back().map_or(0, |e| e.index));
+    // 事件按 index 递增，二分查找第一个 index > after 的位置
+    let start = h.events.partition_point(|e| e.index <= after);
+    for event in h.events.range(start..) {
+      if out.len() >= limit && out.last().map(|e| e.index) != Some(event.index) {
+        next = out.last().unwrap().index;
+        break;
+      }
+      if filter.matches(&event.key) {
+        out.push(event.clone());
+      }
+    }
+    Ok((out, next))
+  }
+}
@@ -0,0 +1,76 @@
+//! raft 调优参数
+//!
+//! 心跳间隔、选举超时决定故障切换时间和心跳开销，快照和 log 清理阈值决定 log 的磁盘占用。
+//! 快照按新增 log 条数（openraft）或写入字节数（store::compaction）触发，以先到者为准。
+//! 参数按 默认值 < 配置文件（JSON） < 命令行参数/环境变量 的顺序合并，启动后通过 /metrics 的 config 字段可见。
+
+use std::fs;
+use std::io;
+use std::path::Path;
+
+use openraft::Config;
+use openraft::ConfigError;
+use openraft::SnapshotPolicy;
+use serde::Deserialize;
+use serde::Serialize;
+
+#[derive(Debug, Clone, PartialEq, Eq, Serialize, Deserialize)]
+#[serde(default)]
+pub struct RaftTuning {
+  /// leader 发送心跳的间隔（毫秒）
+  pub heartbeat_interval: u64,
+  /// follower 选举超时的随机范围（毫秒），leader 宕机后约经过这段时间开始选举
+  pub election_timeout_min: u64,
+  pub election_timeout_max: u64,
+  /// 距上次快照新增多少条 log 后生成快照，0 表示不自动生成
+  pub snapshot_logs_since_last: u64,
+  /// 距上次快照写入多少字节的 log 后生成快照，0 表示不按字节数触发
+  pub snapshot_log_bytes: u64,
+  /// 生成快照后保留的 log 条数，供落后不多的 follower 追赶
+  pub max_in_snapshot_log_to_keep: u64,
+  /// 每次清理 log 的最少条数
+  pub purge_batch_size: u64,
+  /// 一个 append-entries 最多携带的 log 条数
+  pub max_payload_entries: u64,
+}
+
+impl Default for RaftTuning {
+  fn default() -> Self {
+    Self {
+      heartbeat_interval: 250,
+      election_timeout_min: 299,
+      election_timeout_max: 300,
+      snapshot_logs_since_last: 5000,
+      snapshot_log_bytes: 0,
+      max_in_snapshot_log_to_keep: 1000,
+      purge_batch_size: 1,
+      max_payload_entries: 300,
+    }
+  }
+}
+
+impl RaftTuning {
+  /// 从 JSON 文件读取，文件中没有的字段使用默认值
+  pub fn load(path: impl AsRef<Path>) -> io::Result<Self> {
+    let data = fs::read(path)?;
+    serde_json::from_slice(&data).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))
+  }
+
+  pub fn to_config(&self) -> Result<Config, ConfigError> {
+    let snapshot_policy = match self.snapshot_logs_since_last {
+      0 => SnapshotPolicy::Never,
+      n => SnapshotPolicy::LogsSinceLast(n),
+    };
+    let config = Config {
+      heartbeat_interval: self.heartbeat_interval,
+      election_timeout_min: self.election_timeout_min,
+      election_timeout_max: self.election_timeout_max,
+      snapshot_policy,
+      max_in_snapshot_log_to_keep: self.max_in_snapshot_log_to_keep,
+      purge_batch_size: self.purge_batch_size,
+      max_payload_entries: self.max_payload_entries,
+      ..Default::default()
+    };
+    config.validate()
+  }
+}
@@ -3,6 +3,7 @@ use super::TypeConfig;
 pub type Raft = openraft::Raft<TypeConfig>;
 
 pub type LogId = openraft::LogId<TypeConfig>;
+pub type Vote = openraft::alias::VoteOf<TypeConfig>;
 pub type StoredMembership = openraft::StoredMembership<TypeConfig>;
 
 pub type Node = <TypeConfig as openraft::RaftTypeConfig>::Node;
@@ -13,6 +14,9 @@ pub type SnapshotMeta = openraft::SnapshotMeta<TypeConfig>;
 pub type Snapshot = openraft::Snapshot<TypeConfig>;
 pub type SnapshotData = <TypeConfig as openraft::RaftTypeConfig>::SnapshotData;
 
+pub type ClientWriteError = openraft::error::ClientWriteError<TypeConfig>;
+pub type LinearizableReadError = openraft::error::LinearizableReadError<TypeConfig>;
+
 pub type RaftMetrics = openraft::RaftMetrics<TypeConfig>;
 
 pub type VoteRequest = openraft::raft::VoteRequest<TypeConfig>;
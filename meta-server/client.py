@@ -1,6 +1,12 @@
+import time
 import xmlrpc.client as xmlrpclib
 
 
+class GzipTransport(xmlrpclib.Transport):
+    # 超过阈值（字节）的请求体用 gzip 压缩后发送给代理服务器
+    encode_threshold = 1400
+
+
 class Client(object):
     def __init__(self):
         self.id = None  # 客户端ID
@@ -9,7 +15,7 @@ class Client(object):
 
     def connect(self, username, password):
         self.port = '21000'
-        self.proxy = xmlrpclib.ServerProxy('http://localhost:' + self.port)
+        self.proxy = xmlrpclib.ServerProxy('http://localhost:' + self.port, transport=GzipTransport(), allow_none=True)
         # 登录
         # 在此处进行验证 调用代理服务器的验证功能
         if self.proxy.authenticate(username, password):
@@ -23,9 +29,14 @@ class Client(object):
     def handle_user_command(self):
         try:
             while True:
-                command = input(f"客户端 {self.id} 输入命令>> ").upper()
+                line = input(f"客户端 {self.id} 输入命令>> ")
+                command = line.upper()
                 if command == 'HELP':
                     self.print_help()  # 打印命令帮助
+                elif command.split()[:1] == ['WATCH']:
+                    self.watch(command)  # 订阅变更，Ctrl+C 结束
+                elif command.split()[:1] in (['PUT-FILE'], ['GET-FILE']):
+                    self.transfer_file(line)  # 文件路径区分大小写，使用原始输入
                 else:
                     self.send_command_to_server(command)  # 向服务器发送命令
                     if command == 'EXIT':
@@ -38,18 +49,104 @@ class Client(object):
         print(
             '-------------------------------------------\n'
             '命令帮助:\n'
-            'PUT key value —— 添加 (key, value)\n'
-            'GET key —— 获取指定 key 的值\n'
+            'PUT key value [ttl] —— 添加 (key, value)，指定 ttl 时 ttl 秒后自动删除\n'
+            'PUT-FILE key path [ttl] —— 以文件内容（按二进制原样保存）为值写入 key\n'
+            'GET-FILE key path —— 把 key 的值写入文件\n'
+            'GET key [@index] —— 获取指定 key 的值，带 @index 时读取 raft log index 为 index 时的值\n'
+            'MGET key1 key2 ... —— 一次获取多个 key 的值\n'
             'DEL key —— 删除指定 key 的值\n'
-            'LIST —— 显示所有 (key, value)\n'
+            'CAS key expected new —— key 的当前值等于 expected 时改为 new（nil 表示不存在/删除）\n'
+            'TXN [key=value | +key | -key]... THEN [PUT key value | DEL key]... —— 条件全部成立时原子地执行操作\n'
+            'WATCH key | WATCH prefix* —— 订阅 key 或前缀的变更，Ctrl+C 结束订阅\n'
+            'LIST [start [end [limit]]] [@index] —— 显示所有 (key, value)，或 [start, end) 区间内最多 limit 个；带 @index 时列出该 log index 时的数据\n'
             'LOG —— 获取日志\n'
             'ADD-LEARNER node_id "api_addr" —— 添加raft节点作为learner\n'
             'CHANGE-MEMBERSHIP node_id1 node_id2 ... —— 改变节点关系\n'
+            'SCALE node_id ["api_addr"] ... —— 扩容：添加 learner，追上 leader 后提升为投票成员\n'
+            'TOPOLOGY —— 查看集群拓扑（成员、learner、leader 和节点地址）\n'
             'METRICS —— 查询当前的raft集群状态\n'
             'EXIT —— 退出客户端\n'
             '-------------------------------------------'
         )
 
+    def watch(self, command):
+        # 长轮询订阅：每次从上次返回的 index 继续，不会漏掉两次请求之间的变更
+        args = command.lower().split()
+        if len(args) != 2:
+            print('错误的命令格式。使用方法: WATCH key 或 WATCH prefix*')
+            return
+        target = args[1]
+        key, prefix = (None, target[:-1]) if target.endswith('*') else (target, None)
+        after = None
+        print(f'开始订阅 {target}，按 Ctrl+C 结束')
+        try:
+            while True:
+                try:
+                    result = self.proxy.watch(self.id, key, prefix, after)
+                except (OSError, xmlrpclib.ProtocolError) as e:
+                    # 断线后从上次的位置重新订阅
+                    print(f'订阅连接中断：{e}，重试中...')
+                    time.sleep(1)
+                    continue
+                if result['status'] == 'compacted':
+                    print(f'部分变更已被丢弃，从 index {result["index"]} 继续订阅')
+                    after = result['index']
+                elif result['status'] == 'ok':
+                    for event in result['value']:
+                        if event['value'] is None:
+                            print(f'[{event["index"]}] 删除 {event["key"]}')
+                        else:
+                            print(f'[{event["index"]}] {event["key"]} = {self._display_value(event["value"])}')
+                    after = result['index']
+                else:
+                    print(f'订阅失败：{result["error"]}')
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            print('结束订阅')
+
+    def transfer_file(self, line):
+        # 二进制值不经过文本命令，直接以 XML-RPC Binary 传给代理
+        args = line.split()
+        name = args[0].upper()
+        if len(args) > 1:
+            args[1] = args[1].lower()  # 与文本命令一样，键不区分大小写
+        if name == 'PUT-FILE' and len(args) in (3, 4):
+            try:
+                ttl = float(args[3]) if len(args) == 4 else None
+                with open(args[2], 'rb') as f:
+                    data = f.read()
+            except (ValueError, OSError) as e:
+                print(f'✗ 无法读取文件：{e}')
+                return
+            result = self.proxy.put_value(self.id, args[1], xmlrpclib.Binary(data), ttl)
+            if result['status'] == 'ok':
+                print(f'✓ 已写入 {args[1]}（{len(data)} 字节）')
+            else:
+                print(f'✗ 无法写入 {args[1]}：{result["error"]}')
+        elif name == 'GET-FILE' and len(args) == 3:
+            result = self.proxy.get_value(self.id, args[1])
+            if result['status'] != 'found':
+                print(f'✗ 未找到键：{args[1]}' if result['status'] == 'missing' else f'✗ 读取失败：{result["error"]}')
+                return
+            value = result['value']
+            data = value.data if isinstance(value, xmlrpclib.Binary) else value.encode('utf-8')
+            try:
+                with open(args[2], 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                print(f'✗ 无法写入文件：{e}')
+                return
+            print(f'✓ 已保存到 {args[2]}（{len(data)} 字节）')
+        else:
+            print('错误的命令格式。使用方法: PUT-FILE key path [ttl] 或 GET-FILE key path')
+
+    @staticmethod
+    def _display_value(value):
+        # 二进制值只显示长度
+        if isinstance(value, xmlrpclib.Binary):
+            return f'<二进制 {len(value.data)} 字节>'
+        return value
+
     def send_command_to_server(self, command):
         msg = getattr(self.proxy, 'function')(self.id, command)  # 向服务器发送命令并获取返回信息
         if msg is not None:
@@ -1,9 +1,16 @@
 import threading
+import time
 import json
+import collections
 import requests
+import xmlrpc.client as xmlrpclib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from socketserver import ThreadingMixIn
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
 
+from value_codec import encode_value, decode_value
+
 # 服务器日志
 log = []
 log_lock = threading.Lock()
@@ -11,106 +18,839 @@ log_lock = threading.Lock()
 # 数据库服务配置
 DB_BASE_URL = "http://127.0.0.1:21001"
 
+# kv-store 请求超时（秒），避免节点宕机时请求无限期挂起
+REQUEST_TIMEOUT = 3.0
+# 熔断器配置：连续失败次数阈值、熔断后多久进入半开状态、主动探测间隔和探测端点
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 5.0
+PROBE_INTERVAL = 2.0
+PROBE_ENDPOINT = '/metrics'
+# 写合并配置：在该时间窗口（秒）内到达的写请求合并为一个 Batch 写入，0 表示不合并
+WRITE_COALESCE_WINDOW = 0.002
+WRITE_COALESCE_MAX_BATCH = 128
+# 对冲读配置：主节点超过延迟分位数仍未返回时向下一个节点发送重复读请求
+HEDGE_READS = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 0.005  # 对冲延迟下限（秒）
+HEDGE_INITIAL_DELAY = 0.05  # 延迟样本不足时使用的对冲延迟（秒）
+HEDGE_BUDGET_RATIO = 0.1  # 对冲预算：每次读累积的额度，即额外负载最多约为读请求的 10%
+HEDGE_BUDGET_BURST = 10
+# 值编码配置：超过阈值（字节）的值用所选压缩算法（zlib/lzma/bz2/raw）压缩后再写入 kv-store
+VALUE_CODEC = 'zlib'
+VALUE_COMPRESS_THRESHOLD = 1024
+
+# 读一致性：local 读任意节点的本地状态（可能读到旧值），lease 由 leader 在租约内读，
+# linearizable 由 leader 经 ReadIndex 确认领导权后读；后两者只发往 leader，不再向所有节点扩散
+READ_CONSISTENCY = 'lease'
+READ_CONSISTENCY_LEVELS = ('local', 'lease', 'linearizable')
+
+# 添加 learner 时先让 leader 生成快照并清理之前的 log，新节点从流式二进制快照开始追赶，不必重放全部 log；
+# 此时 ADD-LEARNER 立即返回，追赶进度见 METRICS
+LEARNER_SEED_SNAPSHOT = True
+# learner 落后 leader 超过该条数时拒绝将其提升为投票成员，None 表示不检查
+LEARNER_MAX_LAG = 100
+
+# 集群拓扑：初始的 kv-store 节点地址和投票成员，之后定期从 /metrics 的 membership_config 刷新（秒）
+TOPOLOGY_SEED_NODES = {1: DB_BASE_URL, 2: "http://127.0.0.1:21002", 3: "http://127.0.0.1:21003"}
+TOPOLOGY_SEED_VOTERS = [1]
+TOPOLOGY_REFRESH_INTERVAL = 2.0
+
+# 订阅长轮询的最长等待时间（秒）；一次订阅最多用时 WATCH_TIMEOUT + REQUEST_TIMEOUT，
+# 需小于代理服务器的 WATCH_CALL_TIMEOUT
+WATCH_TIMEOUT = 5.0
+
+
+class NodeHealth:
+    """
+    单个 kv-store 节点的健康状态与熔断器
+    closed: 正常转发；open: 已熔断，直接跳过该节点；
+    half-open: 熔断超时或主动探测成功后，只放行一个试探请求，成功则恢复，失败则重新熔断
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, url, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = NodeHealth.CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self.trial_in_flight = False  # 半开状态下是否已有试探请求在途
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        # 判断是否可以向该节点发送请求，已知宕机的节点直接跳过
+        with self.lock:
+            if self.state == NodeHealth.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = NodeHealth.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == NodeHealth.HALF_OPEN:
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != NodeHealth.CLOSED:
+                print(f"kv-store 节点恢复: {self.url}")
+            self.state = NodeHealth.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == NodeHealth.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != NodeHealth.OPEN:
+                    print(f"kv-store 节点熔断: {self.url}")
+                self.state = NodeHealth.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def record_probe(self, ok):
+        # 主动探测结果：成功时让已熔断的节点提前进入半开状态，半开状态下再次成功则恢复
+        # （试探请求可能迟迟没有结果，不能只靠它关闭熔断器）；失败时计入失败次数
+        if not ok:
+            self.record_failure()
+            return
+        with self.lock:
+            if self.state == NodeHealth.OPEN:
+                self.state = NodeHealth.HALF_OPEN
+            elif self.state == NodeHealth.HALF_OPEN:
+                print(f"kv-store 节点恢复: {self.url}")
+                self.state = NodeHealth.CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+
+class HealthTracker:
+    # 所有 kv-store 节点的健康状态，被同一进程内的全部 Server 共享
+    def __init__(self, probe_interval=PROBE_INTERVAL, probe_endpoint=PROBE_ENDPOINT):
+        self.nodes = {}  # url -> NodeHealth
+        self.probe_interval = probe_interval
+        self.probe_endpoint = probe_endpoint
+        self.lock = threading.Lock()
+        self.prober = None
+
+    def node(self, url):
+        with self.lock:
+            if url not in self.nodes:
+                self.nodes[url] = NodeHealth(url)
+            return self.nodes[url]
+
+    def start(self):
+        # 启动后台主动探测线程
+        if self.prober is None:
+            self.prober = threading.Thread(target=self._probe_loop, daemon=True)
+            self.prober.start()
+
+    def probe_once(self):
+        # 依次探测每个节点一次
+        with self.lock:
+            nodes = list(self.nodes.values())
+        for node in nodes:
+            try:
+                response = requests.get(f"{node.url}{self.probe_endpoint}", timeout=self.probe_interval)
+                node.record_probe(response.status_code < 500)
+            except requests.exceptions.RequestException:
+                node.record_probe(False)
+
+    def _probe_loop(self):
+        while True:
+            self.probe_once()
+            time.sleep(self.probe_interval)
+
+
+node_health = HealthTracker()
+
+
+class Topology:
+    """
+    集群拓扑：投票成员、learner 和各 kv-store 节点地址，被同一进程内的全部 Server 共享。
+    版本号为成员配置所在的 raft log index，成员每变更一次就增大；后台线程定期从 kv-store 的
+    /metrics 刷新，只采用版本更新的配置，因此拓扑只会向前推进
+    """
+
+    def __init__(self, nodes, voters, refresh_interval=TOPOLOGY_REFRESH_INTERVAL):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.voters = list(voters)
+        self.learners = []
+        self.nodes = dict(nodes)  # node_id -> url
+        self.leader = None
+        self.refresh_interval = refresh_interval
+        self.refresher = None
+
+    def voter_ids(self):
+        with self.lock:
+            return list(self.voters)
+
+    def read_ids(self):
+        # 本地读可以由任意成员（包括 learner）服务，新加入的节点立即分担读负载
+        with self.lock:
+            return self.voters + [i for i in self.learners if i not in self.voters]
+
+    def url(self, node_id):
+        with self.lock:
+            return self.nodes.get(node_id) or f"http://127.0.0.1:{21000 + node_id}"
+
+    def to_dict(self):
+        # XML-RPC 的字典键必须是字符串
+        with self.lock:
+            return {
+                "version": self.version,
+                "voters": list(self.voters),
+                "learners": list(self.learners),
+                "nodes": {str(k): v for k, v in self.nodes.items()},
+                "leader": self.leader,
+            }
+
+    def update(self, data):
+        # 采用版本更新的拓扑，返回是否发生了变化；同一版本只更新 leader
+        with self.lock:
+            if data["version"] < self.version:
+                return False
+            if data["version"] == self.version:
+                changed = data.get("leader") is not None and data.get("leader") != self.leader
+                if changed:
+                    self.leader = data["leader"]
+                return changed
+            self.version = data["version"]
+            self.voters = [int(i) for i in data["voters"]]
+            self.learners = [int(i) for i in data["learners"]]
+            self.nodes.update({int(k): v for k, v in data["nodes"].items()})
+            if data.get("leader") is not None:
+                self.leader = data["leader"]
+        print(f"集群拓扑更新到版本 {data['version']}：投票成员 {data['voters']}，learner {data['learners']}")
+        return True
+
+    @staticmethod
+    def from_metrics(metrics):
+        # 由 /metrics 响应构造拓扑，格式同 to_dict
+        if not isinstance(metrics, dict) or not isinstance(metrics.get("Ok"), dict):
+            return None
+        ok_data = metrics["Ok"]
+        membership_config = ok_data.get("membership_config") or {}
+        membership = membership_config.get("membership") or {}
+        log_id = membership_config.get("log_id") or {}
+        voters = sorted({int(i) for config in membership.get("configs", []) for i in config})
+        nodes = {}
+        for node_id, info in (membership.get("nodes") or {}).items():
+            if isinstance(info, dict) and info.get("addr"):
+                addr = info["addr"]
+                nodes[str(node_id)] = addr if addr.startswith('http') else f"http://{addr}"
+        return {
+            "version": log_id.get("index", 0),
+            "voters": voters,
+            "learners": sorted(int(i) for i in nodes if int(i) not in voters),
+            "nodes": nodes,
+            "leader": ok_data.get("current_leader"),
+        }
+
+    def refresh(self, health=node_health):
+        # 从 kv-store 读取最新的成员配置：先问已知的 leader，再依次问其他节点，取第一个成功的响应
+        with self.lock:
+            order = sorted(self.nodes, key=lambda i: (i != self.leader, i not in self.voters, i))
+            urls = [self.nodes[i] for i in order]
+        for url in urls:
+            node = health.node(url)
+            if not node.allow_request():
+                continue
+            # 与转发请求一样记录结果，否则半开状态下占用的试探名额不会被释放
+            try:
+                response = requests.get(f"{url}/metrics", timeout=REQUEST_TIMEOUT)
+            except requests.exceptions.RequestException:
+                node.record_failure()
+                continue
+            if response.status_code >= 500:
+                node.record_failure()
+                continue
+            node.record_success()
+            try:
+                data = self.from_metrics(response.json())
+            except ValueError:
+                continue
+            if data is not None:
+                self.update(data)
+                return True
+        return False
+
+    def start(self):
+        # 启动后台刷新线程
+        if self.refresher is None:
+            self.refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+            self.refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_interval)
+
+
+cluster_topology = Topology(TOPOLOGY_SEED_NODES, TOPOLOGY_SEED_VOTERS)
+
+
+class PendingWrite:
+    # 等待合并提交的一个写操作
+    def __init__(self, op):
+        self.op = op
+        self.result = None
+        self.done = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    写合并（group commit）：收集窗口期内到达的写操作，合并成一个 Batch 请求写入 kv-store，
+    使多个写只产生一条 raft log，再把结果分别返回给各个调用者
+    """
+
+    def __init__(self, send_batch, window=WRITE_COALESCE_WINDOW, max_batch=WRITE_COALESCE_MAX_BATCH):
+        self.send_batch = send_batch  # 接收操作列表，返回与之一一对应的结果列表
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.first_at = 0.0  # 当前批次第一个写操作到达的时间
+        self.cond = threading.Condition()
+        if self.window > 0:
+            flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            flusher.start()
+
+    def submit(self, op):
+        # 提交一个写操作并阻塞到其所在批次写入完成
+        if self.window <= 0:
+            return self.send_batch([op])[0]
+        item = PendingWrite(op)
+        with self.cond:
+            if not self.pending:
+                self.first_at = time.monotonic()
+            self.pending.append(item)
+            self.cond.notify()
+        item.done.wait()
+        return item.result
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                # 等到窗口结束或攒满一批
+                deadline = self.first_at + self.window
+                while len(self.pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = self.pending[:self.max_batch]
+                self.pending = self.pending[self.max_batch:]
+                if self.pending:
+                    self.first_at = time.monotonic()
+            try:
+                results = self.send_batch([item.op for item in batch])
+            except Exception as e:
+                print(f"批量写入错误: {e}")
+                results = ["Err"] * len(batch)
+            for item, result in zip(batch, results):
+                item.result = result
+                item.done.set()
+
+
+class ReadHedger:
+    """
+    对冲读：向主节点发出读请求，若超过近期延迟的分位数仍未返回，
+    则向下一个可用节点发送重复请求，取最先成功返回的结果；
+    对冲次数受预算限制，避免慢节点时放大集群负载
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, budget_ratio=HEDGE_BUDGET_RATIO, budget_burst=HEDGE_BUDGET_BURST):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.budget = budget_burst
+        self.latencies = collections.deque(maxlen=200)  # 最近成功读请求的延迟（秒）
+        self.stats = {
+            'reads': 0,  # 读请求总数
+            'hedged': 0,  # 发出对冲请求的次数
+            'hedge_wins': 0,  # 对冲请求先返回的次数
+            'primary_wins': 0,  # 发出对冲后仍由主请求先返回的次数
+            'budget_exhausted': 0,  # 因预算不足未能对冲的次数
+        }
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=32)
+
+    def delay(self):
+        # 对冲延迟：近期读延迟的分位数
+        with self.lock:
+            return self._delay()
+
+    def _delay(self):
+        if len(self.latencies) < 20:
+            return HEDGE_INITIAL_DELAY
+        samples = sorted(self.latencies)
+        index = min(len(samples) - 1, len(samples) * self.percentile // 100)
+        return max(HEDGE_MIN_DELAY, samples[index])
+
+    def _take_budget(self):
+        with self.lock:
+            if self.budget >= 1:
+                self.budget -= 1
+                self.stats['hedged'] += 1
+                return True
+            self.stats['budget_exhausted'] += 1
+            return False
+
+    def run(self, targets, send):
+        """
+        依次尝试 targets，send(target) 返回 (ok, data)
+        主请求失败时立即换下一个节点；主请求过慢时在预算内发出一次对冲请求
+        """
+        with self.lock:
+            self.stats['reads'] += 1
+            self.budget = min(self.budget_burst, self.budget + self.budget_ratio)
+
+        start = time.monotonic()
+        pending = {}  # future -> 是否为对冲请求
+        next_index = 0
+        hedge_decided = False  # 本次读是否已经做过对冲决定（最多对冲一次）
+        hedge_sent = False
+        while pending or next_index < len(targets):
+            if not pending:
+                # 没有在途请求（首次或前一个节点失败），直接发送到下一个节点
+                pending[self.executor.submit(send, targets[next_index])] = False
+                next_index += 1
+                continue
+
+            can_hedge = not hedge_decided and next_index < len(targets)
+            done, _ = wait(pending, timeout=self.delay() if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # 主请求超过对冲延迟仍未返回
+                hedge_decided = True
+                if self._take_budget():
+                    hedge_sent = True
+                    pending[self.executor.submit(send, targets[next_index])] = True
+                    next_index += 1
+                continue
+
+            for future in done:
+                is_hedge = pending.pop(future)
+                ok, data = future.result()
+                if not ok:
+                    continue
+                with self.lock:
+                    self.latencies.append(time.monotonic() - start)
+                    if hedge_sent:
+                        self.stats['hedge_wins' if is_hedge else 'primary_wins'] += 1
+                return data
+        return "Err"
+
+    def snapshot(self):
+        # 当前统计和对冲延迟，用于 METRICS 展示
+        with self.lock:
+            return dict(self.stats), self._delay()
+
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    # 每个请求一个线程，并发的写请求才能被合并
+    daemon_threads = True
+
+
+class OpResult:
+    """
+    get/put/delete 的返回结果，通过 XML-RPC 以结构体传给调用方：
+    status  found/missing（读），ok/missing（写），error（请求失败）
+    value   读到的值；put 为写入前的原值，delete 为被删除的值，键原本不存在时为 None
+    index   写入提交的 raft log index，或读取时该节点已 apply 的 log index
+    node    处理请求的 kv-store 节点 id
+    error   失败原因
+    """
+    FOUND = 'found'
+    MISSING = 'missing'
+    OK = 'ok'
+    ERROR = 'error'
+    COMPACTED = 'compacted'  # watch：订阅位置之后的事件已被丢弃，index 为可以继续的位置
+    CONFLICT = 'conflict'  # cas/txn：条件不成立，没有执行任何操作
+
+    def __init__(self, status, value=None, index=None, node=None, error=None):
+        self.status = status
+        self.value = value
+        self.index = index
+        self.node = node
+        self.error = error
+
+    @classmethod
+    def failed(cls, response):
+        # 由 kv-store 的错误响应构造，{"Err": ...} 保留原因
+        if isinstance(response, dict) and "Err" in response:
+            return cls(cls.ERROR, error=json.dumps(response["Err"], ensure_ascii=False))
+        return cls(cls.ERROR, error=str(response))
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "value": self.value,
+            "index": self.index,
+            "node": self.node,
+            "error": self.error,
+        }
+
 
 class Server:
-    def __init__(self, server_id):
+    def __init__(self, server_id, health=node_health, topology=cluster_topology):
         self.server_id = server_id
         self.cache = {}  # 每个服务器实例的缓存字典
-        self.db_urls = [DB_BASE_URL, "http://127.0.0.1:21002", "http://127.0.0.1:21003"]  # 数据库服务URL列表
-        self.current_ids = [1,] # 当前集群中的voter及以上的节点
+        self.topology = topology  # 共享的集群拓扑：成员和 kv-store 节点地址
+        self.health = health  # kv-store 节点健康状态与熔断器
+        for node_id in self.topology.read_ids():
+            self.health.node(self.topology.url(node_id))
+        self.writer = WriteCoalescer(self._write_batch)  # 写合并
+        self.hedger = ReadHedger()  # 对冲读
+        self.leader_id = None  # 最近一次确认的 leader 节点 id
+
+    @property
+    def current_ids(self):
+        # 当前集群中的投票成员，写请求和一致性读只发往它们
+        return self.topology.voter_ids()
         
-    def put(self, key, value, action):
-        # JSON请求体格式留空占位
-        json_data = {
-            "Put":{ "key":key, "value":value }
-        }
+    def put(self, key, value, action=None, ttl=None):
+        # 二进制值通过 XML-RPC Binary 传入；写入 kv-store 前编码（二进制/大值压缩）
+        # ttl 为存活秒数，换算为绝对过期时间写入 log，缺省表示不过期（并清除之前的 TTL）
+        # 返回 OpResult：ok 时 value 为原值（新增的键为 None），调用方据此区分添加和更新
+        value = self._plain_value(value)
+        json_data = {"Put": self._put_op(key, value, ttl)}
         
-        response = self._http_request('/write', json_data=json_data)
-        if response == "Ok":
-            #self.cache[key] = value  # 添加/更新缓存
-            msg = f"{action}key：{key}，value：{value}"
-            self.write_log(msg)
-            return True
-        return False
+        response = self.writer.submit(json_data)
+        ok = self._ok_payload(response)
+        if ok is None:
+            return OpResult.failed(response).to_dict()
+        old_value = ok.get("value")
+        #self.cache[key] = value  # 添加/更新缓存
+        action = action or ("更新" if old_value is not None else "添加")
+        msg = f"{action}key：{key}，value：{self._log_value(value)}"
+        self.write_log(msg)
+        old_value = None if old_value is None else self._wire_value(old_value)
+        return OpResult(OpResult.OK, old_value, ok.get("index"), ok.get("node")).to_dict()
 
-    def get(self, key):
+    def get(self, key, consistency=None, min_index=None, at=None):
         # 先检查缓存，如果存在于缓存中则直接返回
         # if key in self.cache:
         #     return self.cache[key]
 
         # 如果不在缓存中，则从数据库中获取，并更新缓存
-        # JSON请求体格式：字符串key（根据test-cluster.sh，read使用POST方法）
-        json_data = key  # 直接发送字符串key
+        # consistency 为 local/lease/linearizable，缺省使用 READ_CONSISTENCY
+        # min_index 为调用方最近一次写入的 log index，只读取已 apply 到该位置的节点（读己之写）
+        # at 为 log index，读取该位置时的值（多版本读取），节点未 apply 到 at 时换节点读取
+        # 返回 OpResult：found/missing/error，index 为读取时该节点已 apply 的 log index（指定 at 时为 at）
+        consistency = consistency or READ_CONSISTENCY
+        if consistency not in READ_CONSISTENCY_LEVELS:
+            return OpResult(OpResult.ERROR, error=f"未知的一致性级别：{consistency}").to_dict()
+        json_data = {"key": key, "consistency": consistency}
+        if min_index:
+            json_data["min_index"] = min_index
+        if at is not None:
+            json_data["at"] = at
+        if consistency == 'local':
+            response = self._read_request('/read', json_data=json_data, method='POST')
+        else:
+            # 一致性读只需要 leader 应答
+            response = self._leader_request('/read', json_data=json_data, method='POST')
         
-        response = self._http_request('/read', json_data=json_data, method='POST')
-        if response is not None:
-            # 响应格式：{"OK": "value"}，其中第二个值（value）可能是实际值或空字符串
-            if isinstance(response, dict):
-                # 尝试获取 "OK" 键（不区分大小写）
-                if "Ok" in response:
-                    second_value = response["Ok"]
-                else:
-                    # 如果字典中没有OK键，返回空字符串
-                    return ""
-                
-                # 提取第二个值：{"OK": "value"} 中的 "value" 部分
-                # 注意：即使值为空字符串，也要返回（表示键存在但值为空）
-                # 如果第二个值不为空，更新缓存
-                if second_value and second_value != "":
-                    self.cache[key] = second_value
-                # 返回第二个值（可能是实际值或空字符串）
-                # 这里返回的是 {"OK": "value"} 中的 value 部分
-                return second_value
-            # 如果响应格式不对，尝试直接返回响应（可能是字符串格式）
-            elif isinstance(response, str):
-                return response
-            # 如果响应格式不对，返回空字符串表示键不存在
-            return ""
-        # 如果请求失败，返回空字符串
-        return ""
+        ok = self._ok_payload(response)
+        if ok is None:
+            return OpResult.failed(response).to_dict()
+        if ok.get("value") is None:
+            return OpResult(OpResult.MISSING, index=ok.get("index"), node=ok.get("node")).to_dict()
+        value = self._wire_value(ok["value"])
+        self.cache[key] = value
+        return OpResult(OpResult.FOUND, value, ok.get("index"), ok.get("node")).to_dict()
+
+    def get_many(self, keys, consistency=None, min_index=None):
+        """
+        批量读取：一次 /read-many 请求读取多个键，kv-store 只获取一次读锁
+        返回与 keys 一一对应的 OpResult 列表（found/missing，index 和 node 相同）；
+        请求失败时每个键都是同一个 error 结果。consistency 和 min_index 的含义与 get 相同
+        """
+        consistency = consistency or READ_CONSISTENCY
+        if consistency not in READ_CONSISTENCY_LEVELS:
+            failed = OpResult(OpResult.ERROR, error=f"未知的一致性级别：{consistency}")
+            return [failed.to_dict() for _ in keys]
+        json_data = {"keys": list(keys), "consistency": consistency}
+        if min_index:
+            json_data["min_index"] = min_index
+        if consistency == 'local':
+            response = self._read_request('/read-many', json_data=json_data, method='POST')
+        else:
+            response = self._leader_request('/read-many', json_data=json_data, method='POST')
+        ok = self._ok_payload(response)
+        if ok is None or not isinstance(ok.get("values"), list):
+            failed = OpResult.failed(response)
+            return [failed.to_dict() for _ in keys]
+        index, node = ok.get("index"), ok.get("node")
+        return [OpResult(OpResult.MISSING, index=index, node=node).to_dict() if value is None
+                else OpResult(OpResult.FOUND, self._wire_value(value), index, node).to_dict()
+                for value in ok["values"]]
 
     def delete(self, key):
         # 从数据库中删除键值对，并从缓存中删除
-        # 在删除前先检查键是否存在
-        existing_value = self.get(key)
-        if not existing_value or existing_value == "":
-            # 键不存在，返回False表示无法删除
-            return False
-        
-        # 键存在，执行删除操作
+        # 返回 OpResult：ok 时 value 为被删除的值；键不存在为 missing，不需要先读一次确认
         json_data = {
             "Del":{ "key":key }
         }
         
-        response = self._http_request('/write', json_data=json_data)
-        if response == "Ok":
-            #if key in self.cache:
-            #    del self.cache[key]  # 从缓存中删除
-            msg = f"删除key：{key}"
-            self.write_log(msg)
-            return True
-        return False
+        response = self.writer.submit(json_data)
+        ok = self._ok_payload(response)
+        if ok is None:
+            return OpResult.failed(response).to_dict()
+        if ok.get("value") is None:
+            return OpResult(OpResult.MISSING, index=ok.get("index"), node=ok.get("node")).to_dict()
+        #if key in self.cache:
+        #    del self.cache[key]  # 从缓存中删除
+        msg = f"删除key：{key}"
+        self.write_log(msg)
+        return OpResult(OpResult.OK, self._wire_value(ok["value"]), ok.get("index"), ok.get("node")).to_dict()
+
+    def cas(self, key, expected, value):
+        """
+        比较并交换：key 的当前值等于 expected 时写入 value，一次 raft 提交内原子完成
+        expected 为 None 表示要求键不存在，value 为 None 表示删除
+        返回 OpResult：ok 时 value 为原值；conflict 时 value 为当前值
+        """
+        op = ["put", key, value] if value is not None else ["del", key]
+        result = self.txn([["equals", key, expected]], [op])
+        if result["status"] in (OpResult.OK, OpResult.CONFLICT):
+            result["value"] = result["value"][0]
+        return result
 
-    def list(self):
-        # 返回整个数据库
-        # 端点路径和JSON格式留空占位
-        json_data = None  # TODO: 填充JSON格式
+    def txn(self, guards, ops):
+        """
+        事务：guards 为 [["equals", key, value], ["exists", key], ["missing", key], ...]，
+        ops 与 batch 相同；所有 guard 成立时才执行 ops，检查与执行在同一条 raft log 中原子完成
+        返回 OpResult：ok 时 value 为每个操作的结果（put 为原值，del 为被删除的值）；
+        conflict 时不执行任何操作，value 为各 guard 键的当前值
+        """
+        json_guards = []
+        for guard in guards:
+            kind = guard[0].lower()
+            if kind == "equals":
+                expected = guard[2]
+                if expected is not None:
+                    # 与写入时相同的编码，才能和 kv-store 中保存的值比较
+                    expected = encode_value(self._plain_value(expected), VALUE_CODEC, VALUE_COMPRESS_THRESHOLD)
+                json_guards.append({"Equals":{ "key":guard[1], "value":expected }})
+            elif kind == "exists":
+                json_guards.append({"Exists":{ "key":guard[1] }})
+            elif kind == "missing":
+                json_guards.append({"Missing":{ "key":guard[1] }})
+            else:
+                return OpResult(OpResult.ERROR, error=f"未知的条件：{guard[0]}").to_dict()
+        json_data = {"Txn":{ "guards":json_guards, "ops":self._json_ops(ops) }}
         
-        response = self._http_request('/read-all', json_data=json_data, method='GET')
-        if response is not None:
-            return response  # 根据实际响应格式调整
-        return {}
+        # 事务不参与写合并：合并后的 Batch 只保留每个操作的单个结果
+        response = self._leader_request('/write', json_data=json_data)
+        ok = self._ok_payload(response)
+        if ok is None:
+            return OpResult.failed(response).to_dict()
+        results = [None if v is None else self._wire_value(v) for v in ok.get("results", [])]
+        if ok.get("value") is None:
+            return OpResult(OpResult.CONFLICT, results, ok.get("index"), ok.get("node")).to_dict()
+        self.write_log(f"事务：{len(guards)} 个条件，{len(ops)} 个操作")
+        return OpResult(OpResult.OK, results, ok.get("index"), ok.get("node")).to_dict()
+
+    def watch(self, key=None, prefix=None, after=None, timeout=WATCH_TIMEOUT):
+        """
+        订阅 key 或 prefix（都缺省时为所有键）的变更，长轮询直到有变更或超时
+        返回 OpResult：ok 时 value 为事件列表 [{"index", "key", "value"}]（value 为 None 表示删除），
+        index 为下次订阅应使用的 after；after 缺省时从当前位置开始
+        """
+        timeout = min(timeout, WATCH_TIMEOUT)
+        # 每个 kv-store 节点都 apply 同样的日志，任意一个节点都能提供变更事件；不做对冲。
+        # 换节点重试时只等待剩余的时间，整个调用不超过 timeout + REQUEST_TIMEOUT，在代理的调用超时之内返回
+        targets = [self.topology.url(id) for id in self.topology.read_ids()]
+        targets.sort(key=lambda url: self.health.node(url).state == NodeHealth.OPEN)
+        deadline = time.monotonic() + timeout
+        response = "Err"
+        for base_url in targets:
+            now = time.monotonic()
+            if now >= deadline + REQUEST_TIMEOUT:
+                break
+            remaining = max(deadline - now, 0.0)
+            json_data = {"key": key, "prefix": prefix, "after": after, "timeout_ms": int(remaining * 1000)}
+            ok, response = self._node_request(base_url, '/watch', json_data, timeout=deadline + REQUEST_TIMEOUT - now)
+            if ok:
+                break
+        
+        ok = self._ok_payload(response)
+        if ok is None:
+            err = response.get("Err") if isinstance(response, dict) else None
+            if isinstance(err, dict) and "Compacted" in err:
+                return OpResult(OpResult.COMPACTED, index=err["Compacted"].get("floor")).to_dict()
+            return OpResult.failed(response).to_dict()
+        events = [
+            {"index": e["index"], "key": e["key"], "value": None if e["value"] is None else self._wire_value(e["value"])}
+            for e in ok.get("events", [])
+        ]
+        return OpResult(OpResult.OK, events, ok.get("index")).to_dict()
+
+    def batch(self, ops):
+        """
+        批量写入：ops 为 [["put", key, value], ["del", key], ...]，作为一条 raft log 原子地提交
+        返回与 ops 一一对应的结果列表：put 成功为 True；del 在键存在时为 True，不存在时为 False；
+        整个 batch 写入失败时返回 None
+        """
+        json_ops = self._json_ops(ops)
+        ok = self._ok_payload(self._leader_request('/write', json_data={"Batch":{ "ops":json_ops }}))
+        if ok is None or not isinstance(ok.get("results"), list):
+            return None
+        self.write_log(f"批量写入 {len(ops)} 个操作")
+        return [op[0].lower() == "put" or result is not None for op, result in zip(ops, ok["results"])]
+
+    def _write_batch(self, ops):
+        # 把一批写操作作为一个请求写入 kv-store，单个操作时不包装为 Batch
+        if len(ops) == 1:
+            return [self._leader_request('/write', json_data=ops[0])]
+        json_data = {
+            "Batch":{ "ops":ops }
+        }
+        response = self._leader_request('/write', json_data=json_data)
+        ok = self._ok_payload(response)
+        if ok is None or not isinstance(ok.get("results"), list):
+            return [response] * len(ops)
+        # 拆成与单个写入相同格式的结果，共享同一个 log index
+        return [
+            {"Ok": {"index": ok.get("index"), "node": ok.get("node"), "value": result}}
+            for result in ok["results"]
+        ]
+
+    @classmethod
+    def _json_ops(cls, ops):
+        # [["put", key, value], ["del", key], ...] -> kv-store 的 Put/Del 请求，值按写入格式编码
+        # put 可以带第 4 个元素 ttl（秒）
+        json_ops = []
+        for op in ops:
+            if op[0].lower() == "put":
+                ttl = op[3] if len(op) > 3 else None
+                json_ops.append({"Put": cls._put_op(op[1], cls._plain_value(op[2]), ttl)})
+            else:
+                json_ops.append({"Del":{ "key":op[1] }})
+        return json_ops
+
+    @staticmethod
+    def _put_op(key, value, ttl=None):
+        op = {"key": key, "value": encode_value(value, VALUE_CODEC, VALUE_COMPRESS_THRESHOLD)}
+        if ttl is not None:
+            # 过期时间由写入方计算，各副本使用 log 中相同的值
+            op["expire_at"] = int((time.time() + float(ttl)) * 1000)
+        return op
+
+    @staticmethod
+    def _plain_value(value):
+        # XML-RPC Binary -> bytes，字符串原样返回
+        return value.data if isinstance(value, xmlrpclib.Binary) else value
+
+    @staticmethod
+    def _ok_payload(response):
+        # 取出 kv-store 成功响应 {"Ok": {...}} 中的结果，失败时返回 None
+        if isinstance(response, dict) and isinstance(response.get("Ok"), dict):
+            return response["Ok"]
+        return None
+
+    def list(self, start=None, end=None, limit=None, at=None):
+        # 返回 [start, end) 区间内最多 limit 个键值对，参数缺省表示整个数据库
+        # at 为 log index，列出该位置时的数据；缺省时为节点开始扫描时已 apply 的位置，扫描期间的写入不影响结果
+        # 通过 /range 流式读取，逐行解析，不需要先缓存完整的响应体
+        json_data = {"start": start, "end": end, "limit": limit}
+        if at is not None:
+            json_data["at"] = at
+        
+        items = []
+        for item in self._stream_request('/range', json_data=json_data):
+            if item is None:
+                return "Err"
+            if "Err" in item:
+                # 如 {"Compacted": {"floor": n}}：at 早于节点保留的最早版本
+                return {"Err": item["Err"]}
+            items.append({"k": item.get("k"), "v": self._wire_value(item.get("v"))})
+        return {"Ok": items}
+
+    def _stream_request(self, endpoint, json_data=None):
+        # 流式请求：逐行产出 NDJSON 响应中的对象，请求失败时产出 None
+        # 连接失败，或节点只返回一行 {"Err": {"Lagging": ...}}（还未 apply 到要求的位置）时换下一个成员节点，
+        # 已开始接收数据后不再切换；所有节点都落后时产出最后一个错误
+        lagging = None
+        for id in self.topology.read_ids():
+            base_url = self.topology.url(id)
+            url = f"{base_url}{endpoint}"
+            node = self.health.node(base_url)
+            if not node.allow_request():
+                continue
+            try:
+                response = requests.post(url, json=json_data, stream=True, timeout=REQUEST_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                node.record_failure()
+                print(f"HTTP请求错误 (URL: {url}): {e}")
+                continue
+            with response:
+                if response.status_code >= 500:
+                    node.record_failure()
+                    continue
+                node.record_success()
+                if response.status_code >= 400:
+                    break
+                try:
+                    first = True
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        item = json.loads(line)
+                        if first and isinstance(item.get("Err"), dict) and "Lagging" in item["Err"]:
+                            lagging = item
+                            break
+                        first = False
+                        yield item
+                    else:
+                        return
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    print(f"流式读取错误 (URL: {url}): {e}")
+                    yield None
+                    return
+        yield lagging
+
+    @staticmethod
+    def _wire_value(stored):
+        # kv-store 中保存的值 -> XML-RPC 返回值，二进制值用 Binary 返回
+        value = decode_value(stored)
+        if isinstance(value, bytes):
+            return xmlrpclib.Binary(value)
+        return value
+
+    @staticmethod
+    def _log_value(value):
+        # 日志中只记录二进制值和大值的长度
+        if isinstance(value, bytes):
+            return f"<二进制 {len(value)} 字节>"
+        if len(value) > 200:
+            return f"{value[:50]}...（共 {len(value)} 字符）"
+        return value
 
     def add_learner(self, node_id, api_addr):
         # 添加raft节点作为learner
         # 格式: [node_id, "api_addr"] 例如: [2, "127.0.0.1:21002"]
         json_data = [node_id, api_addr]
-        
-        response = self._http_request('/add-learner', json_data=json_data)
+        endpoint = '/add-learner'
+        if LEARNER_SEED_SNAPSHOT:
+            endpoint += '?seed=true&blocking=false'
+
+        # 成员变更只能由 leader 执行，其他节点会返回 ForwardToLeader
+        response = self._leader_request(endpoint, json_data=json_data)
         # 检查响应中是否包含 "Ok" 键，如果包含则说明操作成功
         if response is not None and isinstance(response, dict) and "Ok" in response:
             msg = f"添加learner节点: node_id={node_id}, address={api_addr}"
             self.write_log(msg)
+            # 新 learner 立即加入本地读的候选节点
+            self.topology.refresh(self.health)
             return response
         return None
 
@@ -122,16 +862,98 @@ class Server:
             json_data = list(node_ids)
         else:
             json_data = node_ids
-        
-        response = self._http_request('/change-membership', json_data=json_data)
+        endpoint = '/change-membership'
+        if LEARNER_MAX_LAG is not None:
+            endpoint += f'?max_lag={LEARNER_MAX_LAG}'
+
+        response = self._leader_request(endpoint, json_data=json_data)
         # 检查响应中是否包含 "Ok" 键，如果包含则说明操作成功
         if response is not None and isinstance(response, dict) and "Ok" in response:
             msg = f"改变成员关系: {json_data}"
             self.write_log(msg)
-            self.current_ids = node_ids
+            # 立即读取新的成员配置，不等后台刷新
+            self.topology.refresh(self.health)
+            return response
+        return None
+
+    def scale(self, nodes):
+        # 扩容的第一步：nodes 为 {node_id(字符串): api_addr}，把尚未加入的节点添加为 learner（从快照开始追赶）。
+        # 等待追赶（scale_progress）和提升为投票成员（change_membership）由代理分步调用，
+        # 只在新节点追上之后才发起成员变更，联合共识期间的写入不会等待落后的新节点
+        # 返回 {"ok": 是否成功, "voters": 当前投票成员, "new": 需要提升的节点 id, "error": 错误信息}
+        nodes = {int(node_id): addr for node_id, addr in nodes.items()}
+        metrics = self._leader_metrics()
+        if metrics is None:
+            return {"ok": False, "error": "无法获取 leader 的集群状态"}
+        voters, _ = self._membership(metrics)
+        learners = self._learner_ids(metrics)
+        new = {node_id: addr for node_id, addr in nodes.items() if node_id not in voters}
+
+        for node_id, addr in new.items():
+            # 已经是 learner 的节点不必重复添加
+            if node_id in learners:
+                continue
+            if self.add_learner(node_id, addr) is None:
+                return {"ok": False, "error": f"无法添加 learner 节点 {node_id}"}
+        return {"ok": True, "voters": sorted(voters), "new": sorted(new)}
+
+    def scale_progress(self, node_ids):
+        # 新 learner 的追赶进度：{"ready": 是否都已追到 leader 附近（LEARNER_MAX_LAG）, "lag": 各节点落后条数}
+        metrics = self._leader_metrics()
+        if metrics is None:
+            return {"ready": False, "lag": {}}
+        lag = self._replication_lag(metrics, node_ids)
+        max_lag = LEARNER_MAX_LAG or 0
+        ready = bool(lag) and all(l is not None and l <= max_lag for l in lag.values())
+        return {"ready": ready, "lag": {str(k): v for k, v in lag.items()}}
+
+    def get_topology(self):
+        # 当前的集群拓扑（同一进程内的全部节点服务器共享），供代理的 TOPOLOGY 命令显示
+        return self.topology.to_dict()
+
+    def _leader_metrics(self):
+        # 复制进度只在 leader 上可知：先从任一节点得知 leader，再查询 leader 的 metrics
+        response = self._http_request('/metrics', json_data=None, method='GET')
+        if not isinstance(response, dict) or not isinstance(response.get("Ok"), dict):
+            return None
+        leader = response["Ok"].get("current_leader")
+        if leader is None or leader == response["Ok"].get("id"):
             return response
+        _, known = self._membership(response)
+        addr = known.get(str(leader))
+        if addr is None:
+            return None
+        url = addr if addr.startswith('http') else f"http://{addr}"
+        ok, leader_response = self._node_request(url, '/metrics', method='GET')
+        if ok and isinstance(leader_response, dict) and isinstance(leader_response.get("Ok"), dict):
+            return leader_response
         return None
 
+    @staticmethod
+    def _membership(metrics):
+        # 从 metrics 的 membership_config 中取出 (投票成员集合, {node_id: addr})
+        membership = metrics["Ok"].get("membership_config", {}).get("membership", {})
+        voters = {int(node_id) for config in membership.get("configs", []) for node_id in config}
+        nodes = {str(node_id): info.get("addr") for node_id, info in membership.get("nodes", {}).items()
+                 if isinstance(info, dict)}
+        return voters, nodes
+
+    def _learner_ids(self, metrics):
+        voters, nodes = self._membership(metrics)
+        return {int(node_id) for node_id in nodes} - voters
+
+    @staticmethod
+    def _replication_lag(metrics, node_ids):
+        # 根据 leader metrics 的 replication 计算各节点落后的 log 条数，尚无复制记录时为 None
+        ok_data = metrics["Ok"]
+        replication = ok_data.get("replication") or metrics.get("replication") or {}
+        last = ok_data.get("last_log_index") or 0
+        lag = {}
+        for node_id in node_ids:
+            matched = replication.get(str(node_id))
+            lag[node_id] = last - matched.get("index", 0) if isinstance(matched, dict) else None
+        return lag
+
     def metrics(self):
         # 查询当前的raft集群状态
         # GET请求，无参数
@@ -139,8 +961,27 @@ class Server:
         if response is not None:
             # 解析并格式化 metrics 响应
             formatted_result = self._format_metrics(response)
+            if isinstance(formatted_result, str):
+                formatted_result += "\n" + self._format_hedge_stats()
             return formatted_result
         return None
+
+    def _format_hedge_stats(self):
+        # 格式化本节点服务器的对冲读统计
+        stats, delay = self.hedger.snapshot()
+        reads = stats['reads']
+        hedge_rate = stats['hedged'] / reads * 100 if reads else 0.0
+        result_lines = []
+        result_lines.append(f"【对冲读统计 (节点服务器 {self.server_id})】")
+        result_lines.append(f"  对冲读: {'开启' if HEDGE_READS else '关闭'}")
+        result_lines.append(f"  读请求总数: {reads}")
+        result_lines.append(f"  对冲请求数: {stats['hedged']} (对冲率 {hedge_rate:.2f}%)")
+        result_lines.append(f"  对冲请求先返回: {stats['hedge_wins']}")
+        result_lines.append(f"  主请求先返回: {stats['primary_wins']}")
+        result_lines.append(f"  预算不足未对冲: {stats['budget_exhausted']}")
+        result_lines.append(f"  当前对冲延迟: {delay * 1000:.1f} 毫秒 (p{HEDGE_PERCENTILE})")
+        result_lines.append("=" * 60)
+        return "\n".join(result_lines)
     
     def _format_metrics(self, metrics_data):
         """
@@ -326,6 +1167,22 @@ class Server:
                             if isinstance(node_info, dict) and "addr" in node_info:
                                 result_lines.append(f"      节点 {node_id}: {node_info['addr']}")
         
+        # raft 配置（kv-store 启动时生效的调优参数）
+        if "config" in metrics_data and isinstance(metrics_data["config"], dict):
+            result_lines.extend(self._format_raft_config(metrics_data["config"]))
+
+        # learner 追赶进度
+        if "catch_up" in metrics_data and isinstance(metrics_data["catch_up"], dict):
+            result_lines.extend(self._format_catch_up(metrics_data["catch_up"], metrics_data.get("Ok", {})))
+
+        # 快照和 log 压缩统计
+        if "compaction" in metrics_data and isinstance(metrics_data["compaction"], dict):
+            result_lines.extend(self._format_compaction(metrics_data["compaction"]))
+
+        # 状态机存放方式和读缓存
+        if "state" in metrics_data and isinstance(metrics_data["state"], dict):
+            result_lines.extend(self._format_state(metrics_data["state"]))
+
         # 心跳信息（非 RaftMetrics 标准字段，可能是扩展信息）
         if "heartbeat" in metrics_data and isinstance(metrics_data["heartbeat"], dict):
             result_lines.append("\n【心跳信息 (heartbeat)】")
@@ -359,6 +1216,91 @@ class Server:
         
         return "\n".join(result_lines)
 
+    def _format_raft_config(self, config):
+        # 格式化 raft 调优参数，并给出由此决定的故障切换时间
+        result_lines = ["\n【Raft 配置 (config)】"]
+        heartbeat = config.get('heartbeat_interval')
+        timeout_min = config.get('election_timeout_min')
+        timeout_max = config.get('election_timeout_max')
+        result_lines.append(f"  心跳间隔 (heartbeat_interval): {heartbeat} 毫秒")
+        result_lines.append(f"  选举超时 (election_timeout): {timeout_min} ~ {timeout_max} 毫秒")
+        if isinstance(heartbeat, int) and isinstance(timeout_max, int) and heartbeat > 0:
+            result_lines.append(f"    └─ Leader 宕机后约 {timeout_min} ~ {timeout_max} 毫秒开始选举；"
+                                f"每个 follower 每秒约 {1000 / heartbeat:.1f} 次心跳")
+        policy = config.get('snapshot_policy')
+        if isinstance(policy, dict) and 'LogsSinceLast' in policy:
+            result_lines.append(f"  快照策略 (snapshot_policy): 每新增 {policy['LogsSinceLast']} 条 log 生成快照")
+        elif policy is not None:
+            result_lines.append(f"  快照策略 (snapshot_policy): {policy}")
+        for key, label in [('max_in_snapshot_log_to_keep', '快照后保留的 log 条数'),
+                           ('purge_batch_size', '每次清理 log 的最少条数'),
+                           ('max_payload_entries', '单次 append-entries 最多 log 条数')]:
+            if key in config:
+                result_lines.append(f"  {label} ({key}): {config[key]}")
+        return result_lines
+
+    def _format_catch_up(self, catch_up, ok_data):
+        # 格式化各 learner 的追赶进度
+        result_lines = ["\n【Learner 追赶进度 (catch_up)】"]
+        if not catch_up:
+            result_lines.append("  无 learner")
+            return result_lines
+        last = ok_data.get('last_log_index') or 0
+        for node_id, progress in catch_up.items():
+            matched = progress.get('matched')
+            lag = progress.get('lag', 0)
+            percent = (matched or 0) / last * 100 if last else 100.0
+            ready = LEARNER_MAX_LAG is None or lag <= LEARNER_MAX_LAG
+            result_lines.append(f"  节点 {node_id}: 已复制到 {matched if matched is not None else '无'}，"
+                                f"落后 {lag} 条 ({percent:.1f}%)，{'可以提升为投票成员' if ready else '追赶中'}")
+        return result_lines
+
+    @staticmethod
+    def _format_bytes(n):
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if n < 1024 or unit == 'GiB':
+                return f"{n:.1f} {unit}" if unit != 'B' else f"{n} B"
+            n /= 1024
+
+    def _format_compaction(self, stats):
+        # 格式化 log 压缩统计：log 占用、距上次快照的增量、快照和 compaction 耗时
+        fmt = self._format_bytes
+        result_lines = ["\n【日志压缩 (compaction)】"]
+        result_lines.append(f"  log 占用空间 (log_bytes_on_disk): {fmt(stats.get('log_bytes_on_disk', 0))}")
+        result_lines.append(f"  距上次快照的 log 条数 (entries_since_snapshot): {stats.get('entries_since_snapshot', 0)}")
+        limit = stats.get('snapshot_log_bytes', 0)
+        since = fmt(stats.get('bytes_since_snapshot', 0))
+        if limit:
+            result_lines.append(f"  距上次快照写入的 log (bytes_since_snapshot): {since} / 阈值 {fmt(limit)}")
+        else:
+            result_lines.append(f"  距上次快照写入的 log (bytes_since_snapshot): {since} (不按字节数触发快照)")
+        result_lines.append(f"  已生成快照: {stats.get('snapshot_count', 0)} 次，"
+                            f"最近一次耗时 {stats.get('last_snapshot_ms', 0)} 毫秒，"
+                            f"大小 {fmt(stats.get('last_snapshot_bytes', 0))}")
+        result_lines.append(f"  log 清理 (purge): {stats.get('purge_count', 0)} 次")
+        result_lines.append(f"  RocksDB compaction: {stats.get('compaction_count', 0)} 次，"
+                            f"最近一次耗时 {stats.get('last_compaction_ms', 0)} 毫秒")
+        return result_lines
+
+    def _format_state(self, stats):
+        # 格式化状态机统计：memory 全部在内存中；rocksdb 保存在磁盘上，显示读缓存的占用和命中率
+        backend = stats.get('backend', 'memory')
+        result_lines = ["\n【状态机 (state)】", f"  存放方式 (backend): {backend}"]
+        if backend == 'memory':
+            return result_lines
+        fmt = self._format_bytes
+        hits = stats.get('cache_hits', 0)
+        lookups = hits + stats.get('cache_misses', 0)
+        ratio = f"{hits / lookups:.1%}" if lookups else "-"
+        result_lines.append(f"  读缓存: {stats.get('cache_entries', 0)} 个键，"
+                            f"{fmt(stats.get('cache_bytes', 0))} / {fmt(stats.get('cache_capacity', 0))}")
+        result_lines.append(f"  读缓存命中率: {ratio} ({hits}/{lookups})")
+        return result_lines
+
+    def ping(self):
+        # 供代理服务器做健康检查
+        return True
+
     def get_log(self):
         # 返回服务器日志
         with log_lock:
@@ -373,34 +1315,11 @@ class Server:
     def _http_request(self, endpoint, json_data=None, method='POST'):
         # HTTP请求辅助方法，处理JSON序列化和错误处理
         # 遍历3个URL，如果所有响应都是"Err"，返回"Err"；否则返回第一个非"Err"响应的json()
-        headers = {'Content-Type': 'application/json'}
         responses = []
         
         for id in self.current_ids:
-            url = f"{self.db_urls[id - 1]}{endpoint}"
-            try:
-                if method == 'POST':
-                    response = requests.post(url, json=json_data, headers=headers)
-                elif method == 'GET':
-                    response = requests.get(url, headers=headers)
-                else:
-                    continue
-                
-                response.raise_for_status()
-                # 检查响应内容
-                if response.content:
-                    try:
-                        response_data = response.json()
-                        responses.append(response_data)
-                    except ValueError:
-                        # 如果不是JSON格式，返回原始文本
-                        response_text = response.text
-                        responses.append(response_text)
-                else:
-                    responses.append(None)
-            except requests.exceptions.RequestException as e:
-                print(f"HTTP请求错误 (URL: {url}): {e}")
-                responses.append("Err")
+            _, response = self._node_request(self.topology.url(id), endpoint, json_data, method)
+            responses.append(response)
 
         # 检查所有响应是否都是"Err"
         if all(resp == "Err" for resp in responses):
@@ -413,10 +1332,111 @@ class Server:
         
         return None
 
+    def _read_request(self, endpoint, json_data=None, method='POST'):
+        # 读请求：开启对冲读时只等待最先返回的节点，否则按顺序尝试；
+        # 节点返回 {"Err": ...}（如读己之写时该节点还未 apply 到要求的位置）时换下一个节点
+        targets = [self.topology.url(id) for id in self.topology.read_ids()]
+        # 已熔断的节点排在最后，只在其他节点都失败时才会尝试
+        targets.sort(key=lambda url: self.health.node(url).state == NodeHealth.OPEN)
+
+        def send(base_url):
+            ok, response = self._node_request(base_url, endpoint, json_data, method)
+            failed = isinstance(response, dict) and "Err" in response
+            return ok and response is not None and not failed, response
+
+        if not HEDGE_READS:
+            for base_url in targets:
+                ok, response = send(base_url)
+                if ok:
+                    return response
+            return "Err"
+        return self.hedger.run(targets, send)
+
+    def _leader_request(self, endpoint, json_data=None, method='POST'):
+        # 只发往 leader 的请求：先试最近确认的 leader，收到 ForwardToLeader 时改发给它指出的 leader，
+        # leader 未知或不可达时依次尝试其余节点
+        order = list(self.current_ids)
+        # 本服务器还没有确认过 leader 时使用集群拓扑中记录的 leader
+        leader_id = self.leader_id if self.leader_id is not None else self.topology.leader
+        if leader_id in order:
+            order.remove(leader_id)
+            order.insert(0, leader_id)
+
+        tried = set()
+        while order:
+            id = order.pop(0)
+            if id in tried:
+                continue
+            tried.add(id)
+            ok, response = self._node_request(self.topology.url(id), endpoint, json_data, method)
+            if not ok:
+                continue
+            forward, leader = self._forward_to_leader(response)
+            if not forward:
+                self.leader_id = id
+                return response
+            if leader in self.current_ids and leader not in tried:
+                order.insert(0, leader)
+        return "Err"
+
+    @staticmethod
+    def _forward_to_leader(response):
+        # 解析 {"Err": {"ForwardToLeader": {"leader_id": id, ...}}}，返回 (是否需要转发, leader id)
+        if isinstance(response, dict) and isinstance(response.get("Err"), dict):
+            forward = response["Err"].get("ForwardToLeader")
+            if isinstance(forward, dict):
+                return True, forward.get("leader_id")
+            # 成员变更的 learner 进度检查在非 leader 节点上返回 NotLeader
+            not_leader = response["Err"].get("NotLeader")
+            if isinstance(not_leader, dict):
+                return True, not_leader.get("leader")
+        return False, None
+
+    def _node_request(self, base_url, endpoint, json_data=None, method='POST', timeout=REQUEST_TIMEOUT):
+        # 向单个 kv-store 节点发送请求，返回 (是否成功, 响应)，失败时响应为 "Err"
+        headers = {'Content-Type': 'application/json'}
+        url = f"{base_url}{endpoint}"
+        node = self.health.node(base_url)
+        # 已熔断的节点直接跳过，不等待连接错误
+        if not node.allow_request():
+            return False, "Err"
+        recorded = False
+        try:
+            if method == 'POST':
+                response = requests.post(url, json=json_data, headers=headers, timeout=timeout)
+            else:
+                response = requests.get(url, headers=headers, timeout=timeout)
+            
+            # 只有连接错误、超时和 5xx 视为节点故障
+            if response.status_code >= 500:
+                node.record_failure()
+            else:
+                node.record_success()
+            recorded = True
+            response.raise_for_status()
+            # 检查响应内容
+            if response.content:
+                try:
+                    return True, response.json()
+                except ValueError:
+                    # 如果不是JSON格式，返回原始文本
+                    return True, response.text
+            return True, None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            node.record_failure()
+            print(f"HTTP请求错误 (URL: {url}): {e}")
+            return False, "Err"
+        except requests.exceptions.RequestException as e:
+            # 其他请求错误（如重定向过多）也要记录结果，否则半开状态下的试探名额不会被释放
+            if not recorded:
+                node.record_failure()
+            print(f"HTTP请求错误 (URL: {url}): {e}")
+            return False, "Err"
+
 
 def run_server(server_id):
     # 启动和运行 XML-RPC 服务器
-    server = SimpleXMLRPCServer(("localhost", 20000 + server_id), requestHandler=SimpleXMLRPCRequestHandler, allow_none=True)
+    server = ThreadedXMLRPCServer(("localhost", 20000 + server_id), requestHandler=SimpleXMLRPCRequestHandler, allow_none=True)
     server.register_instance(Server(server_id))
     print(f"服务器 {server_id} 正在运行在端口 {20000 + server_id}\n")
     server.serve_forever()
@@ -426,9 +1446,15 @@ if __name__ == "__main__":
     # 输入服务器数量并启动相应数量的线程
     count = int(input('输入服务器数量：'))
     threads = []
+    node_health.start()
+    cluster_topology.start()
 
     for i in range(count):
         server_thread = threading.Thread(target=run_server, args=(i,))
         threads.append(server_thread)
         server_thread.start()
 
+
+    # 主线程等待服务器线程，保持解释器存活（线程池在主线程退出后无法再提交任务）
+    for server_thread in threads:
+        server_thread.join()
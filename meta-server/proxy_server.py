@@ -1,29 +1,221 @@
+import json
+import random
+import threading
+import time
+from socketserver import ThreadingMixIn
 from xmlrpc.server import SimpleXMLRPCServer
 import xmlrpc.client as xmlrpclib
 
+# 会话读使用的一致性级别：local 可由任意跟上会话写入进度的节点（包括 follower）服务，
+# 配合会话记录的 log index 实现读己之写
+SESSION_READ_CONSISTENCY = 'local'
+
+# SCALE 等待新 learner 追上 leader 的最长时间和查询复制进度的间隔（秒）
+SCALE_CATCH_UP_TIMEOUT = 120.0
+SCALE_POLL_INTERVAL = 0.5
+
+# WATCH 调用节点服务器的超时（秒）：节点服务器最多长轮询 WATCH_TIMEOUT（5 秒），
+# 换 kv-store 节点时再多等一个请求超时（3 秒），留出余量，避免没有变更的订阅被当作错误
+WATCH_CALL_TIMEOUT = 15.0
+
+
+class TimeoutTransport(xmlrpclib.Transport):
+    # 带超时的 XML-RPC 传输层，避免节点服务器卡死时拖住代理
+    # 超过 encode_threshold 字节的请求体用 gzip 压缩（响应体由节点服务器按同样的阈值压缩）
+    encode_threshold = 1400
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    # 每个请求一个线程，使多个客户端的请求可以并发转发到不同的节点服务器
+    daemon_threads = True
+
+
+class Backend:
+    # 一个节点服务器后端：地址、在途请求数和健康状态
+    def __init__(self, index, url):
+        self.index = index
+        self.url = url
+        self.outstanding = 0  # 在途请求数，用于负载均衡
+        self.healthy = True
+        self.failures = 0  # 连续失败次数
+
+
+class NodeServerPool:
+    """
+    节点服务器池：会话与后端分离，每个请求按 power-of-two-choices
+    选择在途请求更少的健康节点服务器，并由后台线程周期性做健康检查
+    """
+
+    def __init__(self, server_count, base_port=20000, timeout=10.0,
+                 health_interval=2.0, max_failures=2):
+        self.backends = [Backend(i, f'http://localhost:{base_port + i}') for i in range(server_count)]
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.max_failures = max_failures  # 连续失败多少次后标记为不健康
+        self.lock = threading.Lock()
+
+        checker = threading.Thread(target=self._health_loop, daemon=True)
+        checker.start()
+
+    def _proxy(self, backend, timeout=None):
+        # ServerProxy 不是线程安全的，每次调用新建一个
+        transport = TimeoutTransport(timeout or self.timeout)
+        return xmlrpclib.ServerProxy(backend.url, transport=transport, allow_none=True)
+
+    def pick(self, exclude=()):
+        # power-of-two-choices：随机取两个健康后端，选在途请求较少的一个
+        with self.lock:
+            candidates = [b for b in self.backends if b.healthy and b.index not in exclude]
+            if not candidates:
+                # 没有健康后端时退化为在其余全部后端中选择，给它们恢复的机会
+                candidates = [b for b in self.backends if b.index not in exclude]
+            if not candidates:
+                return None
+            if len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                a, b = random.sample(candidates, 2)
+                chosen = a if a.outstanding <= b.outstanding else b
+            chosen.outstanding += 1
+            return chosen
+
+    def call(self, method, *args, timeout=None, retry=True):
+        # 选择一个后端执行 RPC；连接被拒绝（请求一定没有发出）时换另一个后端重试一次。
+        # 超时等其他错误时请求可能仍在第一个后端上执行，不再重试，以免同一个写入执行两次；
+        # 成员变更等非幂等的管理命令使用 retry=False，任何错误都不重试
+        tried = set()
+        last_error = None
+        for _ in range(2 if retry else 1):
+            backend = self.pick(exclude=tried)
+            if backend is None:
+                break
+            tried.add(backend.index)
+            try:
+                result = getattr(self._proxy(backend, timeout), method)(*args)
+                self._mark(backend, ok=True)
+                return result
+            except (OSError, xmlrpclib.ProtocolError) as e:
+                last_error = e
+                self._mark(backend, ok=False)
+                if not isinstance(e, ConnectionRefusedError):
+                    break
+            finally:
+                self._release(backend)
+        raise last_error if last_error else RuntimeError('没有可用的节点服务器')
+
+    def call_on(self, backend, method, *args):
+        # 在指定的节点服务器上执行 RPC，失败时返回 None
+        try:
+            result = getattr(self._proxy(backend), method)(*args)
+            self._mark(backend, ok=True)
+            return result
+        except (OSError, xmlrpclib.ProtocolError):
+            self._mark(backend, ok=False)
+            return None
+
+    def collect(self, method, *args):
+        # 在每个节点服务器上执行 RPC，返回 [(后端, 结果)]，失败的后端结果为 None
+        return [(backend, self.call_on(backend, method, *args)) for backend in self.backends]
+
+    def _release(self, backend):
+        with self.lock:
+            backend.outstanding -= 1
+
+    def _mark(self, backend, ok):
+        with self.lock:
+            if ok:
+                if not backend.healthy:
+                    print(f'节点服务器 {backend.index} 恢复健康')
+                backend.failures = 0
+                backend.healthy = True
+            else:
+                backend.failures += 1
+                if backend.healthy and backend.failures >= self.max_failures:
+                    print(f'节点服务器 {backend.index} 不可用，暂停向其转发请求')
+                    backend.healthy = False
+
+    def _health_loop(self):
+        # 主动健康检查：周期性调用每个节点服务器的 ping
+        while True:
+            for backend in self.backends:
+                try:
+                    self._proxy(backend, timeout=self.health_interval).ping()
+                    self._mark(backend, ok=True)
+                except Exception:
+                    self._mark(backend, ok=False)
+            time.sleep(self.health_interval)
+
 
 class ProxyServer:
-    def __init__(self, client_count):
+    def __init__(self, server_count, max_clients=None):
         # 用户名和密码
         self.users = {
             '1': '1',
             '2': '2',
             '3': '3',
         }
-        # 初始化代理服务器，设置客户端连接状态和服务器列表
-        self.client_ids = [False] * client_count  # 用于标记客户端是否连接的列表
-        # 连接到不同的服务器节点，服务器的基地址是20000
-        self.servers = [xmlrpclib.ServerProxy(f'http://localhost:{20000 + i}') for i in range(client_count)]
+        # 客户端会话与节点服务器解耦：会话只记录登录状态，请求由节点服务器池负载均衡
+        self.sessions = {}  # client_id -> 会话信息
+        self.max_clients = max_clients  # None 表示不限制客户端数量
+        self.next_id = 0
+        self.session_lock = threading.Lock()
+        # 节点服务器池，服务器的基地址是20000
+        # 集群拓扑由节点服务器从 kv-store 刷新；所有节点服务器运行在同一进程中，共享同一份拓扑，代理不需要再同步
+        self.servers = NodeServerPool(server_count)
 
     # 分配客户端ID
     def get_id(self):
-        for i, connected in enumerate(self.client_ids):
-            if not connected:
-                self.client_ids[i] = True
-                print(f'客户端 {i} 登录')
-                return i
-        print('没有可用的 ID')
-        return None
+        with self.session_lock:
+            if self.max_clients is not None and len(self.sessions) >= self.max_clients:
+                print('没有可用的 ID')
+                return None
+            client_id = self.next_id
+            self.next_id += 1
+            # index 为会话已观察到的最大 raft log index（写入提交或读取时的位置）
+            self.sessions[client_id] = {'login_time': time.time(), 'index': 0}
+        print(f'客户端 {client_id} 登录')
+        return client_id
+
+    def _session_index(self, client_id):
+        with self.session_lock:
+            session = self.sessions.get(client_id)
+            return session['index'] if session is not None else 0
+
+    def _observe(self, client_id, result):
+        # 记录会话观察到的最大 log index，之后的读只由已 apply 到该位置的节点服务
+        index = result.get('index')
+        if not index:
+            return
+        with self.session_lock:
+            session = self.sessions.get(client_id)
+            if session is not None and index > session['index']:
+                session['index'] = index
+
+    # 订阅变更：客户端循环调用（长轮询），每次传入上次返回的 index 以便断线后继续
+    def watch(self, client_id, key=None, prefix=None, after=None):
+        result = self.servers.call('watch', key, prefix, after, timeout=WATCH_CALL_TIMEOUT)
+        self._observe(client_id, result)
+        return result
+
+    # 读写单个值：命令行只能传递文本，二进制值（XML-RPC Binary）由客户端直接调用，返回 OpResult
+    def put_value(self, client_id, key, value, ttl=None):
+        result = self.servers.call('put', key, value, None, ttl)
+        self._observe(client_id, result)
+        return result
+
+    def get_value(self, client_id, key):
+        result = self.servers.call('get', key, SESSION_READ_CONSISTENCY, self._session_index(client_id))
+        self._observe(client_id, result)
+        return result
 
     # 处理客户端发来的命令
     def function(self, client_id, clause):
@@ -37,7 +229,7 @@ class ProxyServer:
         command = clause[0]
 
         # 检查命令类型
-        if command in ['put', 'get', 'del', 'list', 'log', 'exit', 'add-learner', 'change-membership', 'metrics']:
+        if command in ['put', 'get', 'mget', 'del', 'cas', 'txn', 'list', 'log', 'exit', 'add-learner', 'change-membership', 'scale', 'topology', 'metrics']:
             # 将命令转换为方法名
             if command == 'del':
                 method_name = 'delete'
@@ -55,55 +247,178 @@ class ProxyServer:
 
     # 处理客户端退出命令
     def exit(self, client_id, clause):
-        self.client_ids[client_id] = False
+        with self.session_lock:
+            self.sessions.pop(client_id, None)
         print(f'客户端 {client_id} 退出')
         return f'客户端 {client_id} 退出'
 
     # 实现PUT方法
     def put(self, client_id, clause):
-        if len(clause) != 3:
-            return '错误的命令格式。使用方法: PUT key value'
+        usage = '错误的命令格式。使用方法: PUT key value [ttl]'
+        if len(clause) not in (3, 4):
+            return usage
 
         key, value = clause[1], clause[2]
-        # 检查key是否已存在，以区分添加和更新操作
-        # get方法返回的是{"Ok": "value"}中的value部分，如果键不存在返回空字符串""
-        existing_value = self.servers[client_id].get(key)
-        # 判断第二个值（{"Ok": "value"}中的value）是否为空
-        if existing_value and existing_value != "":
-            action = "更新"
-            old_value_info = f"（原值：{existing_value}）"
-        else:
-            action = "添加"
-            old_value_info = ""
-        
-        if self.servers[client_id].put(key, value, action):
-            return f"✓ 成功{action}键值对：{key} = {value} {old_value_info}"
-        return f"✗ 无法{action}键值对：{key} = {value}"
+        # 可选的 ttl 为存活秒数，到期后键被自动删除
+        ttl = None
+        if len(clause) == 4:
+            try:
+                ttl = float(clause[3])
+            except ValueError:
+                return usage
+            if ttl <= 0:
+                return usage
+        # 节点服务器返回写入前的原值，据此区分添加和更新操作
+        result = self.servers.call('put', key, value, None, ttl)
+        self._observe(client_id, result)
+        if result['status'] != 'ok':
+            return f"✗ 无法写入键值对：{key} = {value}（{result['error']}）"
+        if result['value'] is not None:
+            return f"✓ 成功更新键值对：{key} = {value} （原值：{self._display_value(result['value'])}）"
+        return f"✓ 成功添加键值对：{key} = {value} "
+
+    @staticmethod
+    def _parse_at(clause):
+        # 取出命令末尾的 @index（按 log index 读取历史版本），返回 (其余参数, index)；格式错误时 index 为 False
+        if len(clause) > 1 and clause[-1].startswith('@'):
+            try:
+                at = int(clause[-1][1:])
+            except ValueError:
+                return clause, False
+            if at < 0:
+                return clause, False
+            return clause[:-1], at
+        return clause, None
 
     # 实现GET方法
     def get(self, client_id, clause):
-        if len(clause) != 2:
-            return '错误的命令格式。使用方法: GET key'
+        usage = '错误的命令格式。使用方法: GET key [@index]'
+        clause, at = self._parse_at(clause)
+        if len(clause) != 2 or at is False:
+            return usage
 
         key = clause[1]
-        value = self.servers[client_id].get(key)
-        # 判断返回的值是否为空（None或空字符串）
-        if value is not None and value != "":
-            return f"✓ 找到键值对：{key} = {value}"
+        if at is None:
+            result = self.servers.call('get', key, SESSION_READ_CONSISTENCY, self._session_index(client_id))
+            self._observe(client_id, result)
         else:
-            return f"✗ 未找到键：{key}"
+            # 历史版本只要求节点已 apply 到 at，不需要会话的读己之写
+            result = self.servers.call('get', key, 'local', None, at)
+        suffix = f"（@{at}）" if at is not None else ""
+        if result['status'] == 'found':
+            return f"✓ 找到键值对：{key} = {self._display_value(result['value'])}{suffix}"
+        if result['status'] == 'missing':
+            return f"✗ 未找到键：{key}{suffix}"
+        return f"✗ 读取键 {key} 失败：{result['error']}"
+
+    # 实现MGET方法
+    def mget(self, client_id, clause):
+        if len(clause) < 2:
+            return '错误的命令格式。使用方法: MGET key1 key2 ...'
+
+        keys = clause[1:]
+        results = self.servers.call('get_many', keys, SESSION_READ_CONSISTENCY, self._session_index(client_id))
+        if results and results[0]['status'] == 'error':
+            # 整个请求失败时每个键的结果相同
+            return f"✗ 批量读取失败：{' '.join(keys)}（{results[0]['error']}）"
+        result_lines = []
+        for key, result in zip(keys, results):
+            self._observe(client_id, result)
+            if result['status'] == 'found':
+                result_lines.append(f"✓ {key} = {self._display_value(result['value'])}")
+            else:
+                result_lines.append(f"✗ 未找到键：{key}")
+        return "\n".join(result_lines)
+
+    # 实现CAS方法
+    def cas(self, client_id, clause):
+        # CAS key expected new：当前值等于 expected 时写入 new；nil 表示键不存在 / 删除
+        if len(clause) != 4:
+            return '错误的命令格式。使用方法: CAS key expected new（nil 表示不存在/删除）'
+
+        key = clause[1]
+        expected = None if clause[2] == 'nil' else clause[2]
+        new = None if clause[3] == 'nil' else clause[3]
+        result = self.servers.call('cas', key, expected, new)
+        self._observe(client_id, result)
+        if result['status'] == 'ok':
+            return f"✓ CAS 成功：{key} = {new if new is not None else '（已删除）'}"
+        if result['status'] == 'conflict':
+            current = result['value']
+            current = self._display_value(current) if current is not None else '（不存在）'
+            return f"✗ CAS 失败：{key} 的当前值为 {current}"
+        return f"✗ CAS 执行失败：{result['error']}"
+
+    # 实现TXN方法
+    def txn(self, client_id, clause):
+        # TXN 条件... THEN 操作...
+        # 条件：key=value（值相等）、+key（键存在）、-key（键不存在）；操作：PUT key value、DEL key
+        usage = '错误的命令格式。使用方法: TXN [key=value | +key | -key]... THEN [PUT key value | DEL key]...'
+        if 'then' not in clause:
+            return usage
+        split = clause.index('then')
+        guards = []
+        for token in clause[1:split]:
+            if '=' in token:
+                key, value = token.split('=', 1)
+                guards.append(['equals', key, value])
+            elif token.startswith('+') and len(token) > 1:
+                guards.append(['exists', token[1:]])
+            elif token.startswith('-') and len(token) > 1:
+                guards.append(['missing', token[1:]])
+            else:
+                return usage
+        ops = []
+        rest = clause[split + 1:]
+        while rest:
+            if rest[0] == 'put' and len(rest) >= 3:
+                ops.append(['put', rest[1], rest[2]])
+                rest = rest[3:]
+            elif rest[0] == 'del' and len(rest) >= 2:
+                ops.append(['del', rest[1]])
+                rest = rest[2:]
+            else:
+                return usage
+        if not ops:
+            return usage
+
+        result = self.servers.call('txn', guards, ops)
+        self._observe(client_id, result)
+        if result['status'] == 'ok':
+            return f"✓ 事务提交成功：执行了 {len(ops)} 个操作"
+        if result['status'] == 'conflict':
+            lines = ["✗ 事务条件不成立，没有执行任何操作，当前值："]
+            for guard, current in zip(guards, result['value']):
+                current = self._display_value(current) if current is not None else '（不存在）'
+                lines.append(f"  {guard[1]} = {current}")
+            return "\n".join(lines)
+        return f"✗ 事务执行失败：{result['error']}"
 
     # 实现LIST方法
     def list(self, client_id, clause):
-        if len(clause) != 1:
-            return '错误的命令格式。使用方法: LIST'
+        # LIST [start [end [limit]]] [@index]：列出 [start, end) 区间内最多 limit 个键值对，
+        # 带 @index 时列出 log index 为 index 时的数据
+        clause, at = self._parse_at(clause)
+        if len(clause) > 4 or at is False:
+            return '错误的命令格式。使用方法: LIST [start [end [limit]]] [@index]'
 
-        result = self.servers[client_id].list()
+        start = clause[1] if len(clause) > 1 else None
+        end = clause[2] if len(clause) > 2 else None
+        try:
+            limit = int(clause[3]) if len(clause) > 3 else None
+        except ValueError:
+            return f"✗ 错误：limit必须是整数，收到: {clause[3]}"
+
+        result = self.servers.call('list', start, end, limit, at)
         # 格式化LIST输出
         return self._format_list_output(result)
     
     def _format_list_output(self, data):
         # 格式化LIST命令的输出
+        if data == "Err":
+            return "✗ 列出键值对失败"
+        if isinstance(data, dict) and "Err" in data:
+            return f"✗ 列出键值对失败：{json.dumps(data['Err'], ensure_ascii=False)}"
         if not data:
             return "数据库为空，没有任何键值对"
         
@@ -136,41 +451,46 @@ class ProxyServer:
                 if isinstance(item, dict):
                     key = item.get("k", item.get("key", "N/A"))
                     value = item.get("v", item.get("value", "N/A"))
-                    result_lines.append(f"{i}. {key} = {value}")
+                    result_lines.append(f"{i}. {key} = {self._display_value(value)}")
                 else:
                     result_lines.append(f"{i}. {item}")
         # 处理字典格式
         elif isinstance(items, dict):
             for i, (key, value) in enumerate(items.items(), 1):
-                result_lines.append(f"{i}. {key} = {value}")
+                result_lines.append(f"{i}. {key} = {self._display_value(value)}")
         
         result_lines.append("=" * 60)
         result_lines.append(f"总计：{len(items) if isinstance(items, (list, dict)) else 1} 个键值对")
         
         return "\n".join(result_lines)
 
+    @staticmethod
+    def _display_value(value):
+        # 二进制值（XML-RPC Binary）只显示长度
+        if isinstance(value, xmlrpclib.Binary):
+            return f"<二进制 {len(value.data)} 字节>"
+        return value
+
     # 实现DELETE方法
     def delete(self, client_id, clause):
         if len(clause) != 2:
             return '错误的命令格式。使用方法: DEL key'
 
         key = clause[1]
-        # 先检查键是否存在
-        existing_value = self.servers[client_id].get(key)
-        if not existing_value or existing_value == "":
+        result = self.servers.call('delete', key)
+        self._observe(client_id, result)
+        if result['status'] == 'ok':
+            return f"✓ 成功删除键 {key}（原值：{self._display_value(result['value'])}）"
+        if result['status'] == 'missing':
             return f"✗ 删除失败：键 {key} 不存在"
-        
-        # 键存在，执行删除
-        if self.servers[client_id].delete(key):
-            return f"✓ 成功删除键 {key}（原值：{existing_value}）"
-        return f"✗ 删除键 {key} 失败"
+        return f"✗ 删除键 {key} 失败：{result['error']}"
 
     # 实现LOG方法
     def log(self, client_id, clause):
         if len(clause) != 1:
             return '错误的命令格式。使用方法: LOG'
 
-        log_data = self.servers[client_id].get_log()
+        log_data = self.servers.call('get_log')
         # 格式化LOG输出
         return self._format_log_output(log_data)
     
@@ -209,8 +529,8 @@ class ProxyServer:
             node_id = int(clause[1])
             api_addr = clause[2].strip('"\'')  # 移除引号
             
-            # 调用第一个服务器节点（通常是leader）来添加learner
-            result = self.servers[0].add_learner(node_id, api_addr)
+            # 由节点服务器池选择一个节点服务器来添加learner
+            result = self.servers.call('add_learner', node_id, api_addr, retry=False)
             # 检查响应中是否包含 "Ok" 键，如果包含则说明操作成功
             if result is not None and isinstance(result, dict) and "Ok" in result:
                 return f"✓ 成功添加learner节点：节点ID={node_id}，地址={api_addr}"
@@ -230,17 +550,96 @@ class ProxyServer:
         try:
             node_ids = [int(node_id) for node_id in clause[1:]]
             
-            # 调用第一个服务器节点（通常是leader）来改变成员关系
-            result = self.servers[0].change_membership(node_ids)
+            # 由节点服务器池选择一个节点服务器来改变成员关系
+            result = self.servers.call('change_membership', node_ids, retry=False)
             # 检查响应中是否包含 "Ok" 键，如果包含则说明操作成功
             if result is not None and isinstance(result, dict) and "Ok" in result:
                 return f"✓ 成功改变成员关系：新成员节点列表 = {node_ids}"
-            return f"✗ 无法改变成员关系：节点列表 = {node_ids}"
+            return f"✗ 无法改变成员关系：节点列表 = {node_ids}（新成员可能尚未追上 leader，追赶进度见 METRICS）"
         except ValueError:
             return f"✗ 错误：所有node_id必须是整数"
         except Exception as e:
             return f"✗ 改变成员关系时出错：{str(e)}"
 
+    # 实现SCALE方法
+    def scale(self, client_id, clause):
+        # 格式: SCALE node_id ["api_addr"] [node_id ["api_addr"]] ...
+        # 例如: SCALE 2 3 或 SCALE 4 "127.0.0.1:21004"，省略地址时为 127.0.0.1:(21000 + node_id)
+        # 依次添加 learner、等待追上 leader、提升为投票成员，并更新所有节点服务器的路由
+        usage = '错误的命令格式。使用方法: SCALE node_id ["api_addr"] [node_id ["api_addr"]] ...'
+        nodes = {}
+        node_id = None
+        for token in clause[1:]:
+            token = token.strip('"\'')
+            if token.isdigit():
+                node_id = int(token)
+                nodes[str(node_id)] = f"127.0.0.1:{21000 + node_id}"
+            elif node_id is not None:
+                nodes[str(node_id)] = token
+                node_id = None
+            else:
+                return usage
+        if not nodes:
+            return usage
+
+        # 分步执行，每一步都是一个短的 RPC：添加 learner、轮询复制进度、提升为投票成员。
+        # 添加和提升不是幂等操作，出错时不换节点服务器重试
+        try:
+            begun = self.servers.call('scale', nodes, retry=False)
+        except Exception as e:
+            return f"✗ 扩容时出错：{str(e)}"
+        if not begun.get('ok'):
+            return f"✗ 扩容失败：{begun.get('error')}"
+        new = begun['new']
+        if not new:
+            return f"✓ 扩容完成：投票成员 = {begun['voters']}"
+
+        deadline = time.time() + SCALE_CATCH_UP_TIMEOUT
+        progress = {}
+        while True:
+            try:
+                progress = self.servers.call('scale_progress', new) or {}
+            except Exception as e:
+                print(f'查询复制进度失败：{e}')
+            if progress.get('ready'):
+                break
+            if time.time() >= deadline:
+                lag = self._format_lag(progress.get('lag', {}))
+                return (f"✗ 扩容失败：新节点在 {SCALE_CATCH_UP_TIMEOUT:.0f} 秒内未追上 leader"
+                        + (f"（{lag}）" if lag else ''))
+            time.sleep(SCALE_POLL_INTERVAL)
+
+        target = sorted(set(begun['voters']) | set(new))
+        lag = self._format_lag(progress.get('lag', {}))
+        try:
+            result = self.servers.call('change_membership', target, retry=False)
+        except Exception as e:
+            return f"✗ 扩容时出错：{str(e)}"
+        if not (isinstance(result, dict) and "Ok" in result):
+            return f"✗ 扩容失败：无法将成员关系改为 {target}" + (f"（{lag}）" if lag else '')
+        return f"✓ 扩容完成：投票成员 = {target}" + (f"，提升时 {lag}" if lag else '')
+
+    @staticmethod
+    def _format_lag(lag):
+        return ', '.join(f"节点 {k} 落后 {'未知' if v is None else v} 条" for k, v in lag.items())
+
+    # 实现TOPOLOGY方法
+    def topology(self, client_id, clause):
+        # 格式: TOPOLOGY，显示代理已知的最新集群拓扑
+        if len(clause) != 1:
+            return '错误的命令格式。使用方法: TOPOLOGY'
+        try:
+            topology = self.servers.call('get_topology')
+        except Exception as e:
+            return f"✗ 获取集群拓扑时出错：{str(e)}"
+        lines = [f"集群拓扑 (版本 {topology['version']})",
+                 f"  投票成员: {topology['voters']}",
+                 f"  learner: {topology['learners']}",
+                 f"  leader: {topology['leader'] if topology['leader'] is not None else '未知'}"]
+        for node_id, url in sorted(topology['nodes'].items(), key=lambda item: int(item[0])):
+            lines.append(f"  节点 {node_id}: {url}")
+        return "\n".join(lines)
+
     # 实现METRICS方法
     def metrics(self, client_id, clause):
         # 格式: METRICS
@@ -248,8 +647,8 @@ class ProxyServer:
             return '错误的命令格式。使用方法: METRICS'
         
         try:
-            # 调用第一个服务器节点（通常是leader）来获取metrics
-            result = self.servers[0].metrics()
+            # 由节点服务器池选择一个节点服务器来获取metrics
+            result = self.servers.call('metrics')
             if result is not None:
                 # result 已经是格式化后的字符串（由 node_server.py 的 _format_metrics 方法处理）
                 return result
@@ -270,9 +669,9 @@ class ProxyServer:
 
 
 if __name__ == '__main__':
-    count = int(input('输入客户端数量: '))
-    proxy = ProxyServer(client_count=count)
-    server = SimpleXMLRPCServer(('localhost', 21000), allow_none=True)
+    count = int(input('输入节点服务器数量: '))
+    proxy = ProxyServer(server_count=count)
+    server = ThreadedXMLRPCServer(('localhost', 21000), allow_none=True)
     server.register_instance(proxy)
 
     print(f"代理服务器正在运行...")
@@ -3,18 +3,136 @@
 模拟Raft集群的HTTP API（端口21001），用于测试其他组件
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import time
+import json
+import heapq
+import os
+import sqlite3
 import threading
+from collections import deque
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
-# 内存数据库（模拟键值存储）
-database = {}
+# 数据存放方式（模拟 kv-store 的 --state-backend）：memory 全部在内存中；
+# sqlite 保存在 KV_STATE_PATH 文件中，重启后数据、过期时间和 log index 仍然保留，可以在本地运行大数据量的基准测试
+STATE_BACKEND = os.environ.get('KV_STATE_BACKEND', 'memory')
+STATE_PATH = os.environ.get('KV_STATE_PATH', 'test_flask.sqlite3')
+STATE_CACHE_BYTES = int(os.environ.get('KV_STATE_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+class MemoryDatabase(dict):
+    """内存中的键值数据"""
+    backend = 'memory'
+
+    def keys_between(self, start, end):
+        # [start, end) 内的键，按键排序
+        return sorted(k for k in self if (start is None or k >= start) and (end is None or k < end))
+
+    def set_expire(self, key, at):
+        pass
+
+    def saved_expire(self):
+        return {}
+
+    def saved_log_index(self):
+        return 0
+
+    def commit(self, log_index):
+        pass
+
+
+class SqliteDatabase:
+    """保存在 sqlite 文件中的键值数据（模拟 kv-store 的 rocksdb 状态机），提供 MemoryDatabase 用到的 dict 接口；
+    sqlite 的页缓存（最多 cache_bytes）即为读缓存。调用方已持有 db_lock"""
+    backend = 'sqlite'
+
+    def __init__(self, path, cache_bytes):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # 只用于测试：不等待 fsync，每次写入的修改连同 log index 在一个事务中提交
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute(f'PRAGMA cache_size={-max(cache_bytes // 1024, 1)}')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS kv '
+                          '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expire_at INTEGER) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def __setitem__(self, key, value):
+        # 只更新值，保留 expire_at（由 set_expire 设置）
+        self.conn.execute('INSERT INTO kv (key, value) VALUES (?, ?) '
+                          'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (key, value))
+
+    def pop(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            return default
+        self.conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.conn.execute('SELECT key FROM kv ORDER BY key'))
+
+    def items(self):
+        return self.conn.execute('SELECT key, value FROM kv ORDER BY key')
+
+    def keys_between(self, start, end):
+        rows = self.conn.execute('SELECT key FROM kv WHERE (?1 IS NULL OR key >= ?1) AND (?2 IS NULL OR key < ?2) '
+                                 'ORDER BY key', (start, end))
+        return [row[0] for row in rows]
+
+    def set_expire(self, key, at):
+        self.conn.execute('UPDATE kv SET expire_at = ? WHERE key = ?', (at, key))
+
+    def saved_expire(self):
+        rows = self.conn.execute('SELECT key, expire_at FROM kv WHERE expire_at IS NOT NULL')
+        return dict(rows.fetchall())
+
+    def saved_log_index(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'log_index'").fetchone()
+        return row[0] if row else 0
+
+    def commit(self, log_index):
+        self.conn.execute("INSERT INTO meta (name, value) VALUES ('log_index', ?) "
+                          "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (log_index,))
+        self.conn.commit()
+
+
+# 键值数据（模拟键值存储）
+database = SqliteDatabase(STATE_PATH, STATE_CACHE_BYTES) if STATE_BACKEND == 'sqlite' else MemoryDatabase()
 db_lock = threading.Lock()
 
+# 变更事件（模拟 kv-store 的 /watch），只保留最近 WATCH_HISTORY 个
+WATCH_HISTORY = 4096
+WATCH_MAX_WAIT = 30.0
+change_events = []
+watch_state = {'floor': 0}  # 不大于 floor 的 index 的事件可能已被丢弃
+changes_cond = threading.Condition(db_lock)
+
+# 被修改键的旧值（模拟 kv-store 的多版本读取），只保留最近 VERSION_RETAIN 条 log 内的
+# version_log 为按 index 排序的 (index, key)；key_versions[key] 为 {修改它的 index: 修改前的值}
+VERSION_RETAIN = 10000
+version_log = deque()
+key_versions = {}
+version_state = {'floor': 0}  # 不小于 floor 的 index 都可以读取
+
+# 键的过期时间（unix 毫秒）和按过期时间排序的堆（模拟 kv-store 的过期索引）
+EXPIRE_INTERVAL = 0.5
+expire_at = {}
+expire_heap = []
+
 # 集群状态（模拟Raft集群信息）
 cluster_state = {
     'current_term': 1,
@@ -27,6 +145,18 @@ cluster_state = {
     'learners': {}
 }
 
+# 模拟 kv-store 的 raft 配置（/metrics 的 config 字段），取值与 kv-store 默认值相同
+raft_config = {
+    'cluster_name': 'foo',
+    'heartbeat_interval': 250,
+    'election_timeout_min': 299,
+    'election_timeout_max': 300,
+    'max_payload_entries': 300,
+    'snapshot_policy': {'LogsSinceLast': 5000},
+    'max_in_snapshot_log_to_keep': 1000,
+    'purge_batch_size': 1,
+}
+
 
 def generate_log_id():
     """生成日志ID"""
@@ -54,6 +184,195 @@ def generate_membership_response():
     }
 
 
+def flatten_batch(ops, out):
+    """校验Batch中的写操作（不支持嵌套Batch），结果为 (op, key, value, expire_at) 列表"""
+    for item in ops:
+        if not isinstance(item, dict):
+            return False
+        if 'Put' in item:
+            key = item['Put'].get('key')
+            value = item['Put'].get('value')
+            if key is None or value is None:
+                return False
+            out.append(('Put', key, value, item['Put'].get('expire_at')))
+        elif 'Del' in item:
+            key = item['Del'].get('key')
+            if key is None:
+                return False
+            out.append(('Del', key, None, None))
+        else:
+            return False
+    return True
+
+
+def write_result(value, results=None, changes=()):
+    """写入结果：log index、处理请求的节点和操作结果，调用方已持有 db_lock
+    changes 为实际发生的变更 (key, value, old)，value 为 None 表示删除，记录为变更事件；old 为修改前的值，记为旧版本"""
+    result = {
+        "index": generate_log_id()["index"],
+        "node": cluster_state['node_id'],
+        "value": value,
+    }
+    if results is not None:
+        result["results"] = results
+    for key, value, old in changes:
+        if len(change_events) == WATCH_HISTORY:
+            watch_state['floor'] = change_events.pop(0)["index"]
+        change_events.append({"index": result["index"], "key": key, "value": value})
+        record_version(result["index"], key, old)
+    collect_versions()
+    database.commit(result["index"])
+    if changes:
+        changes_cond.notify_all()
+    return {"Ok": result}
+
+
+def record_version(index, key, old):
+    """记录 index 处的写入修改 key 之前的值，同一次写入多次修改一个键时只记录第一次；调用方已持有 db_lock"""
+    history = key_versions.setdefault(key, {})
+    if index not in history:
+        history[index] = old
+        version_log.append((index, key))
+
+
+def collect_versions():
+    """回收最近 VERSION_RETAIN 条 log 之前的旧版本，调用方已持有 db_lock"""
+    floor = cluster_state['log_index'] - VERSION_RETAIN
+    if floor <= version_state['floor']:
+        return
+    while version_log and version_log[0][0] <= floor:
+        index, key = version_log.popleft()
+        history = key_versions.get(key)
+        if history is not None:
+            history.pop(index, None)
+            if not history:
+                del key_versions[key]
+    version_state['floor'] = floor
+
+
+def value_at(key, at):
+    """key 在 log index 为 at 时的值：at 之后被修改过时取第一次修改前的值；调用方已持有 db_lock"""
+    history = key_versions.get(key)
+    if history:
+        later = [index for index in history if index > at]
+        if later:
+            return history[min(later)]
+    return database.get(key)
+
+
+def check_at(at):
+    """按时间点读取的检查：未 apply 到 at 时返回 Lagging，早于保留的旧版本时返回 Compacted；调用方已持有 db_lock"""
+    lagging = check_min_index(at)
+    if lagging:
+        return lagging
+    if at < version_state['floor']:
+        return {"Err": {"Compacted": {"floor": version_state['floor']}}}
+    return None
+
+
+def read_result(**fields):
+    """读取结果：附带读取时已 apply 的 log index 和处理请求的节点，调用方已持有 db_lock"""
+    fields["index"] = cluster_state['log_index']
+    fields["node"] = cluster_state['node_id']
+    return {"Ok": fields}
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def set_expire(key, at):
+    """设置或清除 key 的过期时间（在写入 key 之后调用），调用方已持有 db_lock"""
+    if at is None:
+        expire_at.pop(key, None)
+    else:
+        expire_at[key] = at
+        heapq.heappush(expire_heap, (at, key))
+    database.set_expire(key, at)
+
+
+def restore_state():
+    """sqlite 模式下恢复上次保存的 log index 和过期时间，更早的变更事件和旧版本不再可用"""
+    with db_lock:
+        index = database.saved_log_index()
+        cluster_state['log_index'] = index
+        watch_state['floor'] = index
+        version_state['floor'] = index
+        for key, at in database.saved_expire().items():
+            expire_at[key] = at
+            heapq.heappush(expire_heap, (at, key))
+
+
+def live_get(key, now=None):
+    """读取 key，已到期但尚未被清理的键视为不存在；调用方已持有 db_lock"""
+    at = expire_at.get(key)
+    if at is not None and at <= (now or now_ms()):
+        return None
+    return database.get(key)
+
+
+def expire_loop():
+    """定期删除到期的键（模拟 leader 提交 Expire），只检查堆顶已到期的部分"""
+    while True:
+        time.sleep(EXPIRE_INTERVAL)
+        with db_lock:
+            now = now_ms()
+            changes = []
+            while expire_heap and expire_heap[0][0] <= now:
+                at, key = heapq.heappop(expire_heap)
+                # 堆中可能留有被重新写入的键的旧过期时间，与当前记录一致才删除
+                if expire_at.get(key) == at:
+                    del expire_at[key]
+                    old = database.pop(key, None)
+                    if old is not None:
+                        changes.append((key, None, old))
+            if changes:
+                write_result(None, changes=changes)
+
+
+def apply_ops(flat_ops):
+    """依次执行 flatten_batch 得到的写操作，调用方已持有 db_lock
+    返回每个操作的结果（Put 为原值，Del 为被删除的值，键原本不存在时为 None）和实际发生的变更"""
+    results = []
+    changes = []
+    for op, key, value, at in flat_ops:
+        if op == 'Put':
+            results.append(database.get(key))
+            database[key] = value
+            changes.append((key, value, results[-1]))
+        else:
+            # 与 kv-store 一致，batch 中删除不存在的键不视为错误
+            results.append(database.pop(key, None))
+            if results[-1] is not None:
+                changes.append((key, None, results[-1]))
+        set_expire(key, at)
+    return results, changes
+
+
+def check_guard(guard):
+    """检查事务的一个 guard，返回 (是否成立, key)，格式错误时返回 None；调用方已持有 db_lock"""
+    if not isinstance(guard, dict) or len(guard) != 1:
+        return None
+    kind, body = next(iter(guard.items()))
+    key = body.get('key') if isinstance(body, dict) else None
+    if key is None:
+        return None
+    if kind == 'Equals':
+        return database.get(key) == body.get('value'), key
+    if kind == 'Exists':
+        return key in database, key
+    if kind == 'Missing':
+        return key not in database, key
+    return None
+
+
+def check_min_index(min_index):
+    """读己之写：未 apply 到 min_index 时返回 Lagging 错误，调用方已持有 db_lock"""
+    if min_index and min_index > cluster_state['log_index']:
+        return {"Err": {"Lagging": {"applied": cluster_state['log_index'], "required": min_index}}}
+    return None
+
+
 @app.route('/write', methods=['POST'])
 def write():
     """写入操作（增加/更新/删除键值）"""
@@ -63,7 +382,7 @@ def write():
         if not data:
             return "Err", 400
         
-        # 处理Put操作
+        # 处理Put操作，结果为原值（新增的键为 None）
         if 'Put' in data:
             put_data = data['Put']
             key = put_data.get('key')
@@ -73,11 +392,48 @@ def write():
                 return "Err", 400
             
             with db_lock:
+                old_value = database.get(key)
                 database[key] = value
+                # 不带 expire_at 的 Put 清除之前的过期时间
+                set_expire(key, put_data.get('expire_at'))
+                return jsonify(write_result(old_value, changes=[(key, value, old_value)])), 200
+        
+        # 处理Batch操作：多个写操作合并为一次请求，整体原子地应用
+        elif 'Batch' in data:
+            ops = data['Batch'].get('ops')
+            
+            if not isinstance(ops, list):
+                return "Err", 400
+            
+            flat_ops = []
+            if not flatten_batch(ops, flat_ops):
+                return "Err", 400
             
-            return "Ok", 200
+            # 每个操作的结果：Put 为原值，Del 为被删除的值，键原本不存在时为 None
+            with db_lock:
+                results, changes = apply_ops(flat_ops)
+                return jsonify(write_result("Ok", results, changes)), 200
         
-        # 处理Del操作
+        # 处理Txn操作：所有 guard 成立时才原子地执行 ops
+        elif 'Txn' in data:
+            guards = data['Txn'].get('guards')
+            ops = data['Txn'].get('ops')
+            
+            flat_ops = []
+            if not isinstance(guards, list) or not isinstance(ops, list) or not flatten_batch(ops, flat_ops):
+                return "Err", 400
+            
+            with db_lock:
+                checked = [check_guard(guard) for guard in guards]
+                if None in checked:
+                    return "Err", 400
+                if not all(held for held, _ in checked):
+                    # 不执行任何操作，results 为各 guard 键的当前值
+                    return jsonify(write_result(None, [database.get(key) for _, key in checked])), 200
+                results, changes = apply_ops(flat_ops)
+                return jsonify(write_result("Ok", results, changes)), 200
+        
+        # 处理Del操作，结果为被删除的值，键不存在时为 None
         elif 'Del' in data:
             del_data = data['Del']
             key = del_data.get('key')
@@ -86,11 +442,10 @@ def write():
                 return "Err", 400
             
             with db_lock:
-                if key in database:
-                    del database[key]
-                    return "Ok", 200
-                else:
-                    return "Err", 200  # 键不存在也返回Err
+                old_value = database.pop(key, None)
+                set_expire(key, None)
+                changes = [(key, None, old_value)] if old_value is not None else []
+                return jsonify(write_result(old_value, changes=changes)), 200
         
         else:
             return "Err", 400
@@ -104,12 +459,33 @@ def write():
 def read():
     """读取操作（读取单个键值）"""
     try:
-        # 根据API文档，read接收的是字符串key
+        # 根据API文档，read接收的是字符串key，或 {"key": k, "consistency": ...}
         key = request.get_json()
         
         if key is None:
             return jsonify({"err": "缺少key参数"}), 400
         
+        # 模拟服务只有一个节点，本身即是 leader，各一致性级别的读取方式相同
+        # 以对象形式请求时返回 {"Ok": {"value": v, "index": n, "node": id}}，不存在的键为 null
+        if isinstance(key, dict):
+            if key.get('consistency', 'local') not in ('local', 'lease', 'linearizable'):
+                return jsonify({"err": "未知的一致性级别"}), 400
+            if not isinstance(key.get('key'), str):
+                return jsonify({"err": "key必须是字符串"}), 400
+            with db_lock:
+                lagging = check_min_index(key.get('min_index'))
+                if lagging:
+                    return jsonify(lagging), 200
+                at = key.get('at')
+                if at is not None:
+                    # 按时间点读取：返回 log index 为 at 时的值，index 即为 at
+                    err = check_at(at)
+                    if err:
+                        return jsonify(err), 200
+                    return jsonify({"Ok": {"value": value_at(key['key'], at), "index": at,
+                                           "node": cluster_state['node_id']}}), 200
+                return jsonify(read_result(value=live_get(key['key']))), 200
+        
         # 如果传入的是字符串，直接使用
         if isinstance(key, str):
             key_str = key
@@ -118,17 +494,87 @@ def read():
             return jsonify({"err": "key必须是字符串"}), 400
         
         with db_lock:
-            if key_str in database:
-                return jsonify({"Ok": database[key_str]}), 200
-            else:
-                # 没有该键值则返回空字符串
-                return jsonify({"Ok": ""}), 200
+            value = live_get(key_str)
+            # 没有该键值则返回空字符串
+            return jsonify({"Ok": value if value is not None else ""}), 200
     
     except Exception as e:
         print(f"读取操作错误: {e}")
         return jsonify({"err": str(e)}), 500
 
 
+@app.route('/read-many', methods=['POST'])
+def read_many():
+    """批量读取（按顺序返回多个键的值，不存在的键为 null）"""
+    try:
+        # 接收 key 列表，或 {"keys": [...], "consistency": ...}
+        keys = request.get_json()
+        
+        structured = isinstance(keys, dict)
+        min_index = None
+        if structured:
+            if keys.get('consistency', 'local') not in ('local', 'lease', 'linearizable'):
+                return jsonify({"err": "未知的一致性级别"}), 400
+            min_index = keys.get('min_index')
+            keys = keys.get('keys')
+        
+        if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+            return jsonify({"err": "keys必须是字符串列表"}), 400
+        
+        # 所有键只获取一次锁；以对象形式请求时附带 index 和 node
+        with db_lock:
+            lagging = check_min_index(min_index)
+            if lagging:
+                return jsonify(lagging), 200
+            now = now_ms()
+            values = [live_get(k, now) for k in keys]
+            if structured:
+                return jsonify(read_result(values=values)), 200
+        return jsonify({"Ok": values}), 200
+    
+    except Exception as e:
+        print(f"批量读取操作错误: {e}")
+        return jsonify({"err": str(e)}), 500
+
+
+@app.route('/watch', methods=['POST'])
+def watch():
+    """订阅变更（长轮询）：返回 index 大于 after 的匹配变更，没有时最多等待 timeout_ms"""
+    try:
+        data = request.get_json(silent=True) or {}
+        key = data.get('key')
+        prefix = data.get('prefix') or ""
+        after = data.get('after')
+        timeout = min((data.get('timeout_ms') or WATCH_MAX_WAIT * 1000) / 1000, WATCH_MAX_WAIT)
+        deadline = time.monotonic() + timeout
+        
+        def matches(event):
+            if key is not None:
+                return event["key"] == key
+            return event["key"].startswith(prefix)
+        
+        with changes_cond:
+            if after is None:
+                # 缺省时从当前位置开始
+                after = change_events[-1]["index"] if change_events else watch_state['floor']
+            while True:
+                if after < watch_state['floor']:
+                    return jsonify({"Err": {"Compacted": {"floor": watch_state['floor']}}}), 200
+                events = [e for e in change_events if e["index"] > after and matches(e)]
+                if change_events:
+                    after = max(after, change_events[-1]["index"])
+                if events:
+                    return jsonify({"Ok": {"events": events, "index": after}}), 200
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return jsonify({"Ok": {"events": [], "index": after}}), 200
+                changes_cond.wait(remaining)
+    
+    except Exception as e:
+        print(f"订阅操作错误: {e}")
+        return jsonify({"err": str(e)}), 500
+
+
 @app.route('/read-all', methods=['GET'])
 def read_all():
     """读取操作（读取所有键值）"""
@@ -138,7 +584,8 @@ def read_all():
                 return jsonify({"OK": []}), 200
             
             # 格式: {"OK": [{ "k":k1, "v":v1 }, { "k":k2, "v":v2 }...]}
-            result = [{"k": k, "v": v} for k, v in database.items()]
+            now = now_ms()
+            result = [{"k": k, "v": v} for k, v in database.items() if live_get(k, now) is not None]
             return jsonify({"Ok": result}), 200
     
     except Exception as e:
@@ -146,6 +593,58 @@ def read_all():
         return jsonify({"err": str(e)}), 500
 
 
+@app.route('/range', methods=['POST'])
+def range_read():
+    """范围读取（[start, end) 内最多 limit 个键值对），以 NDJSON 流式返回"""
+    try:
+        data = request.get_json(silent=True) or {}
+        start = data.get('start')
+        end = data.get('end')
+        limit = data.get('limit')
+        at = data.get('at')
+        
+        # 读取点缺省为当前位置，扫描期间的写入由旧版本还原；指定 at 时 at 之后被删除的键也要列出
+        with db_lock:
+            live = at is None
+            if live:
+                at = cluster_state['log_index']
+            else:
+                err = check_at(at)
+                if err:
+                    return Response(json.dumps(err) + "\n", mimetype='application/x-ndjson')
+            keys = database.keys_between(start, end)
+            if not live:
+                # at 之后被删除的键只出现在旧版本中
+                deleted = {k for k in key_versions
+                           if (start is None or k >= start) and (end is None or k < end)}
+                keys = sorted(deleted.union(keys))
+        
+        def generate():
+            # 每行一个 {"k":k,"v":v}，逐个从数据库读取，不复制整个数据库
+            count = 0
+            for k in keys:
+                if limit is not None and count >= limit:
+                    break
+                with db_lock:
+                    if at < version_state['floor']:
+                        # 读取点之后的旧版本已被回收
+                        return
+                    v = value_at(k, at)
+                    # 不指定时间点时与 /read 一致，已到期但尚未被清理的键视为不存在
+                    if live and expire_at.get(k, float('inf')) <= now_ms():
+                        v = None
+                if v is None:
+                    continue
+                count += 1
+                yield json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n"
+        
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    except Exception as e:
+        print(f"范围读取操作错误: {e}")
+        return jsonify({"err": str(e)}), 500
+
+
 @app.route('/add-learner', methods=['POST'])
 def add_learner():
     """添加learner节点"""
@@ -268,7 +767,34 @@ def metrics():
                 }
             },
             "heartbeat": heartbeat,
-            "replication": replication
+            "replication": replication,
+            "config": raft_config,
+            # 模拟的 learner 总是已追上 leader
+            "catch_up": {
+                node_id: {"matched": cluster_state['log_index'], "lag": 0}
+                for node_id in cluster_state['learners']
+                if int(node_id) not in [n for c in cluster_state['configs'] for n in c]
+            },
+            "state": {
+                "backend": database.backend,
+                "cache_entries": 0,
+                "cache_bytes": 0,
+                "cache_capacity": STATE_CACHE_BYTES if database.backend == 'sqlite' else 0,
+                "cache_hits": 0,
+                "cache_misses": 0
+            },
+            "compaction": {
+                "log_bytes_on_disk": 0,
+                "entries_since_snapshot": cluster_state['log_index'],
+                "bytes_since_snapshot": 0,
+                "snapshot_log_bytes": 0,
+                "snapshot_count": 0,
+                "last_snapshot_ms": 0,
+                "last_snapshot_bytes": 0,
+                "purge_count": 0,
+                "compaction_count": 0,
+                "last_compaction_ms": 0
+            }
         }
         
         return jsonify(response), 200
@@ -294,9 +820,12 @@ def index():
     return jsonify({
         "message": "模拟数据库服务器 (端口21001)",
         "endpoints": {
-            "POST /write": "写入操作（Put/Del）",
+            "POST /write": "写入操作（Put/Del/Batch）",
             "POST /read": "读取单个键值",
             "GET /read-all": "读取所有键值",
+            "POST /read-many": "批量读取键值",
+            "POST /watch": "订阅键/前缀的变更（长轮询）",
+            "POST /range": "范围读取键值（NDJSON流）",
             "POST /add-learner": "添加learner节点",
             "POST /change-membership": "改变节点属性",
             "GET /metrics": "查询集群状态",
@@ -313,15 +842,21 @@ if __name__ == '__main__':
     print("模拟Raft集群HTTP API (端口21001)")
     print("=" * 60)
     print("API端点:")
-    print("  POST /write - 写入操作（增加/更新/删除键值）")
+    print("  POST /write - 写入操作（增加/更新/删除键值，支持Batch）")
     print("  POST /read - 读取单个键值")
     print("  GET  /read-all - 读取所有键值")
+    print("  POST /read-many - 批量读取键值")
+    print("  POST /watch - 订阅键/前缀的变更（长轮询）")
+    print("  POST /range - 范围读取键值（NDJSON流）")
     print("  POST /add-learner - 添加learner节点")
     print("  POST /change-membership - 改变节点属性")
     print("  GET  /metrics - 查询集群状态")
     print("  GET  /health - 健康检查")
     print("=" * 60)
     print(f"服务器运行在 http://127.0.0.1:21001")
+    print(f"数据存放方式: {database.backend}" + (f"（{STATE_PATH}）" if database.backend == 'sqlite' else ""))
+    restore_state()
+    threading.Thread(target=expire_loop, daemon=True).start()
     print("=" * 60)
     
     app.run(debug=True, host='127.0.0.1', port=21001)
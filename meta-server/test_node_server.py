@@ -0,0 +1,276 @@
+"""
+节点服务器的测试，kv-store 由 test_flask.py 的模拟服务器代替
+运行：cd meta-server && python3 -m pytest -q（或 python3 -m unittest）
+"""
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+from werkzeug.serving import make_server
+
+import node_server
+import test_flask
+from node_server import HealthTracker, NodeHealth, Server, Topology
+
+
+class MockKvStore:
+    """在随机端口上运行 test_flask 的模拟 kv-store"""
+
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, test_flask.app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def trip(node):
+    # 连续失败直到熔断
+    for _ in range(node.failure_threshold):
+        node.record_failure()
+    assert node.state == NodeHealth.OPEN
+
+
+class NodeHealthTest(unittest.TestCase):
+    """熔断器的状态转换"""
+
+    def setUp(self):
+        self.node = NodeHealth("http://kv", failure_threshold=3, reset_timeout=60)
+
+    def test_trips_after_threshold(self):
+        self.node.record_failure()
+        self.node.record_failure()
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+        self.assertTrue(self.node.allow_request())
+        self.node.record_failure()
+        self.assertEqual(self.node.state, NodeHealth.OPEN)
+        self.assertFalse(self.node.allow_request())
+
+    def test_success_resets_failures(self):
+        self.node.record_failure()
+        self.node.record_failure()
+        self.node.record_success()
+        self.node.record_failure()
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+
+    def test_half_open_allows_single_trial(self):
+        trip(self.node)
+        self.node.reset_timeout = 0
+        self.assertTrue(self.node.allow_request())
+        self.assertEqual(self.node.state, NodeHealth.HALF_OPEN)
+        self.assertFalse(self.node.allow_request())
+
+    def test_trial_success_closes(self):
+        trip(self.node)
+        self.node.reset_timeout = 0
+        self.assertTrue(self.node.allow_request())
+        self.node.record_success()
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+        self.assertTrue(self.node.allow_request())
+        self.assertTrue(self.node.allow_request())
+
+    def test_trial_failure_reopens(self):
+        trip(self.node)
+        self.node.reset_timeout = 0
+        self.assertTrue(self.node.allow_request())
+        self.node.reset_timeout = 60
+        self.node.record_failure()
+        self.assertEqual(self.node.state, NodeHealth.OPEN)
+        self.assertFalse(self.node.allow_request())
+
+    def test_probe_success_half_opens(self):
+        trip(self.node)
+        self.node.record_probe(True)
+        self.assertEqual(self.node.state, NodeHealth.HALF_OPEN)
+        self.assertTrue(self.node.allow_request())
+
+    def test_probe_failure_counts(self):
+        for _ in range(3):
+            self.node.record_probe(False)
+        self.assertEqual(self.node.state, NodeHealth.OPEN)
+
+    def test_probe_success_closes_half_open_with_stuck_trial(self):
+        # 试探请求一直没有结果时，下一次探测成功仍能恢复节点
+        trip(self.node)
+        self.node.record_probe(True)
+        self.assertTrue(self.node.allow_request())
+        self.assertFalse(self.node.allow_request())
+        self.node.record_probe(True)
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+        self.assertFalse(self.node.trial_in_flight)
+        self.assertTrue(self.node.allow_request())
+
+
+class NodeRequestTest(unittest.TestCase):
+    """通过模拟 kv-store 发送请求时熔断器记录的结果"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.kv = MockKvStore()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.kv.close()
+
+    def setUp(self):
+        self.health = HealthTracker()
+        self.topology = Topology({1: self.kv.url}, [1])
+        self.server = Server(0, health=self.health, topology=self.topology)
+        self.node = self.health.node(self.kv.url)
+
+    def test_request_closes_half_open(self):
+        trip(self.node)
+        self.node.reset_timeout = 0
+        ok, response = self.server._node_request(self.kv.url, '/metrics', method='GET')
+        self.assertTrue(ok)
+        self.assertIn("Ok", response)
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+
+    def test_request_skips_open_node(self):
+        trip(self.node)
+        with mock.patch.object(node_server.requests, 'get') as get:
+            ok, response = self.server._node_request(self.kv.url, '/metrics', method='GET')
+        get.assert_not_called()
+        self.assertFalse(ok)
+        self.assertEqual(response, "Err")
+
+    def test_other_request_error_releases_trial(self):
+        trip(self.node)
+        self.node.reset_timeout = 0
+        error = requests.exceptions.TooManyRedirects("redirect loop")
+        with mock.patch.object(node_server.requests, 'get', side_effect=error):
+            ok, _ = self.server._node_request(self.kv.url, '/metrics', method='GET')
+        self.assertFalse(ok)
+        self.assertEqual(self.node.state, NodeHealth.OPEN)
+        self.assertFalse(self.node.trial_in_flight)
+
+    def test_client_error_counts_as_success(self):
+        # 4xx 说明节点在正常响应，不计入失败
+        trip(self.node)
+        self.node.reset_timeout = 0
+        ok, _ = self.server._node_request(self.kv.url, '/no-such-endpoint', method='GET')
+        self.assertFalse(ok)
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+
+    def test_connection_error_trips(self):
+        url = "http://127.0.0.1:1"
+        node = self.health.node(url)
+        for _ in range(node.failure_threshold):
+            self.server._node_request(url, '/metrics', method='GET', timeout=0.5)
+        self.assertEqual(node.state, NodeHealth.OPEN)
+
+    def test_probe_recovers_node(self):
+        trip(self.node)
+        self.health.probe_once()
+        self.assertEqual(self.node.state, NodeHealth.HALF_OPEN)
+        self.health.probe_once()
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+
+
+class GetManyTest(unittest.TestCase):
+    """MGET 对每个键返回 OpResult"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.kv = MockKvStore()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.kv.close()
+
+    def setUp(self):
+        self.health = HealthTracker()
+        self.server = Server(0, health=self.health, topology=Topology({1: self.kv.url}, [1]))
+
+    def test_found_missing_and_empty(self):
+        self.assertEqual(self.server.put("mget-a", "1")["status"], "ok")
+        self.assertEqual(self.server.put("mget-empty", "")["status"], "ok")
+        results = self.server.get_many(["mget-a", "mget-empty", "mget-none"], 'local')
+        self.assertEqual([r["status"] for r in results], ["found", "found", "missing"])
+        self.assertEqual(results[0]["value"], "1")
+        self.assertEqual(results[1]["value"], "")
+        self.assertTrue(all(r["index"] for r in results))
+
+    def test_failure_is_error_for_every_key(self):
+        server = Server(0, health=self.health, topology=Topology({1: "http://127.0.0.1:1"}, [1]))
+        results = server.get_many(["a", "b"], 'local')
+        self.assertEqual([r["status"] for r in results], ["error", "error"])
+
+    def test_unknown_consistency(self):
+        results = self.server.get_many(["a"], 'eventual')
+        self.assertEqual(results[0]["status"], "error")
+
+
+class WatchTest(unittest.TestCase):
+    """订阅换节点重试时的总用时"""
+
+    def test_fallback_stays_within_deadline(self):
+        urls = {i: f"http://kv{i}" for i in (1, 2, 3)}
+        server = Server(0, health=HealthTracker(), topology=Topology(urls, [1, 2, 3]))
+        timeouts = []
+
+        def post(url, json=None, headers=None, timeout=None):
+            # 节点 1 连接失败，其余节点一直没有响应，直到请求超时
+            timeouts.append(timeout)
+            if url.startswith(urls[1]):
+                time.sleep(0.05)
+                raise requests.exceptions.ConnectionError()
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout()
+
+        start = time.monotonic()
+        with mock.patch.object(node_server, 'REQUEST_TIMEOUT', 0.1), \
+                mock.patch.object(node_server.requests, 'post', side_effect=post):
+            result = server.watch(key="a", timeout=0.2)
+        elapsed = time.monotonic() - start
+        self.assertEqual(result["status"], "error")
+        # 换到节点 2 时只等待剩余的时间，节点 3 不再尝试；总用时不超过 timeout + REQUEST_TIMEOUT
+        self.assertEqual(len(timeouts), 2)
+        self.assertLess(timeouts[1], timeouts[0])
+        self.assertLess(elapsed, 0.2 + 0.1 + 0.1)
+
+
+class TopologyTest(unittest.TestCase):
+    """从模拟 kv-store 刷新拓扑"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.kv = MockKvStore()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.kv.close()
+
+    def setUp(self):
+        self.health = HealthTracker()
+        self.topology = Topology({1: self.kv.url}, [1])
+        self.node = self.health.node(self.kv.url)
+
+    def test_refresh_reads_membership(self):
+        self.assertTrue(self.topology.refresh(self.health))
+        self.assertEqual(self.topology.voter_ids(), [1])
+
+    def test_refresh_releases_half_open_trial(self):
+        # 熔断后探测成功进入半开状态，刷新占用试探名额后必须记录结果
+        trip(self.node)
+        self.node.record_probe(True)
+        self.topology.refresh(self.health)
+        self.assertEqual(self.node.state, NodeHealth.CLOSED)
+        self.assertTrue(self.node.allow_request())
+
+    def test_refresh_failure_reopens(self):
+        trip(self.node)
+        self.node.record_probe(True)
+        with mock.patch.object(node_server.requests, 'get', side_effect=requests.exceptions.ConnectionError()):
+            self.assertFalse(self.topology.refresh(self.health))
+        self.assertEqual(self.node.state, NodeHealth.OPEN)
+        self.assertFalse(self.node.trial_in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
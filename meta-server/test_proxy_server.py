@@ -0,0 +1,75 @@
+"""
+代理服务器的测试
+运行：cd meta-server && python3 -m pytest -q（或 python3 -m unittest）
+"""
+import socket
+import unittest
+from unittest import mock
+
+from proxy_server import NodeServerPool
+
+
+class FakeProxy:
+    """记录调用的节点服务器，按后端返回结果或抛出异常"""
+
+    def __init__(self, outcomes):
+        self.calls = []
+        self.outcomes = outcomes  # 后端 index -> 结果或异常
+
+    def factory(self, backend, timeout=None):
+        calls, outcome = self.calls, self.outcomes[backend.index]
+
+        class Stub:
+            def __getattr__(self, method):
+                def invoke(*args):
+                    calls.append(backend.index)
+                    if isinstance(outcome, Exception):
+                        raise outcome
+                    return outcome
+                return invoke
+        return Stub()
+
+
+class NodeServerPoolTest(unittest.TestCase):
+    def setUp(self):
+        # 不启动后台健康检查，调用只来自测试本身
+        with mock.patch('proxy_server.threading.Thread'):
+            self.pool = NodeServerPool(2, base_port=1)
+
+    def call(self, outcomes, *args, **kwargs):
+        fake = FakeProxy(outcomes)
+        with mock.patch.object(self.pool, '_proxy', fake.factory):
+            try:
+                return fake.calls, self.pool.call('scale', *args, **kwargs)
+            except Exception as e:
+                return fake.calls, e
+
+    def test_retries_refused_connection(self):
+        calls, result = self.call({0: ConnectionRefusedError(), 1: ConnectionRefusedError()})
+        self.assertEqual(sorted(calls), [0, 1])
+        self.assertIsInstance(result, ConnectionRefusedError)
+
+    def test_refused_then_ok(self):
+        # 先选中哪个后端是随机的，最终都由可用的后端返回
+        calls, result = self.call({0: ConnectionRefusedError(), 1: "ok"})
+        self.assertEqual(result, "ok")
+        self.assertEqual(calls[-1], 1)
+
+    def test_timeout_is_not_retried(self):
+        # 超时的请求可能仍在执行，换节点服务器重试会执行两次
+        calls, result = self.call({0: socket.timeout(), 1: socket.timeout()})
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(result, socket.timeout)
+
+    def test_no_retry_for_admin_commands(self):
+        calls, result = self.call({0: ConnectionRefusedError(), 1: ConnectionRefusedError()}, retry=False)
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(result, ConnectionRefusedError)
+
+    def test_outstanding_released(self):
+        self.call({0: socket.timeout(), 1: socket.timeout()})
+        self.assertEqual([b.outstanding for b in self.pool.backends], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
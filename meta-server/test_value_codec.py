@@ -0,0 +1,55 @@
+"""
+值编码的测试
+运行：cd meta-server && python3 -m pytest -q（或 python3 -m unittest）
+"""
+import json
+import os
+import unittest
+
+from value_codec import MARKER, decode_value, encode_value
+
+
+class ValueCodecTest(unittest.TestCase):
+    def test_plain_string_unchanged(self):
+        self.assertEqual(encode_value("hello"), "hello")
+        self.assertEqual(decode_value("hello"), "hello")
+
+    def test_binary_round_trip(self):
+        data = bytes(range(256))
+        stored = encode_value(data)
+        self.assertTrue(stored.startswith(MARKER + "b:"))
+        self.assertEqual(decode_value(stored), data)
+
+    def test_marker_string_is_escaped(self):
+        value = MARKER + "s:raw:AAAA"
+        stored = encode_value(value)
+        self.assertNotEqual(stored, value)
+        self.assertEqual(decode_value(stored), value)
+
+    def test_large_values_compressed(self):
+        doc = json.dumps([{"id": i, "name": f"user-{i}", "tags": ["a", "b"]} for i in range(200)])
+        for codec in ('zlib', 'lzma', 'bz2'):
+            stored = encode_value(doc, codec)
+            self.assertTrue(stored.startswith(f"{MARKER}s:{codec}:"))
+            self.assertLess(len(stored), len(doc))
+            self.assertEqual(decode_value(stored), doc)
+
+    def test_incompressible_value_not_compressed(self):
+        data = os.urandom(4096)
+        self.assertTrue(encode_value(data).startswith(MARKER + "b:raw:"))
+
+    def test_below_threshold_not_compressed(self):
+        self.assertEqual(encode_value("x" * 100, threshold=1024), "x" * 100)
+
+    def test_documented_examples(self):
+        # api.md 中的示例
+        self.assertEqual(decode_value("~v1:b:raw:AAEC"), b"\x00\x01\x02")
+        self.assertEqual(decode_value("~v1:s:zlib:eJzLSM3JyQcABiwCFQ=="), "hello")
+
+    def test_invalid_envelope_returned_as_is(self):
+        for stored in (MARKER + "s:zstd:AAAA", MARKER + "broken", MARKER + "s:zlib:!!!"):
+            self.assertEqual(decode_value(stored), stored)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+值编码：在节点服务器与 kv-store 之间传输和存储的值
+kv-store 只保存字符串，二进制值和压缩后的值以带标记的 base64 信封形式保存：
+
+    ~v1:<类型>:<编码>:<base64 数据>
+
+类型 s 表示原值为字符串，b 表示原值为二进制；编码为 raw/zlib/lzma/bz2
+不带标记的字符串按原样保存，与已有数据兼容
+"""
+
+import base64
+import bz2
+import lzma
+import zlib
+
+MARKER = "~v1:"
+
+CODECS = {
+    'raw': (lambda data: data, lambda data: data),
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+}
+
+
+def encode_value(value, codec='zlib', threshold=1024):
+    """
+    编码一个值（str 或 bytes）为可写入 kv-store 的字符串
+    超过 threshold 字节时尝试用 codec 压缩，只有压缩后确实变小才采用
+    """
+    if isinstance(value, str):
+        kind, data = 's', value.encode('utf-8')
+        plain = not value.startswith(MARKER)
+    else:
+        kind, data = 'b', bytes(value)
+        plain = False
+
+    if codec != 'raw' and len(data) > threshold:
+        compressed = _envelope(kind, codec, CODECS[codec][0](data))
+        if len(compressed) < len(data):
+            return compressed
+
+    if plain:
+        return value
+    return _envelope(kind, 'raw', data)
+
+
+def decode_value(stored):
+    """解码 kv-store 中保存的字符串，返回 str 或 bytes"""
+    if not isinstance(stored, str) or not stored.startswith(MARKER):
+        return stored
+    try:
+        kind, codec, payload = stored[len(MARKER):].split(':', 2)
+        data = CODECS[codec][1](base64.b64decode(payload))
+    except (ValueError, KeyError, zlib.error, lzma.LZMAError, OSError):
+        # 不是合法的信封，按普通字符串返回
+        return stored
+    return data.decode('utf-8') if kind == 's' else data
+
+
+def _envelope(kind, codec, data):
+    return f"{MARKER}{kind}:{codec}:{base64.b64encode(data).decode('ascii')}"